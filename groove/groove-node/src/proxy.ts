@@ -4,7 +4,7 @@ import { stat } from 'fs/promises';
 import { readFileSync } from 'fs';
 import { join } from 'path';
 import { fetchWithTimeout, sleep, streamToBuffer } from './utilities';
-import { TapeSession } from './tape';
+import { TAPE_BINARY_CONTENT_TYPE, TapeSession } from './tape';
 import { homedir } from 'os';
 import FormData from 'form-data';
 import { DialerDefinition } from './dialer';
@@ -20,6 +20,12 @@ export interface GrooveConfiguration {
     commandTimeout?: number;
     port?: number;
     controlPort?: number;
+    // If provided, also serve the proxy over TLS (HTTP/2) on this port
+    tlsPort?: number;
+    // Number of SO_REUSEPORT accept loops to run for the proxy port
+    proxyListeners?: number;
+    // Minimum level the proxy logs at: debug | info | warn | error | quiet
+    logLevel?: string;
     authUsername?: string;
     authPassword?: string;
 }
@@ -49,10 +55,14 @@ export class Groove {
     commandTimeout: number
     port: number
     controlPort: number
+    tlsPort: number | null
+    proxyListeners: number | null
+    logLevel: string | null
     authUsername: string | null
     authPassword: string | null
 
     baseUrlProxy: string;
+    baseUrlProxyTls: string | null;
     baseUrlControl: string;
 
     certificate: Buffer;
@@ -70,10 +80,14 @@ export class Groove {
         this.commandTimeout = config.commandTimeout || 5000;
         this.port = config.port || 6010;
         this.controlPort = config.controlPort || 6011;
+        this.tlsPort = config.tlsPort || null;
+        this.proxyListeners = config.proxyListeners || null;
+        this.logLevel = config.logLevel || null;
         this.authUsername = config.authUsername || null;
         this.authPassword = config.authPassword || null;
 
         this.baseUrlProxy = `http://localhost:${this.port}`
+        this.baseUrlProxyTls = this.tlsPort ? `https://localhost:${this.tlsPort}` : null
         this.baseUrlControl = `http://localhost:${this.controlPort}`
 
         this.certificate = readFileSync(join(homedir(), '.grooveproxy/ca.crt'));
@@ -90,6 +104,9 @@ export class Groove {
         const parameters = {
             "--port": this.port ? this.port.toString() : null,
             "--control-port": this.controlPort ? this.controlPort.toString() : null,
+            "--tls-port": this.tlsPort ? this.tlsPort.toString() : null,
+            "--listeners": this.proxyListeners ? this.proxyListeners.toString() : null,
+            "--log-level": this.logLevel,
             "--auth-username": this.authUsername,
             "--auth-password": this.authPassword,
         }
@@ -139,12 +156,18 @@ export class Groove {
         this.process = null;
     }
 
-    async tapeStart() {
+    async tapeStart(tapeID?: string) {
+        // With a tape ID, other tapes keep recording or replaying
+        tapeID = tapeID || "";
+
         const response = await fetchWithTimeout(
             `${this.baseUrlControl}/api/tape/record`,
             {
                 method: "POST",
                 timeout: this.commandTimeout,
+                body: JSON.stringify({
+                    tapeID,
+                }),
             }
         )
         await checkStatus(response, "Failed to start recording.");
@@ -158,6 +181,8 @@ export class Groove {
             {
                 method: "POST",
                 timeout: this.commandTimeout,
+                // Raw bodies instead of base64, readFromServer handles either format
+                headers: { "Accept": TAPE_BINARY_CONTENT_TYPE },
                 body: JSON.stringify({
                     tapeID,
                 }),
@@ -169,13 +194,14 @@ export class Groove {
         return session;
     }
 
-    async tapeLoad(session: TapeSession) {
+    async tapeLoad(session: TapeSession, tapeID?: string) {
         const formData = new FormData();
         // Filename is irrelevant but required to upload payload buffer as file
-        formData.append("file", session.toServer(), { filename : 'tape.json.gzip' });
+        formData.append("file", session.toServer(true), { filename : 'tape.gzip' });
 
+        const query = tapeID ? `?tapeID=${encodeURIComponent(tapeID)}` : "";
         const response = await fetchWithTimeout(
-            `${this.baseUrlControl}/api/tape/load`,
+            `${this.baseUrlControl}/api/tape/load${query}`,
             {
                 method: "POST",
                 timeout: this.commandTimeout,
@@ -185,12 +211,17 @@ export class Groove {
         await checkStatus(response, "Failed to load tape.");
     }
 
-    async tapeStop() {
+    async tapeStop(tapeID?: string) {
+        tapeID = tapeID || "";
+
         const response = await fetchWithTimeout(
             `${this.baseUrlControl}/api/tape/stop`,
             {
                 method: "POST",
                 timeout: this.commandTimeout,
+                body: JSON.stringify({
+                    tapeID,
+                }),
             }
         )
         await checkStatus(response, "Failed to stop recording.");
@@ -211,6 +242,45 @@ export class Groove {
         await checkStatus(response, "Failed to clear tape.");
     }
 
+    async setReplayMode(mode: number) {
+        // 0 plays each record once, 1 (first match) and 2 (round-robin) replay without consuming
+        const response = await fetchWithTimeout(
+            `${this.baseUrlControl}/api/tape/replay_mode`,
+            {
+                method: "POST",
+                timeout: this.commandTimeout,
+                body: JSON.stringify({ mode }),
+            }
+        )
+        await checkStatus(response, "Failed to set replay mode.");
+    }
+
+    async setReplayMatch(ignoreParams: string[] = [], method: boolean = false, body: boolean = false) {
+        // Which parts of a request select the replayed record, the exact URL by default
+        const response = await fetchWithTimeout(
+            `${this.baseUrlControl}/api/tape/replay_match`,
+            {
+                method: "POST",
+                timeout: this.commandTimeout,
+                body: JSON.stringify({ ignoreParams, method, body }),
+            }
+        )
+        await checkStatus(response, "Failed to set replay matching.");
+    }
+
+    async setReplayTiming(scale: number = 1) {
+        // Multiplier for recorded network timings during replay, 0 replays as fast as possible
+        const response = await fetchWithTimeout(
+            `${this.baseUrlControl}/api/tape/replay_timing`,
+            {
+                method: "POST",
+                timeout: this.commandTimeout,
+                body: JSON.stringify({ scale }),
+            }
+        )
+        await checkStatus(response, "Failed to set replay timing.");
+    }
+
     async setCacheMode(mode: number) {
         const response = await fetchWithTimeout(
             `${this.baseUrlControl}/api/cache/mode`,
@@ -260,6 +330,18 @@ export class Groove {
         await checkStatus(response, "Failed to start end-proxy.")
     }
 
+    async bypassLoad(hostPatterns: string[]) {
+        const response = await fetchWithTimeout(
+            `${this.baseUrlControl}/api/bypass/load`,
+            {
+                method: "POST",
+                timeout: this.commandTimeout,
+                body: JSON.stringify({ hostPatterns }),
+            }
+        )
+        await checkStatus(response, "Failed to load bypass rules.");
+    }
+
     async endProxyStop() {
         const response = await fetchWithTimeout(
             `${this.baseUrlControl}/api/proxy/stop`,
@@ -1,5 +1,19 @@
+import { createHash } from "crypto";
 import { gunzipSync, gzipSync } from "zlib";
 
+// Binary tapes are requested with this Accept header, see tape_format.go
+export const TAPE_BINARY_CONTENT_TYPE = "application/x-groove-tape";
+
+// Start of an uncompressed binary tape, the last byte is the format version
+const TAPE_BINARY_MAGIC = Buffer.from("GRVT\x02", "latin1");
+
+// Version 1 tapes have no body references and are still read
+const TAPE_BINARY_MAGIC_V1 = Buffer.from("GRVT\x01", "latin1");
+
+// Added to the length of a body frame that refers to an earlier body instead, the remainder
+// is the body's index in the order bodies first appeared on the tape
+const TAPE_BODY_REFERENCE = 0x80000000;
+
 
 export interface TapeRequest {
     url: string
@@ -29,6 +43,12 @@ export class TapeSession {
     async readFromServer(contents: Buffer) {
         // un-gzip and un-json the blob
         const uncompressed = gunzipSync(contents);
+        const magic = uncompressed.subarray(0, TAPE_BINARY_MAGIC.length);
+        if (magic.equals(TAPE_BINARY_MAGIC) || magic.equals(TAPE_BINARY_MAGIC_V1)) {
+            this.records = decodeBinaryRecords(uncompressed);
+            return;
+        }
+
         const jsonPayload = JSON.parse(uncompressed.toString());
 
         // Un-base64 the bodies
@@ -47,7 +67,12 @@ export class TapeSession {
         });
     }
 
-    toServer() : Buffer {
+    toServer(binary: boolean = false) : Buffer {
+        // Binary tapes keep the bodies raw, only groove itself reads them
+        if (binary) {
+            return gzipSync(encodeBinaryRecords(this.records));
+        }
+
         // Base64 the bodies
         const jsonPayload = this.records.map((record) => {
             return {
@@ -68,3 +93,93 @@ export class TapeSession {
         return compressed;
     }
 }
+
+const encodeBinaryRecords = (records: TapeRecord[]) : Buffer => {
+    // Each record is three length-prefixed frames: its JSON without the bodies, then the raw
+    // request body and the raw response body. Repeated bodies are only written once, later
+    // frames just refer back to them.
+    const chunks = [TAPE_BINARY_MAGIC];
+    const writtenBodies = new Map<string, number>();
+
+    const pushLength = (length: number) => {
+        const header = Buffer.alloc(4);
+        header.writeUInt32BE(length);
+        chunks.push(header);
+    }
+
+    for (const record of records) {
+        const metadata = Buffer.from(JSON.stringify({
+            ...record,
+            request: { ...record.request, body: undefined },
+            response: { ...record.response, body: undefined },
+        }));
+        pushLength(metadata.length);
+        chunks.push(metadata);
+
+        for (const body of [record.request.body, record.response.body]) {
+            if (body.length === 0) {
+                pushLength(0);
+                continue;
+            }
+            const key = createHash("sha256").update(body).digest("hex");
+            const index = writtenBodies.get(key);
+            if (index !== undefined) {
+                pushLength(TAPE_BODY_REFERENCE + index);
+                continue;
+            }
+            // Larger lengths would read back as references
+            if (body.length >= TAPE_BODY_REFERENCE || writtenBodies.size >= TAPE_BODY_REFERENCE) {
+                throw new Error(`Body of ${body.length} bytes doesn't fit in a tape`);
+            }
+            writtenBodies.set(key, writtenBodies.size);
+            pushLength(body.length);
+            chunks.push(body);
+        }
+    }
+    return Buffer.concat(chunks);
+}
+
+const decodeBinaryRecords = (payload: Buffer) : TapeRecord[] => {
+    const records: TapeRecord[] = [];
+    // Non-empty bodies in the order they first appeared, for frames that refer back to them
+    const bodies: Buffer[] = [];
+    let offset = TAPE_BINARY_MAGIC.length;
+
+    const readLength = () => {
+        if (offset + 4 > payload.length) throw new Error("Tape is truncated");
+        const length = payload.readUInt32BE(offset);
+        offset += 4;
+        return length;
+    }
+
+    const readFrame = (length: number) => {
+        const start = offset;
+        offset = start + length;
+        if (offset > payload.length) throw new Error("Tape is truncated");
+        return payload.subarray(start, offset);
+    }
+
+    const readBody = () => {
+        const length = readLength();
+        if (length >= TAPE_BODY_REFERENCE) {
+            const body = bodies[length - TAPE_BODY_REFERENCE];
+            if (body === undefined) throw new Error(`Tape refers to missing body ${length - TAPE_BODY_REFERENCE}`);
+            return body;
+        }
+        const body = readFrame(length);
+        if (body.length > 0) bodies.push(body);
+        return body;
+    }
+
+    while (offset < payload.length) {
+        const metadata = JSON.parse(readFrame(readLength()).toString());
+        const requestBody = readBody();
+        const responseBody = readBody();
+        records.push({
+            ...metadata,
+            request: { ...metadata.request, body: requestBody },
+            response: { ...metadata.response, body: responseBody },
+        });
+    }
+    return records;
+}
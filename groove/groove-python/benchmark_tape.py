@@ -0,0 +1,95 @@
+"""
+Benchmark building and serializing large tapes in the client
+
+Compares TapeSession.from_server / to_server with the validated pydantic round trip they
+replaced, on a synthetic tape.
+
+"""
+from base64 import b64encode
+from gzip import compress, decompress
+from json import dumps, loads
+from os import urandom
+from time import perf_counter
+
+from click import command, option, secho
+
+from groove.tape import TapeRecord, TapeRequest, TapeResponse, TapeSession
+
+
+def validated_from_server(data: bytes) -> TapeSession:
+    return TapeSession(records=loads(decompress(data)))
+
+
+def validated_to_server(session: TapeSession) -> bytes:
+    return compress(
+        dumps([
+            loads(record.json(by_alias=True, exclude_none=True))
+            for record in session.records
+        ]).encode()
+    )
+
+
+def page_body(index: int, size: int) -> bytes:
+    # Markup compresses like real pages, with a random token so bodies aren't identical
+    token = urandom(8).hex()
+    markup = f"<div class='item-{index}' data-token='{token}'>groove</div>".encode()
+    return (markup * (size // len(markup) + 1))[:size]
+
+
+def timed(label: str, func, repeat: int):
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = func()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    secho(f"{label}: {best:.3f}s")
+    return result, best
+
+
+@command()
+@option("--records", default=50000, help="Number of records on the tape")
+@option("--body-size", default=512, help="Size of each response body in bytes")
+@option("--repeat", default=3, help="Report the best of this many runs")
+def benchmark(records, body_size, repeat):
+    session = TapeSession(
+        records=[
+            TapeRecord(
+                request=TapeRequest(
+                    url=f"https://example.com/{i}?cache={i}",
+                    method="GET",
+                    headers={"Accept": ["*/*"], "User-Agent": ["groove"]},
+                    body=b"",
+                ),
+                response=TapeResponse(
+                    status=200,
+                    headers={"Content-Type": ["text/html"]},
+                    body=b64encode(page_body(i, body_size)),
+                ),
+            )
+            for i in range(records)
+        ]
+    )
+
+    json_tape, slow_encode = timed("to_server (validated)", lambda: validated_to_server(session), repeat)
+    _, fast_encode = timed("to_server", lambda: session.to_server(), repeat)
+    binary_tape, _ = timed("to_server (binary)", lambda: session.to_server(binary=True), repeat)
+
+    slow_session, slow_decode = timed("from_server (validated)", lambda: validated_from_server(json_tape), repeat)
+    fast_session, fast_decode = timed("from_server", lambda: TapeSession.from_server(json_tape), repeat)
+    binary_session, _ = timed("from_server (binary)", lambda: TapeSession.from_server(binary_tape), repeat)
+    timed("from_server (gc paused)", lambda: TapeSession.from_server(json_tape, pause_gc=True), repeat)
+    timed("to_server (gc paused)", lambda: session.to_server(pause_gc=True), repeat)
+
+    # Bodies that were never read are written back without decoding them
+    timed("round trip", lambda: TapeSession.from_server(json_tape).to_server(), repeat)
+    timed("round trip (binary)", lambda: TapeSession.from_server(binary_tape).to_server(binary=True), repeat)
+
+    assert fast_session == slow_session == binary_session
+
+    secho(f"Encode speedup: {slow_encode / fast_encode:.1f}x", fg="green")
+    secho(f"Decode speedup: {slow_decode / fast_decode:.1f}x", fg="green")
+
+
+if __name__ == "__main__":
+    benchmark()
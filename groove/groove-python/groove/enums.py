@@ -7,3 +7,21 @@ class CacheModeEnum(Enum):
     STANDARD = 1
     AGGRESSIVE_GET = 2
     AGGRESSIVE = 3
+
+
+class ReplayModeEnum(Enum):
+    # Ensure enum values are aligned with the recorder.go definitions
+    CONSUME = 0
+    FIRST = 1
+    ROUND_ROBIN = 2
+
+
+class ProfileKindEnum(Enum):
+    # Profile names served by the proxy under /debug/pprof
+    CPU = "profile"
+    HEAP = "heap"
+    ALLOCS = "allocs"
+    MUTEX = "mutex"
+    BLOCK = "block"
+    GOROUTINE = "goroutine"
+    TRACE = "trace"
@@ -0,0 +1,88 @@
+from groove.models import GrooveModelBase
+
+
+class HistogramBucket(GrooveModelBase):
+    upper_bound: float
+    # Cumulative, includes every observation at or below upper_bound
+    count: int
+
+
+class Histogram(GrooveModelBase):
+    count: int
+    sum_seconds: float
+    buckets: list[HistogramBucket]
+
+    @property
+    def mean_seconds(self) -> float | None:
+        return self.sum_seconds / self.count if self.count else None
+
+
+class StageMetrics(GrooveModelBase):
+    stage: str
+    request: Histogram
+    response: Histogram
+
+
+class CacheMetrics(GrooveModelBase):
+    hits: int
+    misses: int
+    expired: int
+    coalesced_waiters: int
+    waiting: int
+
+
+class CacheTierMetrics(GrooveModelBase):
+    memory_hits: int
+    disk_hits: int
+    misses: int
+
+
+class DialerMetrics(GrooveModelBase):
+    identifier: str
+    priority: int
+    # Blank for dialers that connect directly
+    proxy: str
+    attempts: int
+    failures: int
+    latency: Histogram
+
+
+class CertificateMetrics(GrooveModelBase):
+    hits: int
+    misses: int
+
+
+class TunnelMetrics(GrooveModelBase):
+    connections: int
+    failures: int
+    bytes_sent: int
+    bytes_received: int
+
+
+class CaptureMetrics(GrooveModelBase):
+    completed: int
+    # Bodies over the capture limit, streamed to the client but not recorded or cached
+    skipped: int
+    aborted: int
+
+
+class RuntimeMetrics(GrooveModelBase):
+    goroutines: int
+    heap_alloc_bytes: int
+    heap_inuse_bytes: int
+    heap_objects: int
+    gc_cycles: int
+
+
+class ProxyMetrics(GrooveModelBase):
+    stages: list[StageMetrics]
+    cache: CacheMetrics
+    cache_tiers: CacheTierMetrics
+    dialers: list[DialerMetrics]
+    certificates: CertificateMetrics
+    tunnels: TunnelMetrics
+    captures: CaptureMetrics
+    runtime: RuntimeMetrics
+
+    def stage(self, name: str) -> StageMetrics | None:
+        return next((stage for stage in self.stages if stage.stage == name), None)
@@ -1,16 +1,21 @@
 from contextlib import contextmanager
 from enum import Enum
+from functools import partial
+from pathlib import Path
 from subprocess import Popen
 from sysconfig import get_config_var
 from time import sleep
+from typing import Iterator
 from urllib.parse import urljoin
 
 from requests import Session
 
 from groove.assets import get_asset_path
 from groove.dialer import DefaultInternetDialer, DialerDefinition
-from groove.enums import CacheModeEnum
-from groove.tape import TapeSession
+from groove.enums import CacheModeEnum, ProfileKindEnum, ReplayModeEnum
+from groove.metrics import ProxyMetrics
+from groove.tape import TAPE_BINARY_CONTENT_TYPE, TAPE_READ_CHUNK_SIZE, TapeSession
+from groove.unix_socket import UnixSocketAdapter
 
 
 class ProxyFailureError(Exception):
@@ -23,19 +28,54 @@ class Groove:
         command_timeout: int = 5,
         port: int = 6010,
         control_port: int = 6011,
+        tls_port: int | None = None,
+        control_socket: str | None = None,
+        proxy_listeners: int | None = None,
+        log_level: str | None = None,
+        profiling: bool = False,
+        capture_max_mb: int | None = None,
+        tape_dir: str | None = None,
         auth_username: str | None = None,
         auth_password: str | None = None,
     ):
+        """
+        :param tls_port: If specified, will also serve the proxy over TLS on this port. Clients
+            that connect to `base_url_proxy_tls` can multiplex their requests over HTTP/2.
+        :param control_socket: If specified, the control API is also served on this unix domain
+            socket path and all control calls are sent over it instead of TCP.
+        :param proxy_listeners: Number of SO_REUSEPORT accept loops to run for the proxy port.
+        :param log_level: Minimum level the proxy logs at: debug, info, warn, error, or quiet.
+        :param profiling: Serve pprof and execution trace endpoints on the control API and turn
+            on mutex and block contention sampling, required for `profile()`.
+        :param capture_max_mb: Largest body the proxy keeps for tapes and the cache. Larger
+            bodies still stream to the client but aren't recorded or cached.
+        :param tape_dir: If specified, recordings are written ahead to segment files in this
+            directory instead of held in memory. A restarted proxy picks the recording back up.
+
+        """
         self.session = Session()
 
         self.port = port
         self.control_port = control_port
+        self.tls_port = tls_port
+        self.control_socket = control_socket
+        self.proxy_listeners = proxy_listeners
+        self.log_level = log_level
+        self.profiling = profiling
+        self.capture_max_mb = capture_max_mb
+        self.tape_dir = tape_dir
         self.auth_username = auth_username
         self.auth_password = auth_password
 
         self.base_url_proxy = f"http://localhost:{port}"
+        self.base_url_proxy_tls = f"https://localhost:{tls_port}" if tls_port else None
         self.base_url_control = f"http://localhost:{control_port}"
 
+        if control_socket:
+            # Hostname is only used for adapter routing, the adapter always dials the socket
+            self.base_url_control = "http://groove-control"
+            self.session.mount(self.base_url_control, UnixSocketAdapter(control_socket))
+
         self.timeout = command_timeout
 
     @contextmanager
@@ -43,6 +83,13 @@ class Groove:
         parameters = {
             "--port": self.port,
             "--control-port": self.control_port,
+            "--tls-port": self.tls_port,
+            "--control-socket": self.control_socket,
+            "--listeners": self.proxy_listeners,
+            "--log-level": self.log_level,
+            "--profiling": self.profiling or None,
+            "--capture-max-mb": self.capture_max_mb,
+            "--tape-dir": self.tape_dir,
             "--auth-username": self.auth_username,
             "--auth-password": self.auth_password,
         }
@@ -56,7 +103,8 @@ class Groove:
                 *[
                     str(item)
                     for key, value in parameters.items()
-                    for item in [key, value]
+                    # Go only accepts explicit values for boolean flags in the key=value form
+                    for item in ([f"{key}={str(value).lower()}"] if isinstance(value, bool) else [key, value])
                 ]
             ]
         )
@@ -69,30 +117,195 @@ class Groove:
         finally:
             process.terminate()
 
-    def tape_start(self):
-        response = self.session.post(urljoin(self.base_url_control, "/api/tape/record"), timeout=self.timeout)
+    def tape_start(self, tape_id: str | None = None):
+        """
+        :param tape_id: Only record requests tagged with this tape ID, and only clear its previous
+            records. Other tapes keep recording or replaying, so one proxy can serve many parallel
+            sessions. Without a tape ID every tape starts recording from scratch.
+
+        """
+        response = self.session.post(
+            urljoin(self.base_url_control, "/api/tape/record"),
+            json=dict(
+                tapeID=tape_id,
+            ),
+            timeout=self.timeout,
+        )
         assert response.json()["success"] == True
 
-    def tape_get(self, tape_id: str | None = None) -> TapeSession:
+    def tape_get(
+        self,
+        tape_id: str | None = None,
+        url_pattern: str | None = None,
+        since: int | None = None,
+        cursor: int | None = None,
+        limit: int | None = None,
+        compression_level: int | None = None,
+        parallel: bool = False,
+    ) -> TapeSession:
+        """
+        :param url_pattern: Only return records whose URL matches this regex.
+        :param since: Only return records with a higher sequence number, typically the
+            `next_since` of the previous call. Lets monitors poll a long recording and only
+            transfer new records.
+        :param cursor: Skip this many matching records, typically the `next_cursor` of the
+            previous page.
+        :param limit: Return at most this many records. `next_cursor` is set on the session
+            when more remain.
+        :param compression_level: gzip level for the transfer, from -2 (huffman only) to 9.
+        :param parallel: Compress on every core of the proxy, worthwhile for large tapes.
+
+        """
         tape_response = self.session.post(
             urljoin(self.base_url_control, "/api/tape/retrieve"),
             json=dict(
                 tapeID=tape_id,
+                urlPattern=url_pattern,
+                since=since,
+                cursor=cursor,
+                limit=limit,
+                compressionLevel=compression_level,
+                parallel=parallel,
             ),
+            # Raw bodies instead of base64, from_server reads either format
+            headers={"Accept": TAPE_BINARY_CONTENT_TYPE},
             timeout=self.timeout
         )
-        return TapeSession.from_server(tape_response.content)
+        if tape_response.status_code != 200:
+            raise ProxyFailureError(f"Unable to retrieve tape: {tape_response.text}")
+
+        session = TapeSession.from_server(tape_response.content)
+        if (next_cursor := tape_response.headers.get("Tape-Next-Cursor")) is not None:
+            session.next_cursor = int(next_cursor)
+        if (next_since := tape_response.headers.get("Tape-Next-Since")) is not None:
+            session.next_since = int(next_since)
+        return session
+
+    def tape_get_to_file(
+        self,
+        path: Path | str,
+        tape_id: str | None = None,
+        url_pattern: str | None = None,
+        since: int | None = None,
+        compression_level: int | None = None,
+        parallel: bool = False,
+    ) -> Path:
+        """
+        Stream a tape straight to a gzipped file without holding it in memory. Read it back with
+        `TapeSession.iter_from_server` or replay it with `tape_load_from_file`.
+
+        Parameters are the same as for `tape_get`.
+
+        """
+        path = Path(path)
+        with self.session.post(
+            urljoin(self.base_url_control, "/api/tape/retrieve"),
+            json=dict(
+                tapeID=tape_id,
+                urlPattern=url_pattern,
+                since=since,
+                compressionLevel=compression_level,
+                parallel=parallel,
+            ),
+            headers={"Accept": TAPE_BINARY_CONTENT_TYPE},
+            stream=True,
+            timeout=self.timeout,
+        ) as tape_response:
+            if tape_response.status_code != 200:
+                raise ProxyFailureError(f"Unable to retrieve tape: {tape_response.text}")
+
+            with open(path, "wb") as file:
+                for chunk in tape_response.iter_content(TAPE_READ_CHUNK_SIZE):
+                    file.write(chunk)
+        return path
+
+    def tape_pages(
+        self,
+        page_size: int,
+        tape_id: str | None = None,
+        url_pattern: str | None = None,
+    ) -> Iterator[TapeSession]:
+        """
+        Page through a tape without holding all of it in memory at once.
 
-    def tape_load(self, session: TapeSession):
+        """
+        cursor = 0
+        while cursor is not None:
+            session = self.tape_get(tape_id, url_pattern=url_pattern, cursor=cursor, limit=page_size)
+            yield session
+            cursor = session.next_cursor
+
+    def tape_load(self, session: TapeSession, tape_id: str | None = None):
+        """
+        :param tape_id: Replay the session only for requests tagged with this tape ID. Its records
+            replace those of the same tape and other tapes are left alone.
+
+        """
         tape_response = self.session.post(
             urljoin(self.base_url_control, "/api/tape/load"),
-            files={"file": session.to_server()},
+            params=dict(
+                tapeID=tape_id,
+            ),
+            files={"file": session.to_server(binary=True)},
             timeout=self.timeout,
         )
-        assert tape_response.json()["success"] == True
+        if not tape_response.json()["success"]:
+            raise ProxyFailureError(f"Unable to load tape: {tape_response.json()['error']}")
+
+    def tape_load_from_file(self, path: Path | str, tape_id: str | None = None):
+        """
+        Upload a gzipped tape file in chunks, as written by `tape_get_to_file` or `TapeWriter`.
+        Unlike `tape_load_from_path` the proxy doesn't need access to the file.
+
+        :param tape_id: Same as for `tape_load`.
 
-    def tape_stop(self):
-        response = self.session.post(urljoin(self.base_url_control, "/api/tape/stop"), timeout=self.timeout)
+        """
+        with open(path, "rb") as file:
+            tape_response = self.session.post(
+                urljoin(self.base_url_control, "/api/tape/load"),
+                params=dict(
+                    tapeID=tape_id,
+                ),
+                # Generators are sent with chunked transfer, so the file is never read in full
+                data=iter(partial(file.read, TAPE_READ_CHUNK_SIZE), b""),
+                headers={"Content-Type": "application/x-gzip"},
+                timeout=self.timeout,
+            )
+        if not tape_response.json()["success"]:
+            raise ProxyFailureError(f"Unable to load tape: {tape_response.json()['error']}")
+
+    def tape_load_from_path(self, path: Path | str, tape_id: str | None = None):
+        """
+        Load a gzipped tape file, as written by `TapeSession.to_server`, straight from disk.
+        The proxy reads the file itself so it must be on the same host, which avoids uploading
+        large tapes over the control API.
+
+        :param tape_id: Same as for `tape_load`.
+
+        """
+        tape_response = self.session.post(
+            urljoin(self.base_url_control, "/api/tape/load_path"),
+            json=dict(
+                path=str(Path(path).resolve()),
+                tapeID=tape_id,
+            ),
+            timeout=self.timeout,
+        )
+        if not tape_response.json()["success"]:
+            raise ProxyFailureError(f"Unable to load tape: {tape_response.json()['error']}")
+
+    def tape_stop(self, tape_id: str | None = None):
+        """
+        :param tape_id: Only stop recording or replaying this tape.
+
+        """
+        response = self.session.post(
+            urljoin(self.base_url_control, "/api/tape/stop"),
+            json=dict(
+                tapeID=tape_id,
+            ),
+            timeout=self.timeout,
+        )
         assert response.json()["success"] == True
 
     def tape_clear(self, tape_id: str | None = None):
@@ -105,6 +318,67 @@ class Groove:
         )
         assert response.json()["success"] == True
 
+    def set_replay_mode(self, mode: ReplayModeEnum):
+        """
+        Choose how loaded tapes are played back. CONSUME serves each record once, FIRST and
+        ROUND_ROBIN serve records without using them up, so one tape can be replayed to any
+        number of parallel browser contexts.
+
+        """
+        response = self.session.post(
+            urljoin(self.base_url_control, "/api/tape/replay_mode"),
+            json=dict(
+                mode=mode.value,
+            ),
+            timeout=self.timeout,
+        )
+        assert response.json()["success"] == True
+
+    def set_replay_match(
+        self,
+        ignore_params: list[str] | None = None,
+        method: bool = False,
+        body: bool = False,
+    ):
+        """
+        Choose which parts of a request select the record it replays. By default only the exact
+        URL is compared. Applies to tapes that are already loaded.
+
+        :param ignore_params: Query parameters to leave out, like cache busters and timestamps.
+        :param method: Only match records with the same request method.
+        :param body: Only match records with the same request body, for GraphQL style APIs that
+            send every query to one URL.
+
+        """
+        response = self.session.post(
+            urljoin(self.base_url_control, "/api/tape/replay_match"),
+            json=dict(
+                ignoreParams=ignore_params or [],
+                method=method,
+                body=body,
+            ),
+            timeout=self.timeout,
+        )
+        assert response.json()["success"] == True
+
+    def set_replay_timing(self, scale: float = 1.0):
+        """
+        Reproduce the network timings recorded on the tape during replay. Responses are held back
+        for the recorded time to first byte and bodies stream at the recorded transfer rate.
+
+        :param scale: Multiplier for the recorded timings, 2 replays twice as slow. 0 replays as
+            fast as possible, which is the default.
+
+        """
+        response = self.session.post(
+            urljoin(self.base_url_control, "/api/tape/replay_timing"),
+            json=dict(
+                scale=scale,
+            ),
+            timeout=self.timeout,
+        )
+        assert response.json()["success"] == True
+
     def set_cache_mode(self, mode: CacheModeEnum):
         response = self.session.post(
             urljoin(self.base_url_control, "/api/cache/mode"),
@@ -137,6 +411,60 @@ class Groove:
         )
         assert response.json()["success"] == True
 
+    def bypass_load(self, host_patterns: list[str]):
+        """
+        Tunnel hosts matching any of these regex patterns directly to their destination,
+        without interception. Bypassed traffic can't be recorded or cached.
+
+        """
+        response = self.session.post(
+            urljoin(self.base_url_control, "/api/bypass/load"),
+            json=dict(
+                hostPatterns=host_patterns,
+            ),
+            timeout=self.timeout,
+        )
+        assert response.json()["success"] == True
+
+    def metrics(self) -> ProxyMetrics:
+        """
+        Snapshot of the proxy's internal counters: per-stage latency, cache and certificate
+        hit rates, dialer health, and runtime gauges.
+
+        """
+        response = self.session.get(urljoin(self.base_url_control, "/api/metrics"), timeout=self.timeout)
+        response.raise_for_status()
+        return ProxyMetrics.parse_obj(response.json())
+
+    def profile(self, seconds: int, kind: ProfileKindEnum, output_path: Path | str) -> Path:
+        """
+        Capture a profile of the running proxy and save it to `output_path`, in the binary
+        format read by `go tool pprof` (or `go tool trace` for execution traces). Requires
+        the proxy to be launched with `profiling=True`.
+
+        CPU profiles and traces sample over the next `seconds`. Heap, allocation, mutex, and
+        block profiles report the change over that window, so contention from the cache locks
+        or recorder shows up for just the workload that ran while profiling.
+
+        """
+        output_path = Path(output_path)
+
+        with self.session.get(
+            urljoin(self.base_url_control, f"/debug/pprof/{kind.value}"),
+            params=dict(seconds=seconds),
+            stream=True,
+            # The proxy holds the response open for the whole sampling window
+            timeout=seconds + self.timeout,
+        ) as response:
+            if response.status_code != 200:
+                raise ProxyFailureError(f"Unable to capture {kind.value} profile: {response.text}")
+
+            with open(output_path, "wb") as file:
+                for chunk in response.iter_content(chunk_size=64*1024):
+                    file.write(chunk)
+
+        return output_path
+
     @property
     def executable_path(self) -> str:
         # Support statically and dynamically build libraries
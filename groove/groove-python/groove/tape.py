@@ -1,13 +1,126 @@
 from base64 import b64decode, b64encode
-from gzip import compress, decompress
-from json import dumps, loads
+from codecs import getincrementaldecoder
+from contextlib import contextmanager, nullcontext
+from gc import disable as disable_gc, enable as enable_gc, isenabled as gc_isenabled
+from gzip import GzipFile, compress, decompress
+from json import JSONDecodeError, JSONDecoder, dumps, loads
+from re import compile as re_compile
+from struct import error as StructError, pack, unpack, unpack_from
+from typing import Any, BinaryIO, Iterator
 
-from pydantic import validator
+from pydantic import Field, PrivateAttr, validator
 
 from groove.models import GrooveModelBase
+from groove.tape_index import TapeIndex
 
+# Binary tapes are requested with this Accept header, see tape_format.go
+TAPE_BINARY_CONTENT_TYPE = "application/x-groove-tape"
 
-class TapeRequest(GrooveModelBase):
+# Start of an uncompressed binary tape, the last byte is the format version
+TAPE_BINARY_MAGIC = b"GRVT\x02"
+
+# Version 1 tapes have no body references and are still read
+TAPE_BINARY_MAGIC_V1 = b"GRVT\x01"
+
+# Set on the length of a body frame that refers to an earlier body instead, the remaining bits
+# are the body's index in the order bodies first appeared on the tape
+TAPE_BODY_REFERENCE = 1 << 31
+
+# gzip.DefaultCompression in Go
+TAPE_COMPRESSION_LEVEL = 6
+
+# Minimum amount of compressed or decompressed data read at once when streaming tapes
+TAPE_READ_CHUNK_SIZE = 1 << 20
+
+JSON_WHITESPACE = re_compile(r"[ \t\n\r]*")
+
+
+class TapeBody:
+    """
+    Body of a parsed tape, shared by every record of the tape with the same content
+
+    Keeps the body as it was read: the base64 string of a JSON tape, or a view into the
+    decompressed buffer of a binary tape. It's decoded once for all the records that share it.
+
+    """
+    __slots__ = ("encoded", "decoded")
+
+    def __init__(self, encoded: str | memoryview):
+        self.encoded = encoded
+        self.decoded: bytes | None = None
+
+    def decode(self) -> bytes:
+        if self.decoded is None:
+            encoded = self.encoded
+            self.decoded = b64decode(encoded) if isinstance(encoded, str) else bytes(encoded)
+        return self.decoded
+
+    def content(self) -> bytes | memoryview:
+        # Binary tapes don't need to copy the body out of the tape
+        return self.encoded if isinstance(self.encoded, memoryview) else self.decode()
+
+    def base64(self) -> str:
+        return self.encoded if isinstance(self.encoded, str) else b64encode(self.encoded).decode()
+
+    def __deepcopy__(self, memo):
+        # Never changes once decoded, and views into a binary tape can't be copied
+        return self
+
+
+class TapeMessage(GrooveModelBase):
+    """
+    Body handling shared by requests and responses
+
+    `body` is a regular field. Messages parsed from a tape also keep the TapeBody it was decoded
+    from: `body_view` and `body_content` return bodies of binary tapes without copying them out
+    of the tape, and `to_server` writes bodies that weren't replaced straight from the TapeBody
+    instead of re-encoding them.
+
+    """
+    _shared_body: TapeBody | None = PrivateAttr(default=None)
+
+    @classmethod
+    def from_server(cls, shared_body: TapeBody | None, **fields):
+        if shared_body is None:
+            return cls.construct(body=b"", **fields)
+        message = cls.construct(body=shared_body.decode(), **fields)
+        message._shared_body = shared_body
+        return message
+
+    @property
+    def body_view(self) -> memoryview:
+        """
+        Read-only view of the body. Bodies of binary tapes aren't copied out of the tape, so
+        the view keeps the whole decompressed tape alive.
+
+        """
+        return memoryview(self.body_content())
+
+    def body_content(self) -> bytes | memoryview:
+        """
+        The body as bytes or as a view into a binary tape. Records that share a body return
+        the same object, which only computes its hash once when bodies are deduplicated.
+
+        """
+        shared_body = self.source_body()
+        return shared_body.content() if shared_body is not None else self.body
+
+    def body_base64(self) -> str:
+        shared_body = self.source_body()
+        return shared_body.base64() if shared_body is not None else b64encode(self.body).decode()
+
+    def source_body(self) -> TapeBody | None:
+        """
+        The TapeBody this message was parsed from, or None once `body` has been replaced.
+
+        """
+        shared_body = self._shared_body
+        if shared_body is not None and self.body is shared_body.decoded:
+            return shared_body
+        return None
+
+
+class TapeRequest(TapeMessage):
     url: str
     method: str
     headers: dict[str, list[str]]
@@ -18,7 +131,7 @@ class TapeRequest(GrooveModelBase):
         return b64decode(value)
 
 
-class TapeResponse(GrooveModelBase):
+class TapeResponse(TapeMessage):
     status: int
     headers: dict[str, list[str]]
     body: bytes
@@ -28,10 +141,49 @@ class TapeResponse(GrooveModelBase):
         return b64decode(value)
 
 
+class TapeTiming(GrooveModelBase):
+    """
+    Breakdown of where the proxy spent time on a recorded request, in milliseconds
+
+    """
+    cache_lookup_ms: float
+    lock_wait_ms: float
+    dial_ms: float
+    tls_ms: float
+    ttfb_ms: float
+    transfer_ms: float
+    connection_reused: bool
+
+    @property
+    def total_ms(self) -> float:
+        return (
+            self.cache_lookup_ms
+            + self.lock_wait_ms
+            + self.dial_ms
+            + self.tls_ms
+            + self.ttfb_ms
+            + self.transfer_ms
+        )
+
+
 class TapeRecord(GrooveModelBase):
     request: TapeRequest
     response: TapeResponse
 
+    # Tape the request was tagged with, the proxy's field isn't camel cased
+    tape_id: str | None = Field(None, alias="tape_id")
+
+    # Assigned by the proxy, increases with every record it adds
+    sequence: int | None = None
+
+    # Only set for records the proxy captured itself, and only on the final hop of a redirect
+    timing: TapeTiming | None = None
+
+    @validator("tape_id")
+    def validate_tape_id(cls, value):
+        # Go writes an empty string for untagged records
+        return value or None
+
     class Config:
         json_encoders = {
             # Assume that body bytes should always be encoded as base64 strings
@@ -42,17 +194,466 @@ class TapeRecord(GrooveModelBase):
 class TapeSession(GrooveModelBase):
     records: list[TapeRecord]
 
+    # Cursor for the next page when the proxy returned a partial export
+    next_cursor: int | None = None
+
+    # Pass as `since` to only retrieve records added after this session
+    next_since: int | None = None
+
+    _index: TapeIndex | None = PrivateAttr(default=None)
+
+    @classmethod
+    def from_server(cls, data: bytes, pause_gc: bool = False):
+        """
+        Parse a gzipped tape in either the JSON or the binary format.
+
+        Tapes come from the proxy or from `to_server`, so records are built without running
+        validation. Validating every record and base64 body takes tens of seconds on large tapes.
+        Records with the same body share it and it's decoded once, see TapeBody.
+
+        :param pause_gc: Disable the garbage collector while parsing, see `paused_gc`.
+
+        """
+        payload = decompress(data)
+        with paused_gc() if pause_gc else nullcontext():
+            if payload.startswith((TAPE_BINARY_MAGIC, TAPE_BINARY_MAGIC_V1)):
+                records = decode_binary_records(payload)
+            else:
+                bodies = TapeBodies()
+                records = [
+                    record_from_server(
+                        raw_record,
+                        bodies.share(raw_record["request"]["body"]),
+                        bodies.share(raw_record["response"]["body"]),
+                    )
+                    for raw_record in loads(payload)
+                ]
+        return cls.construct(records=records)
+
+    def to_server(self, binary: bool = False, pause_gc: bool = False) -> bytes:
+        """
+        :param binary: Write the binary format, which keeps bodies as raw bytes instead of
+            base64 and only writes repeated bodies once. Smaller and faster to encode, but only
+            readable by groove itself.
+        :param pause_gc: Disable the garbage collector while encoding, see `paused_gc`.
+
+        """
+        with paused_gc() if pause_gc else nullcontext():
+            if binary:
+                payload = encode_binary_records(self.records)
+            else:
+                payload = dumps([json_record(record) for record in self.records]).encode()
+
+        # Same level as the proxy's exports, the default of 9 is several times slower for
+        # marginally smaller tapes
+        return compress(payload, compresslevel=TAPE_COMPRESSION_LEVEL)
+
+    def select(self, **filters: Any) -> list[TapeRecord]:
+        """
+        Records that match every filter, in tape order. Filters are the fields of
+        TAPE_INDEX_FIELDS set to a value, a compiled regex or a `glob`:
+
+            session.select(host="cdn.example.com", url=glob("*.js"), status=200)
+
+        Each field is indexed the first time it's used, so later lookups don't scan the tape.
+        Indexes are rebuilt once records are added or removed, call `reindex` after editing
+        the indexed fields of records in place.
+
+        """
+        index = self.current_index()
+        return [self.records[position] for position in index.select(filters)]
+
+    def group_by(self, field: str, **filters: Any) -> dict[Any, list[TapeRecord]]:
+        """
+        Records that match the filters, grouped by the value of an indexed field.
+
+        """
+        index = self.current_index()
+        selected = set(index.select(filters)) if filters else None
+
+        groups = {}
+        for value, positions in index.field(field).items():
+            records = [
+                self.records[position]
+                for position in positions
+                if selected is None or position in selected
+            ]
+            if records:
+                groups[value] = records
+        return groups
+
+    def replace_bodies(self, body: bytes, **filters: Any) -> int:
+        """
+        Replace the response body of every record that matches the filters of `select`.
+
+        :return: Number of replaced bodies.
+
+        """
+        records = self.select(**filters)
+        for record in records:
+            record.response.body = body
+        return len(records)
+
+    def reindex(self):
+        self._index = None
+
+    def current_index(self) -> TapeIndex:
+        if self._index is None or not self._index.is_current(self.records):
+            self._index = TapeIndex(self.records)
+        return self._index
+
     @classmethod
-    def from_server(cls, data: bytes):
-        raw_records = loads(decompress(data))
-        return cls(records=raw_records)
-
-    def to_server(self) -> bytes:
-        return compress(
-            dumps([
-                # json_encoders doesn't operate on list items, must iterate manually
-                # https://github.com/pydantic/pydantic/issues/4085
-                loads(record.json())
-                for record in self.records
-            ]).encode()
-        )
\ No newline at end of file
+    def iter_from_server(cls, stream: BinaryIO) -> Iterator[TapeRecord]:
+        """
+        Read records from a gzipped tape one at a time, for tapes that don't fit in memory.
+        Accepts both formats, like `from_server`. Binary tapes keep every distinct body that was
+        read so far, since later records can refer back to it.
+
+        """
+        with GzipFile(fileobj=stream, mode="rb") as payload:
+            prefix = payload.read(len(TAPE_BINARY_MAGIC))
+            if prefix in (TAPE_BINARY_MAGIC, TAPE_BINARY_MAGIC_V1):
+                yield from iter_binary_records(payload)
+            else:
+                # Not shared, which would keep every body alive
+                for raw_record in iter_json_records(payload, prefix):
+                    yield record_from_server(
+                        raw_record,
+                        new_body(raw_record["request"]["body"]),
+                        new_body(raw_record["response"]["body"]),
+                    )
+
+
+class TapeWriter:
+    """
+    Write records to a gzipped tape one at a time, the streaming counterpart of
+    `TapeSession.to_server`. Only closing the writer makes the tape complete.
+
+    """
+    def __init__(self, stream: BinaryIO, binary: bool = False):
+        self.binary = binary
+        self.count = 0
+        # Index of every body written so far, by content
+        self.written_bodies = {}
+        # Leaves `stream` open when closed
+        self.payload = GzipFile(fileobj=stream, mode="wb", compresslevel=TAPE_COMPRESSION_LEVEL)
+
+    def write(self, record: TapeRecord):
+        if self.binary:
+            if self.count == 0:
+                self.payload.write(TAPE_BINARY_MAGIC)
+            for frame in binary_frames(record, self.written_bodies):
+                self.payload.write(frame)
+        else:
+            self.payload.write(b"," if self.count else b"[")
+            self.payload.write(dumps(json_record(record)).encode())
+        self.count += 1
+
+    def close(self):
+        if self.binary:
+            if self.count == 0:
+                self.payload.write(TAPE_BINARY_MAGIC)
+        else:
+            self.payload.write(b"]" if self.count else b"[]")
+        self.payload.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def new_body(encoded: str | memoryview | None) -> TapeBody | None:
+    # Go encodes a missing body as null
+    return TapeBody(encoded) if encoded else None
+
+
+class TapeBodies:
+    """
+    Distinct bodies of a tape that's being read, keyed by content
+
+    Binary tapes number their bodies in the order they first appear, empty bodies aren't
+    numbered. Later records refer back to a body by its number instead of repeating it.
+
+    """
+    def __init__(self):
+        self.by_content: dict[str | memoryview, TapeBody] = {}
+        self.numbered: list[TapeBody] = []
+
+    def share(self, encoded: str | memoryview | None) -> TapeBody | None:
+        body = self.by_content.get(encoded) if encoded else None
+        if body is None and (body := new_body(encoded)) is not None:
+            self.by_content[encoded] = body
+        return body
+
+    def frame(self, length: int, read_body) -> TapeBody | None:
+        """
+        :param length: Length field of a binary body frame.
+        :param read_body: Reads the body of an inline frame, which has `length` bytes.
+
+        """
+        if length & TAPE_BODY_REFERENCE:
+            number = length & ~TAPE_BODY_REFERENCE
+            if number >= len(self.numbered):
+                raise ValueError(f"Tape refers to missing body {number}")
+            return self.numbered[number]
+
+        body = self.share(read_body())
+        if body is not None:
+            self.numbered.append(body)
+        return body
+
+
+@contextmanager
+def paused_gc():
+    """
+    Building a large tape allocates millions of objects that all stay referenced, so the
+    collections this triggers are pure overhead. They take most of the time otherwise.
+
+    Only used when callers opt in: the collector is off for every thread of the process while
+    paused, and cycles created meanwhile are only collected afterwards.
+
+    """
+    enabled = gc_isenabled()
+    disable_gc()
+    try:
+        yield
+    finally:
+        if enabled:
+            enable_gc()
+
+
+def record_from_server(
+    raw_record: dict,
+    request_body: TapeBody | None,
+    response_body: TapeBody | None,
+) -> TapeRecord:
+    """
+    Build a record from trusted tape data, skipping pydantic validation. Bodies are passed
+    still encoded, `None` for empty bodies.
+
+    """
+    request = raw_record["request"]
+    response = raw_record["response"]
+    timing = raw_record.get("timing")
+
+    return TapeRecord.construct(
+        request=TapeRequest.from_server(
+            request_body,
+            url=request["url"],
+            method=request["method"],
+            headers=request["headers"] or {},
+        ),
+        response=TapeResponse.from_server(
+            response_body,
+            status=response["status"],
+            headers=response["headers"] or {},
+        ),
+        # Go writes an empty string for untagged records
+        tape_id=raw_record.get("tape_id") or None,
+        sequence=raw_record.get("sequence"),
+        timing=TapeTiming.construct(**{
+            # construct() accepts aliases but also keeps them around as extra attributes
+            name: timing[field.alias]
+            for name, field in TapeTiming.__fields__.items()
+            if field.alias in timing
+        }) if timing else None,
+    )
+
+
+def record_metadata(record: TapeRecord) -> dict:
+    """
+    Server representation of a record without its bodies, built directly instead of through
+    `record.json()`. Keep in sync with the fields of TapeRecord.
+
+    """
+    raw_record = {
+        "request": {
+            "url": record.request.url,
+            "method": record.request.method,
+            "headers": record.request.headers,
+        },
+        "response": {
+            "status": record.response.status,
+            "headers": record.response.headers,
+        },
+    }
+    if record.tape_id is not None:
+        raw_record["tape_id"] = record.tape_id
+    if record.sequence is not None:
+        raw_record["sequence"] = record.sequence
+    if record.timing is not None:
+        raw_record["timing"] = record.timing.dict(by_alias=True)
+    return raw_record
+
+
+def json_record(record: TapeRecord) -> dict:
+    raw_record = record_metadata(record)
+    raw_record["request"]["body"] = record.request.body_base64()
+    raw_record["response"]["body"] = record.response.body_base64()
+    return raw_record
+
+
+def binary_frames(record: TapeRecord, written_bodies: dict) -> list[bytes | memoryview]:
+    """
+    Each record is three length-prefixed frames: its JSON without the bodies, then the raw
+    request body and the raw response body.
+
+    A body that's already in `written_bodies` is only a length field with TAPE_BODY_REFERENCE
+    set, see TapeBodies. New bodies are added to it.
+
+    """
+    metadata = dumps(record_metadata(record)).encode()
+    chunks = [pack(">I", len(metadata)), metadata]
+
+    for message in (record.request, record.response):
+        body = message.body_content()
+        if not body:
+            chunks.append(pack(">I", 0))
+        elif (number := written_bodies.get(body)) is not None:
+            chunks.append(pack(">I", TAPE_BODY_REFERENCE | number))
+        else:
+            # Larger lengths would read back as references
+            if len(body) >= TAPE_BODY_REFERENCE or len(written_bodies) >= TAPE_BODY_REFERENCE:
+                raise ValueError(f"Body of {len(body)} bytes doesn't fit in a tape")
+            written_bodies[body] = len(written_bodies)
+            chunks.append(pack(">I", len(body)))
+            chunks.append(body)
+    return chunks
+
+
+def encode_binary_records(records: list[TapeRecord]) -> bytes:
+    chunks = [TAPE_BINARY_MAGIC]
+    written_bodies = {}
+    for record in records:
+        chunks.extend(binary_frames(record, written_bodies))
+    return b"".join(chunks)
+
+
+def decode_binary_records(payload: bytes) -> list[TapeRecord]:
+    """
+    Frames are sliced as views so every body shares the one decompressed payload.
+
+    """
+    records = []
+    bodies = TapeBodies()
+    offset = len(TAPE_BINARY_MAGIC)
+    view = memoryview(payload)
+
+    def read_length():
+        nonlocal offset
+        try:
+            (length,) = unpack_from(">I", payload, offset)
+        except StructError:
+            raise ValueError("Tape is truncated")
+        offset += 4
+        return length
+
+    def read_frame(length):
+        nonlocal offset
+        start = offset
+        offset = start + length
+        if offset > len(payload):
+            raise ValueError("Tape is truncated")
+        return view[start:offset]
+
+    def read_body():
+        length = read_length()
+        return bodies.frame(length, lambda: read_frame(length))
+
+    while offset < len(payload):
+        metadata = loads(bytes(read_frame(read_length())))
+        request_body = read_body()
+        response_body = read_body()
+        records.append(record_from_server(metadata, request_body, response_body))
+
+    return records
+
+
+def iter_binary_records(payload: BinaryIO) -> Iterator[TapeRecord]:
+    """
+    Read the frames of a binary tape after its magic header, see `binary_frames`.
+
+    """
+    bodies = TapeBodies()
+
+    def read_length():
+        header = payload.read(4)
+        if not header:
+            return None
+        if len(header) < 4:
+            raise ValueError("Tape is truncated")
+        return unpack(">I", header)[0]
+
+    def read_frame(length):
+        frame = payload.read(length)
+        if len(frame) < length:
+            raise ValueError("Tape is truncated")
+        return memoryview(frame)
+
+    def read_body():
+        length = read_length()
+        if length is None:
+            raise ValueError("Tape is truncated")
+        return bodies.frame(length, lambda: read_frame(length))
+
+    while (length := read_length()) is not None:
+        metadata = loads(bytes(read_frame(length)))
+        request_body = read_body()
+        response_body = read_body()
+        yield record_from_server(metadata, request_body, response_body)
+
+
+def iter_json_records(payload: BinaryIO, prefix: bytes = b"") -> Iterator[dict]:
+    """
+    Parse a JSON array of records as it's read. A record that's still incomplete is parsed
+    again once more data arrived, and each read is at least as large as the pending data so
+    very large records stay linear.
+
+    """
+    decoder = JSONDecoder()
+    decode_text = getincrementaldecoder("utf-8")().decode
+    buffer = decode_text(prefix)
+    position = 0
+    finished = False
+
+    def read_more():
+        nonlocal buffer, position, finished
+        chunk = payload.read(max(TAPE_READ_CHUNK_SIZE, len(buffer) - position))
+        finished = not chunk
+        buffer = buffer[position:] + decode_text(chunk, final=finished)
+        position = 0
+
+    def next_character():
+        # Skips whitespace, empty once the tape ends
+        nonlocal position
+        while True:
+            position = JSON_WHITESPACE.match(buffer, position).end()
+            if position < len(buffer) or finished:
+                return buffer[position:position + 1]
+            read_more()
+
+    if next_character() != "[":
+        raise ValueError("Tape should be a JSON array of records")
+    position += 1
+    if next_character() == "]":
+        return
+
+    while True:
+        next_character()
+        try:
+            raw_record, position = decoder.raw_decode(buffer, position)
+        except JSONDecodeError as error:
+            if finished:
+                raise ValueError(f"Tape is truncated or invalid: {error}")
+            read_more()
+            continue
+        yield raw_record
+
+        separator = next_character()
+        position += 1
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError("Tape is truncated or invalid")
@@ -0,0 +1,85 @@
+from fnmatch import translate
+from re import Pattern, compile as re_compile
+from typing import Any, Callable
+from urllib.parse import urlsplit
+
+
+def glob(pattern: str) -> Pattern:
+    """
+    Filter with shell-style wildcards instead of a regex, matched against the whole value.
+
+    """
+    return re_compile(r"\A" + translate(pattern))
+
+
+def response_content_type(record) -> str | None:
+    # Media type only, without parameters like the charset
+    for name, values in record.response.headers.items():
+        if name.lower() == "content-type" and values:
+            return values[0].split(";")[0].strip().lower()
+    return None
+
+
+# Fields that tape records can be filtered and grouped by
+TAPE_INDEX_FIELDS: dict[str, Callable[[Any], Any]] = {
+    "url": lambda record: record.request.url,
+    "host": lambda record: urlsplit(record.request.url).hostname,
+    "method": lambda record: record.request.method,
+    "status": lambda record: record.response.status,
+    "content_type": response_content_type,
+    "tape_id": lambda record: record.tape_id,
+}
+
+
+class TapeIndex:
+    """
+    Secondary indexes over the records of a session, each built the first time it's used
+
+    An index maps every value of a field to the positions of the records that have it. Exact
+    filters are a dict lookup and patterns only run against the distinct values, so a lookup
+    doesn't scan the tape.
+
+    """
+    def __init__(self, records: list):
+        self.records = records
+        self.size = len(records)
+        self.fields: dict[str, dict[Any, list[int]]] = {}
+
+    def is_current(self, records: list) -> bool:
+        return records is self.records and len(records) == self.size
+
+    def field(self, name: str) -> dict[Any, list[int]]:
+        if name not in self.fields:
+            if name not in TAPE_INDEX_FIELDS:
+                raise ValueError(f"Unable to index tape records by {name}")
+            key = TAPE_INDEX_FIELDS[name]
+            positions = {}
+            for position, record in enumerate(self.records):
+                positions.setdefault(key(record), []).append(position)
+            self.fields[name] = positions
+        return self.fields[name]
+
+    def matching(self, name: str, value: Any) -> list[int]:
+        index = self.field(name)
+        if isinstance(value, Pattern):
+            return [
+                position
+                for key, positions in index.items()
+                if isinstance(key, str) and value.search(key)
+                for position in positions
+            ]
+        return index.get(value, [])
+
+    def select(self, filters: dict[str, Any]) -> list[int]:
+        """
+        Positions of the records that match every filter, in tape order.
+
+        """
+        if not filters:
+            return list(range(self.size))
+
+        selected = None
+        for name, value in filters.items():
+            positions = set(self.matching(name, value))
+            selected = positions if selected is None else selected & positions
+        return sorted(selected)
@@ -0,0 +1,29 @@
+from uuid import uuid4
+
+from groove.proxy import CacheModeEnum, Groove
+from groove.tests.mock_server import MockPageDefinition, mock_server
+
+
+def test_metrics(proxy: Groove, session):
+    """
+    Ensure cache lookups and round trips are reflected in the metrics
+    """
+    proxy.set_cache_mode(CacheModeEnum.AGGRESSIVE)
+
+    with mock_server([
+        MockPageDefinition(
+            "/test",
+            content=f"<html><body>{uuid4()}</body></html>"
+        ),
+    ]) as mock_url:
+        session.get(f"{mock_url}/test")
+        session.get(f"{mock_url}/test")
+
+    metrics = proxy.metrics()
+
+    assert metrics.cache.hits == 1
+    assert metrics.cache.misses == 1
+    assert metrics.stage("roundtrip").request.count == 1
+    assert metrics.stage("cache").request.count == 2
+    assert sum(dialer.attempts for dialer in metrics.dialers) == 1
+    assert metrics.runtime.goroutines > 0
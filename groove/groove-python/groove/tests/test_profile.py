@@ -0,0 +1,22 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from groove.enums import ProfileKindEnum
+from groove.proxy import Groove, ProxyFailureError
+
+
+def test_profile_mutex():
+    proxy = Groove(profiling=True)
+    with proxy.launch(), TemporaryDirectory() as directory:
+        output_path = proxy.profile(1, ProfileKindEnum.MUTEX, Path(directory) / "mutex.pprof")
+
+        # pprof output is gzip compressed
+        assert output_path.read_bytes()[:2] == b"\x1f\x8b"
+
+
+def test_profile_disabled(proxy: Groove):
+    with TemporaryDirectory() as directory:
+        with pytest.raises(ProxyFailureError):
+            proxy.profile(1, ProfileKindEnum.HEAP, Path(directory) / "heap.pprof")
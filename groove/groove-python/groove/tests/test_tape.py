@@ -1,11 +1,22 @@
 from base64 import b64encode
+from pathlib import Path
 from uuid import uuid4
 
+import pytest
+
 from bs4 import BeautifulSoup
 from functools import partial
-from requests import get
+from gzip import compress, decompress
+from json import dumps
+from re import compile as re_compile
+from tempfile import TemporaryDirectory
+from time import monotonic
+from requests import Session, get
 
-from groove.tape import TapeRecord, TapeRequest, TapeResponse, TapeSession
+from groove.enums import ReplayModeEnum
+from groove.proxy import Groove, ProxyFailureError
+from groove.tape import TapeRecord, TapeRequest, TapeResponse, TapeSession, TapeTiming, TapeWriter
+from groove.tape_index import glob
 from groove.tests.mock_server import MockPageDefinition, mock_server
 
 
@@ -78,6 +89,276 @@ def test_tape_id(proxy, session):
     assert session2.records[0].request.url == f"{mock_url}/test2"
 
 
+def test_tape_namespaces(proxy, session):
+    """
+    One tape can replay while another keeps recording in the same proxy
+    """
+    with mock_server([
+        MockPageDefinition("/test", content="<html><body>Live</body></html>"),
+    ]) as mock_url:
+        tape = TapeSession(
+            records=[
+                TapeRecord(
+                    request=TapeRequest(url=f"{mock_url}/test", method="GET", headers={}, body=b""),
+                    response=TapeResponse(status=200, headers={}, body=b64encode(b"Replayed")),
+                )
+            ]
+        )
+        proxy.tape_start(tape_id="Recording")
+        proxy.tape_load(tape, tape_id="Replaying")
+
+        assert session.get(f"{mock_url}/test", headers={"Tape-ID": "Replaying"}).text == "Replayed"
+        assert "Live" in session.get(f"{mock_url}/test", headers={"Tape-ID": "Recording"}).text
+
+        proxy.tape_stop(tape_id="Recording")
+        assert "Live" in session.get(f"{mock_url}/test", headers={"Tape-ID": "Recording"}).text
+
+    # Only the request made while recording was kept
+    recorded = proxy.tape_get("Recording")
+    assert [record.request.url for record in recorded.records] == [f"{mock_url}/test"]
+
+
+def test_tape_replay_round_robin(proxy, session):
+    """
+    Non-consuming replay serves the same tape to every request
+    """
+    with mock_server([
+        MockPageDefinition("/test", content="<html><body>Live</body></html>"),
+    ]) as mock_url:
+        tape = TapeSession(
+            records=[
+                TapeRecord(
+                    request=TapeRequest(url=f"{mock_url}/test", method="GET", headers={}, body=b""),
+                    response=TapeResponse(status=200, headers={}, body=b64encode(body)),
+                )
+                for body in [b"First", b"Second"]
+            ]
+        )
+        proxy.set_replay_mode(ReplayModeEnum.ROUND_ROBIN)
+        proxy.tape_load(tape)
+
+        responses = [session.get(f"{mock_url}/test").text for _ in range(4)]
+        assert responses == ["First", "Second", "First", "Second"]
+
+
+def test_tape_replay_timing(proxy, session):
+    """
+    Timed replay holds responses for the recorded network time
+    """
+    with mock_server([
+        MockPageDefinition("/test", content="<html><body>Live</body></html>"),
+    ]) as mock_url:
+        tape = TapeSession(
+            records=[
+                TapeRecord(
+                    request=TapeRequest(url=f"{mock_url}/test", method="GET", headers={}, body=b""),
+                    response=TapeResponse(status=200, headers={}, body=b64encode(b"Replayed")),
+                    timing=TapeTiming(
+                        cache_lookup_ms=0,
+                        lock_wait_ms=0,
+                        dial_ms=0,
+                        tls_ms=0,
+                        ttfb_ms=200,
+                        transfer_ms=100,
+                        connection_reused=True,
+                    ),
+                )
+            ]
+        )
+        proxy.set_replay_mode(ReplayModeEnum.FIRST)
+        proxy.tape_load(tape)
+
+        start = monotonic()
+        assert session.get(f"{mock_url}/test").text == "Replayed"
+        assert monotonic() - start < 0.2
+
+        proxy.set_replay_timing(scale=2)
+        start = monotonic()
+        assert session.get(f"{mock_url}/test").text == "Replayed"
+        assert monotonic() - start >= 0.6
+
+
+def test_tape_replay_match(proxy, session):
+    """
+    Loose matching ignores cache busters and tells POST bodies apart
+    """
+    with mock_server([
+        MockPageDefinition("/graphql", content="<html><body>Live</body></html>"),
+    ]) as mock_url:
+        tape = TapeSession(
+            records=[
+                TapeRecord(
+                    request=TapeRequest(url=f"{mock_url}/graphql?ts=1", method="POST", headers={}, body=b64encode(query)),
+                    response=TapeResponse(status=200, headers={}, body=b64encode(query.upper())),
+                )
+                for query in [b"first", b"second"]
+            ]
+        )
+        proxy.set_replay_match(ignore_params=["ts"], body=True)
+        proxy.tape_load(tape)
+
+        assert session.post(f"{mock_url}/graphql?ts=2", data=b"second").text == "SECOND"
+        assert session.post(f"{mock_url}/graphql?ts=3", data=b"first").text == "FIRST"
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_tape_formats(proxy, session, binary):
+    """
+    Both tape formats round trip binary bodies through the proxy
+    """
+    with mock_server([
+        MockPageDefinition("/test", content="<html><body>Live</body></html>"),
+    ]) as mock_url:
+        body = bytes(range(256))
+        tape = TapeSession(
+            records=[
+                TapeRecord(
+                    request=TapeRequest(url=f"{mock_url}/test", method="GET", headers={}, body=b""),
+                    response=TapeResponse(status=200, headers={}, body=b64encode(body)),
+                )
+            ]
+        )
+
+        # Files are written by users and can be in either format
+        with TemporaryDirectory() as directory:
+            tape_path = Path(directory) / "tape.gz"
+            tape_path.write_bytes(tape.to_server(binary=binary))
+            proxy.tape_load_from_path(tape_path)
+
+        assert session.get(f"{mock_url}/test").content == body
+
+        exported = proxy.tape_get()
+        assert [record.response.body for record in exported.records] == [body]
+        assert TapeSession.from_server(exported.to_server(binary=binary)).records == exported.records
+
+
+def test_tape_session_from_server():
+    """
+    Tapes parsed without validation equal the validated models, including the null bodies and
+    headers the proxy writes for empty values
+    """
+    payload = [
+        {
+            "request": {"url": "https://example.com", "method": "GET", "headers": None, "body": None},
+            "response": {"status": 200, "headers": {"A": ["b"]}, "body": b64encode(b"Body").decode()},
+            "tape_id": "Tape1",
+            "sequence": 4,
+            "timing": {
+                "cacheLookupMs": 0, "lockWaitMs": 0, "dialMs": 1, "tlsMs": 2, "ttfbMs": 3,
+                "transferMs": 4, "connectionReused": False,
+            },
+        }
+    ]
+    session = TapeSession.from_server(compress(dumps(payload).encode()))
+
+    expected = TapeRecord(
+        request=TapeRequest(url="https://example.com", method="GET", headers={}, body=b""),
+        response=TapeResponse(status=200, headers={"A": ["b"]}, body=b64encode(b"Body")),
+        tape_id="Tape1",
+        sequence=4,
+        timing=TapeTiming(
+            cache_lookup_ms=0, lock_wait_ms=0, dial_ms=1, tls_ms=2, ttfb_ms=3,
+            transfer_ms=4, connection_reused=False,
+        ),
+    )
+    assert session.records == [expected]
+    for binary in [False, True]:
+        assert TapeSession.from_server(session.to_server(binary=binary)) == session
+
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_tape_session_lazy_bodies(binary):
+    """
+    Parsed bodies are written back as they were read unless replaced
+    """
+    session = TapeSession(
+        records=[
+            TapeRecord(
+                request=TapeRequest(url=f"https://example.com/{i}", method="GET", headers={}, body=b""),
+                response=TapeResponse(status=200, headers={}, body=b64encode(bytes([i]) * 64)),
+            )
+            for i in range(3)
+        ]
+    )
+    parsed = TapeSession.from_server(session.to_server(binary=binary))
+    responses = [record.response for record in parsed.records]
+
+    if binary:
+        # Views share the decompressed tape instead of copying each body
+        assert responses[0].body_view.obj is responses[1].body_view.obj
+
+    assert TapeSession.from_server(parsed.to_server(binary=binary)) == session
+    assert parsed.copy(deep=True) == parsed
+    assert all(response.source_body() is not None for response in responses)
+
+    responses[1].body = b"Replaced"
+    assert responses[1].source_body() is None
+    assert [
+        record.response.body
+        for record in TapeSession.from_server(parsed.to_server(binary=not binary)).records
+    ] == [bytes([0]) * 64, b"Replaced", bytes([2]) * 64]
+
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_tape_session_shared_bodies(binary):
+    """
+    Repeated bodies are stored once in binary tapes and shared between parsed records
+    """
+    bundle = b"console.log('groove');" * 100
+    session = TapeSession(
+        records=[
+            TapeRecord(
+                request=TapeRequest(url=f"https://example.com/{i}", method="GET", headers={}, body=b""),
+                response=TapeResponse(status=200, headers={}, body=b64encode(bundle)),
+            )
+            for i in range(3)
+        ]
+    )
+    tape = session.to_server(binary=binary)
+    if binary:
+        assert decompress(tape).count(bundle) == 1
+
+    parsed = TapeSession.from_server(tape)
+    assert parsed == session
+    assert parsed.records[0].response.body is parsed.records[2].response.body
+
+def test_tape_session_query():
+    """
+    Records can be selected, grouped and edited through the indexed fields
+    """
+    def record(url, content_type, status=200, tape_id=None):
+        return TapeRecord(
+            request=TapeRequest(url=url, method="GET", headers={}, body=b""),
+            response=TapeResponse(status=status, headers={"Content-Type": [content_type]}, body=b""),
+            tape_id=tape_id,
+        )
+
+    session = TapeSession(
+        records=[
+            record("https://example.com/", "text/html; charset=utf-8"),
+            record("https://cdn.example.com/app.js", "application/javascript"),
+            record("https://cdn.example.com/lib.js?v=2", "application/javascript", tape_id="Tape1"),
+            record("https://example.com/missing", "text/html", status=404),
+        ]
+    )
+
+    assert session.select(url=glob("*.js*")) == session.records[1:3]
+    assert session.select(host="cdn.example.com", tape_id=None) == session.records[1:2]
+    assert session.select(url=re_compile(r"/missing$"), status=404) == session.records[3:]
+    assert {
+        content_type: len(records)
+        for content_type, records in session.group_by("content_type", status=200).items()
+    } == {"text/html": 1, "application/javascript": 2}
+
+    assert session.replace_bodies(b"Stub", content_type="application/javascript") == 2
+    assert [record.response.body for record in session.records] == [b"", b"Stub", b"Stub", b""]
+
+    # Indexes follow records that are added later
+    session.records.append(record("https://example.com/new.js", "application/javascript"))
+    assert len(session.select(url=glob("*.js*"))) == 3
+
 def test_multiple_requests(proxy, context):
     """
     Ensure mocked requests resolve in the same order
@@ -115,3 +396,189 @@ def test_multiple_requests(proxy, context):
 
     page.goto("https://freeman.vc")
     assert BeautifulSoup(page.content(), features="html.parser").text.strip() == response_2
+
+
+def test_tape_timing(proxy, session):
+    """
+    Ensure recorded requests carry their timing breakdown
+    """
+    proxy.tape_start()
+
+    with mock_server([
+        MockPageDefinition(
+            "/test",
+            content=f"<html><body>{uuid4()}</body></html>"
+        ),
+    ]) as mock_url:
+        response = session.get(f"{mock_url}/test", headers={"Request-Timing": "1"})
+        assert response.ok
+        assert "ttfb;dur=" in response.headers["Server-Timing"]
+
+    tape = proxy.tape_get()
+    assert len(tape.records) == 1
+
+    timing = tape.records[0].timing
+    assert timing is not None
+    assert timing.ttfb_ms > 0
+    assert timing.total_ms >= timing.ttfb_ms
+
+
+def test_tape_skips_large_bodies():
+    """
+    Bodies over the capture limit still reach the client but aren't recorded
+    """
+    proxy = Groove(capture_max_mb=1)
+    large_content = "a" * (2 * 1024 * 1024)
+
+    with proxy.launch():
+        proxy.tape_start()
+
+        session = Session()
+        session.proxies = {
+            "http": proxy.base_url_proxy,
+            "https": proxy.base_url_proxy,
+        }
+
+        with mock_server([
+            MockPageDefinition("/small", content="<html><body>Small</body></html>"),
+            MockPageDefinition("/large", content=large_content),
+        ]) as mock_url:
+            assert session.get(f"{mock_url}/small").ok
+            assert session.get(f"{mock_url}/large").text == large_content
+
+        records = proxy.tape_get().records
+        assert [record.request.url for record in records] == [f"{mock_url}/small"]
+        assert proxy.metrics().captures.skipped == 1
+
+
+def test_tape_dir_survives_restart():
+    """
+    Disk backed recordings can be retrieved after the proxy restarts
+    """
+    with TemporaryDirectory() as tape_dir:
+        proxy = Groove(tape_dir=tape_dir)
+
+        with mock_server([
+            MockPageDefinition("/test", content="<html><body>Recorded</body></html>"),
+        ]) as mock_url:
+            with proxy.launch():
+                proxy.tape_start()
+
+                session = Session()
+                session.proxies = {
+                    "http": proxy.base_url_proxy,
+                    "https": proxy.base_url_proxy,
+                }
+                assert session.get(f"{mock_url}/test").ok
+
+            with proxy.launch():
+                records = proxy.tape_get().records
+
+        assert [record.request.url for record in records] == [f"{mock_url}/test"]
+
+
+def test_tape_pages(proxy, session):
+    """
+    Page through a filtered tape
+    """
+    proxy.tape_start()
+
+    with mock_server([
+        MockPageDefinition(f"/page{i}", content=f"<html><body>Page {i}</body></html>")
+        for i in range(5)
+    ] + [
+        MockPageDefinition("/other", content="<html><body>Other</body></html>"),
+    ]) as mock_url:
+        for i in range(5):
+            assert session.get(f"{mock_url}/page{i}").ok
+        assert session.get(f"{mock_url}/other").ok
+
+    pages = list(proxy.tape_pages(2, url_pattern="/page[0-9]$"))
+    assert [len(page.records) for page in pages] == [2, 2, 1]
+    assert [
+        record.request.url
+        for page in pages
+        for record in page.records
+    ] == [f"{mock_url}/page{i}" for i in range(5)]
+
+    compressed = proxy.tape_get(compression_level=9, parallel=True)
+    assert len(compressed.records) == 6
+    assert compressed.next_cursor is None
+
+
+def test_tape_load_from_path(proxy, session):
+    """
+    Tapes can be loaded from a local file, and invalid tapes are rejected
+    """
+    with mock_server([
+        MockPageDefinition("/test", content="<html><body>Live</body></html>"),
+    ]) as mock_url:
+        tape = TapeSession(
+            records=[
+                TapeRecord(
+                    request=TapeRequest(url=f"{mock_url}/test", method="GET", headers={}, body=b""),
+                    response=TapeResponse(status=200, headers={}, body=b64encode(b"From disk")),
+                )
+            ]
+        )
+
+        with TemporaryDirectory() as directory:
+            tape_path = Path(directory) / "tape.gz"
+            tape_path.write_bytes(tape.to_server())
+            proxy.tape_load_from_path(tape_path)
+
+            assert session.get(f"{mock_url}/test").text == "From disk"
+
+            invalid_path = Path(directory) / "invalid.gz"
+            invalid_path.write_bytes(b"not a tape")
+            with pytest.raises(ProxyFailureError):
+                proxy.tape_load_from_path(invalid_path)
+
+
+
+def test_tape_file_streaming(proxy, session):
+    """
+    Tapes can be streamed to a file, read back record by record and uploaded again
+    """
+    with mock_server([
+        MockPageDefinition("/test", content="<html><body>Live</body></html>"),
+    ]) as mock_url:
+        proxy.tape_start()
+        session.get(f"{mock_url}/test")
+        proxy.tape_stop()
+
+        with TemporaryDirectory() as directory:
+            tape_path = proxy.tape_get_to_file(Path(directory) / "recorded.gz")
+            with open(tape_path, "rb") as file:
+                records = list(TapeSession.iter_from_server(file))
+            assert [record.request.url for record in records] == [f"{mock_url}/test"]
+
+            records[0].response.body = b"From file"
+            edited_path = Path(directory) / "edited.gz"
+            with open(edited_path, "wb") as file, TapeWriter(file) as writer:
+                for record in records:
+                    writer.write(record)
+            proxy.tape_load_from_file(edited_path)
+
+        assert session.get(f"{mock_url}/test").text == "From file"
+
+def test_tape_since(proxy, session):
+    """
+    Polling with since only returns records added after the previous call
+    """
+    proxy.tape_start()
+
+    with mock_server([
+        MockPageDefinition("/test1", content="<html><body>Request 1</body></html>"),
+        MockPageDefinition("/test2", content="<html><body>Request 2</body></html>"),
+    ]) as mock_url:
+        assert session.get(f"{mock_url}/test1").ok
+        first = proxy.tape_get()
+        assert [record.request.url for record in first.records] == [f"{mock_url}/test1"]
+
+        assert proxy.tape_get(since=first.next_since).records == []
+
+        assert session.get(f"{mock_url}/test2").ok
+        second = proxy.tape_get(since=first.next_since)
+        assert [record.request.url for record in second.records] == [f"{mock_url}/test2"]
+        assert second.next_since > first.next_since
@@ -0,0 +1,54 @@
+from socket import AF_UNIX, SOCK_STREAM, socket
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+
+
+class UnixSocketConnection(HTTPConnection):
+    def __init__(self, socket_path: str, **kwargs):
+        super().__init__("localhost", **kwargs)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket(AF_UNIX, SOCK_STREAM)
+        # urllib3 uses a sentinel object when no timeout has been requested
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class UnixSocketConnectionPool(HTTPConnectionPool):
+    def __init__(self, socket_path: str):
+        super().__init__("localhost")
+        self.socket_path = socket_path
+
+    def _new_conn(self):
+        return UnixSocketConnection(self.socket_path, timeout=self.timeout.connect_timeout)
+
+
+class UnixSocketAdapter(HTTPAdapter):
+    """
+    Send every request mounted on this adapter to a unix domain socket, regardless
+    of the host in the URL. Connections are kept alive in a single pool.
+
+    """
+    def __init__(self, socket_path: str):
+        super().__init__()
+        self.socket_path = socket_path
+        self.pool = UnixSocketConnectionPool(socket_path)
+
+    def get_connection(self, url, proxies=None):
+        return self.pool
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self.pool
+
+    def request_url(self, request, proxies):
+        # Environment proxies don't apply to a local socket, always send the origin form
+        return request.path_url
+
+    def close(self):
+        self.pool.close()
+        super().close()
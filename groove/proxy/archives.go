@@ -2,9 +2,7 @@ package main
 
 import (
 	"bytes"
-	"io"
 	"io/ioutil"
-	"log"
 	"net/http"
 )
 
@@ -30,16 +28,15 @@ type ArchivedResponse struct {
 }
 
 func requestToArchivedRequest(request *http.Request) *ArchivedRequest {
-	requestBody, err := io.ReadAll(request.Body)
-
-	if err != nil {
-		log.Println("Unable to read request body stream.")
-		return nil
+	/*
+	 * The transport has already sent the body by the time the response arrives, so it's
+	 * only available when the recorder captured it on the way out
+	 */
+	var requestBody []byte
+	if capture, ok := request.Body.(*BodyCapture); ok {
+		requestBody, _ = capture.Body()
 	}
 
-	// Allow other clients to consume these bodies again
-	request.Body = ioutil.NopCloser(bytes.NewReader(requestBody))
-
 	return &ArchivedRequest{
 		// last url accessed - how do we get the first
 		Url:     request.URL.String(),
@@ -49,21 +46,14 @@ func requestToArchivedRequest(request *http.Request) *ArchivedRequest {
 	}
 }
 
-func responseToArchivedResponse(response *http.Response) *ArchivedResponse {
-	responseBody, err := io.ReadAll(response.Body)
-
-	if err != nil {
-		log.Println("Unable to read response body stream.")
-		return nil
-	}
-
-	// Allow other clients to consume these bodies again
-	response.Body = ioutil.NopCloser(bytes.NewReader(responseBody))
-
+func responseToArchivedResponse(response *http.Response, body []byte) *ArchivedResponse {
+	/*
+	 * body comes from a BodyCapture once the response has finished streaming to the client
+	 */
 	return &ArchivedResponse{
 		Status:  response.StatusCode,
 		Headers: response.Header,
-		Body:    responseBody,
+		Body:    body,
 	}
 }
 
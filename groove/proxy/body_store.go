@@ -0,0 +1,102 @@
+package main
+
+import (
+	"crypto/sha256"
+	"sync"
+)
+
+// Content hash of a body, the zero key stands for an empty body
+type bodyKey [sha256.Size]byte
+
+func newBodyKey(body []byte) bodyKey {
+	if len(body) == 0 {
+		return bodyKey{}
+	}
+	return sha256.Sum256(body)
+}
+
+type storedBody struct {
+	body []byte
+	refs int
+}
+
+type bodyStore struct {
+	/*
+	 * Content-addressed bodies of the records held in memory
+	 *
+	 * Tapes repeat the same bodies over and over: bundles fetched on every page, tracking
+	 * pixels, polled API responses. Records point into the single copy kept here and remember
+	 * its key, so releasing a record doesn't hash its bodies again. Bodies are dropped once
+	 * no record refers to them.
+	 */
+	lock   sync.Mutex
+	bodies map[bodyKey]*storedBody
+}
+
+func newBodyStore() *bodyStore {
+	return &bodyStore{bodies: make(map[bodyKey]*storedBody)}
+}
+
+func (store *bodyStore) Add(record *RecordedRecord) {
+	/*
+	 * Share the record's bodies with other records that have the same content
+	 * Bodies are hashed before taking the lock, unless the record already knows their keys.
+	 */
+	if record.requestBodyKey == (bodyKey{}) {
+		record.requestBodyKey = newBodyKey(record.Request.Body)
+	}
+	if record.responseBodyKey == (bodyKey{}) {
+		record.responseBodyKey = newBodyKey(record.Response.Body)
+	}
+
+	store.lock.Lock()
+	record.Request.Body = store.add(record.Request.Body, record.requestBodyKey)
+	record.Response.Body = store.add(record.Response.Body, record.responseBodyKey)
+	store.lock.Unlock()
+}
+
+func (store *bodyStore) Release(records []*RecordedRecord) {
+	store.lock.Lock()
+	for _, record := range records {
+		store.release(record.requestBodyKey)
+		store.release(record.responseBodyKey)
+	}
+	store.lock.Unlock()
+}
+
+func (store *bodyStore) Stats() (count int, size int) {
+	/*
+	 * Number of distinct bodies and their total size in bytes
+	 */
+	store.lock.Lock()
+	defer store.lock.Unlock()
+
+	for _, stored := range store.bodies {
+		size += len(stored.body)
+	}
+	return len(store.bodies), size
+}
+
+func (store *bodyStore) add(body []byte, key bodyKey) []byte {
+	if key == (bodyKey{}) {
+		return body
+	}
+	stored, ok := store.bodies[key]
+	if !ok {
+		stored = &storedBody{body: body}
+		store.bodies[key] = stored
+	}
+	stored.refs += 1
+	return stored.body
+}
+
+func (store *bodyStore) release(key bodyKey) {
+	stored, ok := store.bodies[key]
+	if !ok {
+		return
+	}
+	stored.refs -= 1
+	if stored.refs <= 0 {
+		delete(store.bodies, key)
+	}
+}
@@ -0,0 +1,42 @@
+package main
+
+import (
+	"testing"
+)
+
+func TestBodyStore(t *testing.T) {
+	recorder := NewRecorder(NewConfigStore(), nil)
+
+	// Same response body on both tapes, the request bodies are empty
+	for _, tapeID := range []string{"Tape1", "Tape2"} {
+		record := newStoreRecord("https://example.com/bundle.js", tapeID)
+		record.Response.Body = []byte("bundle")
+		recorder.addRecord(record)
+	}
+	recorder.addRecord(newStoreRecord("https://example.com/other", "Tape2"))
+
+	first, second := recorder.records[0], recorder.records[1]
+	if &first.Response.Body[0] != &second.Response.Body[0] {
+		t.Error("Expected identical bodies to share memory")
+	}
+	if count, size := recorder.bodies.Stats(); count != 2 || size != len("bundle")+len("body https://example.com/other") {
+		t.Errorf("Expected 2 stored bodies, got %d of %d bytes", count, size)
+	}
+
+	tests := []struct {
+		name  string
+		clear func()
+		count int
+	}{
+		// The bundle is still used by Tape2
+		{"clear tape", func() { recorder.ClearTapeID("Tape1") }, 2},
+		{"clear all", recorder.Clear, 0},
+	}
+
+	for _, test := range tests {
+		test.clear()
+		if count, _ := recorder.bodies.Stats(); count != test.count {
+			t.Errorf("%s: expected %d stored bodies, got %d", test.name, test.count, count)
+		}
+	}
+}
@@ -0,0 +1,167 @@
+package main
+
+import (
+	"io"
+	"net"
+	"net/http"
+	"regexp"
+	"sync"
+	"sync/atomic"
+
+	goproxy "github.com/piercefreeman/goproxy"
+)
+
+type TunnelStats struct {
+	/*
+	 * Traffic counters for CONNECTs that skipped the MITM pipeline
+	 */
+	Connections   int64 `json:"connections"`
+	Failures      int64 `json:"failures"`
+	BytesSent     int64 `json:"bytesSent"`
+	BytesReceived int64 `json:"bytesReceived"`
+}
+
+type BypassRules struct {
+	/*
+	 * Hosts that should be tunneled as raw bytes instead of being intercepted
+	 *
+	 * Bypassed hosts never see TLS termination, certificate generation, or re-encryption, so
+	 * they also can't be recorded or cached. Use for traffic that we never inspect (video,
+	 * websockets, third party analytics).
+	 */
+	hostPatterns []*regexp.Regexp
+	lock         sync.RWMutex
+
+	stats TunnelStats
+}
+
+func NewBypassRules() *BypassRules {
+	return &BypassRules{
+		hostPatterns: make([]*regexp.Regexp, 0),
+	}
+}
+
+func (rules *BypassRules) Load(hostPatterns []string) error {
+	/*
+	 * Replace the current rule set. Either all patterns compile or we keep the old rules.
+	 */
+	compiled := make([]*regexp.Regexp, 0, len(hostPatterns))
+	for _, pattern := range hostPatterns {
+		expression, err := regexp.Compile(pattern)
+		if err != nil {
+			return err
+		}
+		compiled = append(compiled, expression)
+	}
+
+	rules.lock.Lock()
+	rules.hostPatterns = compiled
+	rules.lock.Unlock()
+
+	return nil
+}
+
+func (rules *BypassRules) Matches(host string) bool {
+	// CONNECT hosts are formatted as host:port, patterns are written against the bare hostname
+	hostname := addressToHost(host)
+
+	rules.lock.RLock()
+	defer rules.lock.RUnlock()
+
+	for _, pattern := range rules.hostPatterns {
+		if pattern.MatchString(hostname) {
+			return true
+		}
+	}
+	return false
+}
+
+func (rules *BypassRules) Stats() TunnelStats {
+	return TunnelStats{
+		Connections:   atomic.LoadInt64(&rules.stats.Connections),
+		Failures:      atomic.LoadInt64(&rules.stats.Failures),
+		BytesSent:     atomic.LoadInt64(&rules.stats.BytesSent),
+		BytesReceived: atomic.LoadInt64(&rules.stats.BytesReceived),
+	}
+}
+
+func (rules *BypassRules) tunnel(client net.Conn, host string, dialerSession *DialerSession) {
+	/*
+	 * Splice bytes between the client and the remote host
+	 *
+	 * The remote connection still goes through the dialer session so end-proxy routing applies.
+	 * When both sides are plain TCP connections io.Copy resolves to TCPConn.ReadFrom, which
+	 * uses splice(2) on Linux and never copies the payload into userspace.
+	 */
+	atomic.AddInt64(&rules.stats.Connections, 1)
+
+	dialerDefinition := dialerSession.NextDialer(dialerSession.NewDialerContext(nil))
+	if dialerDefinition == nil {
+		atomic.AddInt64(&rules.stats.Failures, 1)
+		client.Write([]byte("HTTP/1.1 502 Bad Gateway\r\n\r\n"))
+		client.Close()
+		return
+	}
+
+	remote, err := dialerDefinition.Dial("tcp", host)
+	if err != nil {
+		tunnelLog.Warnf("Unable to open bypass tunnel to %s: %s", host, err)
+		atomic.AddInt64(&rules.stats.Failures, 1)
+		client.Write([]byte("HTTP/1.1 502 Bad Gateway\r\n\r\n"))
+		client.Close()
+		return
+	}
+
+	client.Write([]byte("HTTP/1.0 200 Connection established\r\n\r\n"))
+
+	var wg sync.WaitGroup
+	wg.Add(2)
+
+	go func() {
+		defer wg.Done()
+		written, _ := io.Copy(remote, client)
+		atomic.AddInt64(&rules.stats.BytesSent, written)
+		closeWrite(remote)
+	}()
+
+	go func() {
+		defer wg.Done()
+		written, _ := io.Copy(client, remote)
+		atomic.AddInt64(&rules.stats.BytesReceived, written)
+		closeWrite(client)
+	}()
+
+	wg.Wait()
+	remote.Close()
+	client.Close()
+}
+
+func closeWrite(connection net.Conn) {
+	// Signal EOF to the other side while still allowing reads to drain
+	if tcpConnection, ok := connection.(*net.TCPConn); ok {
+		tcpConnection.CloseWrite()
+	} else {
+		connection.Close()
+	}
+}
+
+func setupBypassMiddleware(proxy *goproxy.ProxyHttpServer, bypass *BypassRules, dialerSession *DialerSession) {
+	/*
+	 * This should be mounted before the MITM connect handler, goproxy uses the first
+	 * handler that returns an action
+	 */
+	proxy.OnRequest().HandleConnectFunc(
+		func(host string, ctx *goproxy.ProxyCtx) (*goproxy.ConnectAction, string) {
+			if !bypass.Matches(host) {
+				return nil, ""
+			}
+
+			return &goproxy.ConnectAction{
+				Action: goproxy.ConnectHijack,
+				Hijack: func(req *http.Request, client net.Conn, ctx *goproxy.ProxyCtx) {
+					bypass.tunnel(client, host, dialerSession)
+				},
+			}, host
+		},
+	)
+}
@@ -0,0 +1,78 @@
+package main
+
+import (
+	"bufio"
+	"io"
+	"net"
+	"testing"
+)
+
+func TestBypassMatches(t *testing.T) {
+	bypass := NewBypassRules()
+	if err := bypass.Load([]string{`(^|\.)youtube\.com$`, `^analytics\.`}); err != nil {
+		t.Fatal(err)
+	}
+
+	var tests = []struct {
+		host    string
+		matches bool
+	}{
+		{"www.youtube.com:443", true},
+		{"youtube.com:443", true},
+		{"analytics.example.com:443", true},
+		{"notyoutube.com:443", false},
+		{"example.com:443", false},
+	}
+
+	for _, tt := range tests {
+		if bypass.Matches(tt.host) != tt.matches {
+			t.Fatalf("Bypass - `%s` (expected: %v)", tt.host, tt.matches)
+		}
+	}
+
+	// Invalid patterns shouldn't clobber the existing rules
+	if err := bypass.Load([]string{"("}); err == nil {
+		t.Fatalf("Expected invalid pattern to fail")
+	}
+	if !bypass.Matches("www.youtube.com:443") {
+		t.Fatalf("Existing rules were replaced by a failed load")
+	}
+}
+
+func TestBypassTunnel(t *testing.T) {
+	// Echo server that stands in for the remote host
+	listener, err := net.Listen("tcp", "127.0.0.1:0")
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer listener.Close()
+	go func() {
+		remote, err := listener.Accept()
+		if err != nil {
+			return
+		}
+		io.Copy(remote, remote)
+		remote.Close()
+	}()
+
+	dialerSession := NewDialerSession(NewConfigStore())
+	dialerSession.SetDialerDefinitions([]*DialerDefinition{NewDialerDefinition(0, nil, nil)})
+
+	bypass := NewBypassRules()
+	client, proxySide := net.Pipe()
+	go bypass.tunnel(proxySide, listener.Addr().String(), dialerSession)
+
+	reader := bufio.NewReader(client)
+	status, err := reader.ReadString('\n')
+	if err != nil || status != "HTTP/1.0 200 Connection established\r\n" {
+		t.Fatalf("Unexpected tunnel status: %q %v", status, err)
+	}
+	reader.ReadString('\n')
+
+	client.Write([]byte("ping"))
+	echo := make([]byte, 4)
+	if _, err := io.ReadFull(reader, echo); err != nil || string(echo) != "ping" {
+		t.Fatalf("Unexpected tunnel echo: %q %v", echo, err)
+	}
+	client.Close()
+}
@@ -7,6 +7,7 @@ import (
 	"os/user"
 	"path"
 	"sync"
+	"sync/atomic"
 	"time"
 
 	goproxy "github.com/piercefreeman/goproxy"
@@ -48,8 +49,21 @@ type CacheEntry struct {
 	Error             string
 }
 
+type CacheStats struct {
+	/*
+	 * Lookup results and request coalescing counters, only collected while caching is enabled
+	 */
+	Hits    int64 `json:"hits"`
+	Misses  int64 `json:"misses"`
+	Expired int64 `json:"expired"`
+
+	// Requests that had to wait for an inflight request to the same URL
+	CoalescedWaiters int64 `json:"coalescedWaiters"`
+	Waiting          int64 `json:"waiting"`
+}
+
 type Cache struct {
-	mode int // CacheModeOff | CacheModeStandard | CacheModeAggressive
+	config *ConfigStore
 
 	// Disk cache comes bundled with a RWMutex so we can call functions directly
 	// and the lock will be handled internally
@@ -61,9 +75,11 @@ type Cache struct {
 	// Current locks that are blocking on gaining exclusive access to their lock
 	blockingLocks      map[string]int
 	blockingLocksMutex *sync.RWMutex
+
+	stats CacheStats
 }
 
-func NewCache(cacheSizeMaxMB uint64) *Cache {
+func NewCache(cacheSizeMaxMB uint64, config *ConfigStore) *Cache {
 	user, err := user.Current()
 	if err != nil {
 		log.Fatal(fmt.Errorf("Unable to resolve current user: %w", err))
@@ -75,7 +91,7 @@ func NewCache(cacheSizeMaxMB uint64) *Cache {
 	cachePath := path.Join(user.HomeDir, ".grooveproxy/cache")
 
 	return &Cache{
-		mode:               CacheModeStandard,
+		config:             config,
 		cacheDiskCache:     lrucache.NewCacheInvalidator(cachePath, 20, 500, 10),
 		inflightRequests:   map[string]*sync.Mutex{},
 		lockGeneration:     &sync.Mutex{},
@@ -84,13 +100,38 @@ func NewCache(cacheSizeMaxMB uint64) *Cache {
 	}
 }
 
-func (c *Cache) SetValidCacheContents(request *http.Request, response *http.Response) {
+func (c *Cache) Mode() int {
+	return c.config.Load().CacheMode
+}
+
+func (c *Cache) SetMode(mode int) {
+	c.config.Update(func(config *RuntimeConfig) {
+		config.CacheMode = mode
+	})
+}
+
+func (c *Cache) Stats() CacheStats {
+	return CacheStats{
+		Hits:             atomic.LoadInt64(&c.stats.Hits),
+		Misses:           atomic.LoadInt64(&c.stats.Misses),
+		Expired:          atomic.LoadInt64(&c.stats.Expired),
+		CoalescedWaiters: atomic.LoadInt64(&c.stats.CoalescedWaiters),
+		Waiting:          atomic.LoadInt64(&c.stats.Waiting),
+	}
+}
+
+func (c *Cache) SetValidCacheContents(request *http.Request, response *http.Response, onComplete func()) {
 	/*
 	 * Attempts to update the current cache with given request/response. As part of this function
 	 * we will determine if this is a valid payload to cache and will no-op if invalid.
+	 *
+	 * The entry is stored once the body has finished streaming to the client. onComplete runs
+	 * after that, or right away when the response isn't cached, so callers can hold the request
+	 * lock until waiters are able to find the new entry.
 	 */
 	// No-op if we are disabled
-	if c.mode == CacheModeOff {
+	if c.Mode() == CacheModeOff {
+		onComplete()
 		return
 	}
 
@@ -102,17 +143,29 @@ func (c *Cache) SetValidCacheContents(request *http.Request, response *http.Resp
 	// TODO: Explicit handling for redirects?
 	noCacheReasons, expires, _ := cachecontrol.CachableResponse(request, response, cachecontrol.Options{})
 
-	if c.isModeAggressive(request) || len(noCacheReasons) == 0 {
-		log.Printf("Caching response for %s", request.URL.String())
+	if !c.isModeAggressive(request) && len(noCacheReasons) > 0 {
+		onComplete()
+		return
+	}
+
+	captureResponseBody(response).OnComplete(func(body []byte, captured bool) {
+		defer onComplete()
+
+		if !captured {
+			cacheLog.Debugf("Response body wasn't captured, not caching: %s", request.URL)
+			return
+		}
+
+		cacheLog.Debugf("Caching response for %s", request.URL)
 		cacheEntry := &CacheEntry{
 			CacheInvalidation: expires,
-			Value:             responseToArchivedResponse(response),
+			Value:             responseToArchivedResponse(response, body),
 		}
 		err := c.cacheDiskCache.Set(getCacheKey(request), cacheEntry)
 		if err != nil {
-			log.Printf("Failed to set cache entry for key: %s %s", request.URL.String(), err.Error())
+			cacheLog.Warnf("Failed to set cache entry for key: %s %s", request.URL, err)
 		}
-	}
+	})
 }
 
 func (c *Cache) SetFailedCacheContents(request *http.Request, err error) {
@@ -135,19 +188,20 @@ func (c *Cache) SetFailedCacheContents(request *http.Request, err error) {
 	}
 	err = c.cacheDiskCache.Set(getCacheKey(request), cacheEntry)
 	if err != nil {
-		log.Printf("Failed to set cache entry for key: %s", request.URL.String())
+		cacheLog.Warnf("Failed to set cache entry for key: %s %s", request.URL, err)
 	}
 }
 
 func (c *Cache) GetCacheContents(request *http.Request) *CacheEntry {
 	// No-op if we are disabled, since we don't use request based locks
-	if c.mode == CacheModeOff {
+	if c.Mode() == CacheModeOff {
 		return nil
 	}
 
 	requestKey := getCacheKey(request)
 
 	if !c.cacheDiskCache.Has(requestKey) {
+		atomic.AddInt64(&c.stats.Misses, 1)
 		return nil
 	}
 
@@ -155,17 +209,20 @@ func (c *Cache) GetCacheContents(request *http.Request) *CacheEntry {
 	err := c.cacheDiskCache.Get(requestKey, &cache)
 
 	if err != nil {
-		log.Printf("Failed to read cache entry for key: %s (%s)", request.URL.String(), requestKey)
+		cacheLog.Warnf("Failed to read cache entry for key: %s (%s)", request.URL, requestKey)
+		atomic.AddInt64(&c.stats.Misses, 1)
 		return nil
 	}
 
 	// Determine if the cache is still valid
 	if c.cacheEntryValid(request, &cache) {
-		log.Printf("Return cache value: %s (%s)", request.URL.String(), requestKey)
+		cacheLog.Debugf("Return cache value: %s (%s)", request.URL, requestKey)
+		atomic.AddInt64(&c.stats.Hits, 1)
 		return &cache
 	}
 
-	log.Printf("Cache miss: %s (%s)", request.URL.String(), requestKey)
+	cacheLog.Debugf("Cache expired: %s (%s)", request.URL, requestKey)
+	atomic.AddInt64(&c.stats.Expired, 1)
 	return nil
 }
 
@@ -179,7 +236,7 @@ func (c *Cache) AcquireRequestLock(url string) {
 
 	// no-op if cache is disabled, an unlimited number of clients should be able to acquire
 	// a resource lock at any one time
-	if c.mode == CacheModeOff {
+	if c.Mode() == CacheModeOff {
 		return
 	}
 
@@ -197,35 +254,38 @@ func (c *Cache) AcquireRequestLock(url string) {
 	c.lockGeneration.Unlock()
 
 	c.blockingLocksMutex.Lock()
-	if _, ok := c.blockingLocks[url]; !ok {
-		c.blockingLocks[url] = 0
-	}
 	c.blockingLocks[url] += 1
 	c.blockingLocksMutex.Unlock()
 
-	c.LogBlockingRequests()
+	// Walking every blocked URL is only worth it when someone is reading debug output
+	if cacheLog.Enabled(LogLevelDebug) {
+		c.LogBlockingRequests()
+	}
 
-	lock.Lock()
+	// Only count requests that have to wait, TryLock takes the lock just like Lock when it's free
+	if !lock.TryLock() {
+		atomic.AddInt64(&c.stats.CoalescedWaiters, 1)
+		atomic.AddInt64(&c.stats.Waiting, 1)
+		lock.Lock()
+		atomic.AddInt64(&c.stats.Waiting, -1)
+	}
 
 	c.blockingLocksMutex.Lock()
 	c.blockingLocks[url] -= 1
+	if c.blockingLocks[url] == 0 {
+		// Don't let the map grow with every URL we've ever seen
+		delete(c.blockingLocks, url)
+	}
 	c.blockingLocksMutex.Unlock()
-
-	c.LogBlockingRequests()
 }
 
 func (c *Cache) LogBlockingRequests() {
 	c.blockingLocksMutex.RLock()
+	defer c.blockingLocksMutex.RUnlock()
 
-	log.Println("---BLOCKING REQUESTS---")
 	for count_url, count_values := range c.blockingLocks {
-		if count_values > 0 {
-			log.Printf("Blocking Locks: %s: %d\n", count_url, count_values)
-		}
+		cacheLog.Debugf("Blocking Locks: %s: %d", count_url, count_values)
 	}
-	log.Println("---END---")
-
-	c.blockingLocksMutex.RUnlock()
 }
 
 func (c *Cache) ReleaseRequestLock(url string) {
@@ -233,7 +293,12 @@ func (c *Cache) ReleaseRequestLock(url string) {
 	// the cache mode mid-operation we still want to allow client callers to
 	// unlock the locks of inflight requests
 
+	// Releases run on whichever goroutine finished streaming the body, guard the map
+	// against concurrent lock generation
+	c.lockGeneration.Lock()
 	lock, ok := c.inflightRequests[url]
+	c.lockGeneration.Unlock()
+
 	if ok {
 		// We want to allow for liberal request unlocking, ie. we want to call this
 		// function even if we aren't guaranteed that there's a lock
@@ -275,11 +340,12 @@ func (c *Cache) isModeAggressive(request *http.Request) bool {
 	 * This function will return true if the given request should quality for aggressive handling AND if the
 	 * current mode allows for aggressive caching.
 	 */
-	if c.mode == CacheModeAggressive {
+	mode := c.Mode()
+	if mode == CacheModeAggressive {
 		return true
 	}
 
-	if c.mode == CacheModeGetAggressive && request.Method == "GET" {
+	if mode == CacheModeGetAggressive && request.Method == "GET" {
 		return true
 	}
 
@@ -292,13 +358,20 @@ func setupCacheMiddleware(proxy *goproxy.ProxyHttpServer, cache *Cache, recorder
 		 * Cache layer
 		 */
 		func(r *http.Request, ctx *goproxy.ProxyCtx) (*http.Request, *http.Response) {
+			// Includes time spent waiting on coalesced requests
+			defer cacheStage.request.ObserveSince(time.Now())
+
+			requestHeaders := ctx.UserData.(*HeaderDefinition)
+
 			// Only cache if we are not replaying the tape
-			if recorder.mode == RecorderModeRead {
+			if recorder.ModeFor(requestHeaders.tapeID) == RecorderModeRead {
 				return r, nil
 			}
 
 			// Determine if we have a cache result available
+			lookupStart := time.Now()
 			cacheValue := cache.GetCacheContents(r)
+			requestHeaders.timer.Record(TimingCacheLookup, lookupStart)
 			if cacheValue != nil {
 				if cacheValue.Value != nil {
 					return r, archivedResponseToResponse(r, cacheValue.Value)
@@ -312,9 +385,11 @@ func setupCacheMiddleware(proxy *goproxy.ProxyHttpServer, cache *Cache, recorder
 			// Determine if we have permission to proceed for this URL
 			// FIX: This causes a deadlock right now because these request handling aren't goroutines
 			// therefore they will run inline with the rest of the program and block each other
-			log.Printf("Will acquire lock: %s\n", r.URL.String())
+			cacheLog.Debugf("Will acquire lock: %s", r.URL)
+			lockStart := time.Now()
 			cache.AcquireRequestLock(r.URL.String())
-			log.Printf("Did acquire lock: %s\n", r.URL.String())
+			requestHeaders.timer.Record(TimingLockWait, lockStart)
+			cacheLog.Debugf("Did acquire lock: %s", r.URL)
 
 			// We now have permission to access this URL and should continue until complete
 			return r, nil
@@ -326,6 +401,8 @@ func setupCacheMiddleware(proxy *goproxy.ProxyHttpServer, cache *Cache, recorder
 		 * Cache layer
 		 */
 		func(response *http.Response, ctx *goproxy.ProxyCtx) *http.Response {
+			defer cacheStage.response.ObserveSince(time.Now())
+
 			if ctx.Error != nil {
 				request := ctx.Req
 				cache.SetFailedCacheContents(request, ctx.Error)
@@ -333,7 +410,7 @@ func setupCacheMiddleware(proxy *goproxy.ProxyHttpServer, cache *Cache, recorder
 				return nil
 			}
 
-			if recorder.mode == RecorderModeRead {
+			if recorder.ModeFor(ctx.UserData.(*HeaderDefinition).tapeID) == RecorderModeRead {
 				return response
 			}
 
@@ -347,10 +424,11 @@ func setupCacheMiddleware(proxy *goproxy.ProxyHttpServer, cache *Cache, recorder
 				request := requestHistory[i]
 				response := responseHistory[i]
 
-				cache.SetValidCacheContents(request, response)
-				log.Printf("Will release lock: %s\n", request.URL.String())
-				cache.ReleaseRequestLock(request.URL.String())
-				log.Printf("Did release lock: %s\n", request.URL.String())
+				// Coalesced requests keep waiting until the entry is stored
+				cache.SetValidCacheContents(request, response, func() {
+					cache.ReleaseRequestLock(request.URL.String())
+					cacheLog.Debugf("Released lock: %s", request.URL)
+				})
 			}
 
 			return response
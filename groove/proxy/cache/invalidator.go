@@ -8,12 +8,22 @@ import (
 	"os"
 	"path/filepath"
 	"sync"
+	"sync/atomic"
 
 	"github.com/peterbourgon/diskv/v3"
 )
 
 type MemoryCache map[string]*[]byte
 
+type TierStats struct {
+	/*
+	 * Which storage tier served each read
+	 */
+	MemoryHits int64 `json:"memoryHits"`
+	DiskHits   int64 `json:"diskHits"`
+	Misses     int64 `json:"misses"`
+}
+
 type CacheInvalidator struct {
 	/*
 	 * Light wapper around a disk cache to provide automatic cache invalidation
@@ -35,6 +45,8 @@ type CacheInvalidator struct {
 	saveInterval     int
 	operationCounter int
 	saveWaiter       *sync.WaitGroup
+
+	stats TierStats
 }
 
 const transformBlockSize = 2 // Grouping of chars per directory depth
@@ -156,21 +168,36 @@ func (cache *CacheInvalidator) Get(key string, obj any) (err error) {
 		if err != nil {
 			return err
 		}
+		atomic.AddInt64(&cache.stats.MemoryHits, 1)
 	}
 	if cache.diskCache.Has(key) {
+		// Also read on memory hits, which keeps the entry recent in the disk tier
+		memoryHit := encodedValue != nil
 		encodedValue, err = cache.diskCache.Get(key)
 		if err != nil {
 			return err
 		}
+		if !memoryHit {
+			atomic.AddInt64(&cache.stats.DiskHits, 1)
+		}
 	}
 
 	if encodedValue == nil {
+		atomic.AddInt64(&cache.stats.Misses, 1)
 		return fmt.Errorf("Key %s not found in cache", key)
 	}
 
 	return objectFromBytes(*encodedValue, obj)
 }
 
+func (cache *CacheInvalidator) Stats() TierStats {
+	return TierStats{
+		MemoryHits: atomic.LoadInt64(&cache.stats.MemoryHits),
+		DiskHits:   atomic.LoadInt64(&cache.stats.DiskHits),
+		Misses:     atomic.LoadInt64(&cache.stats.Misses),
+	}
+}
+
 func (cache *CacheInvalidator) Set(key string, value any) error {
 	encodedValue, err := objectToBytes(value)
 	if err != nil {
@@ -44,3 +44,28 @@ func TestSaveReadIndex(t *testing.T) {
 	invalidator.writeIndex()
 	invalidator.saveWaiter.Wait()
 }
+
+func TestTierStats(t *testing.T) {
+	cacheDirectory, err := ioutil.TempDir("", "")
+	if err != nil {
+		t.Fatalf("Error creating temp dir: %s", err)
+	}
+
+	invalidator := NewCacheInvalidator(cacheDirectory, 10, 10, 1)
+	invalidator.Set("testKey", &TestSimpleObject{"testValue"})
+	invalidator.saveWaiter.Wait()
+
+	var value TestSimpleObject
+	invalidator.Get("testKey", &value)
+
+	// Evict from memory so the next read has to go to disk
+	invalidator.memoryCache.Delete("testKey")
+	invalidator.Get("testKey", &value)
+
+	invalidator.Get("missingKey", &value)
+
+	stats := invalidator.Stats()
+	if stats.MemoryHits != 1 || stats.DiskHits != 1 || stats.Misses != 1 {
+		t.Fatalf("Unexpected tier stats: %+v", stats)
+	}
+}
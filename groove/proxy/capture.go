@@ -0,0 +1,194 @@
+package main
+
+import (
+	"bytes"
+	"io"
+	"net/http"
+	"sync"
+	"sync/atomic"
+)
+
+const (
+	CaptureStreaming = iota
+	CaptureComplete  = iota
+
+	// Body grew past the size limit, it's still streamed to the client but not kept
+	CaptureSkipped = iota
+
+	// Stream closed or errored before the end of the body
+	CaptureAborted = iota
+)
+
+// Bodies larger than this are passed through without being recorded or cached, set at launch
+var maxCaptureBytes int64 = 64 << 20
+
+type CaptureStats struct {
+	Completed int64 `json:"completed"`
+	Skipped   int64 `json:"skipped"`
+	Aborted   int64 `json:"aborted"`
+}
+
+var captureStats CaptureStats
+
+func loadCaptureStats() CaptureStats {
+	return CaptureStats{
+		Completed: atomic.LoadInt64(&captureStats.Completed),
+		Skipped:   atomic.LoadInt64(&captureStats.Skipped),
+		Aborted:   atomic.LoadInt64(&captureStats.Aborted),
+	}
+}
+
+type BodyCapture struct {
+	/*
+	 * Tees a request or response body into memory as it streams through the proxy
+	 *
+	 * The client receives each chunk as soon as it arrives from upstream, instead of waiting
+	 * for the recorder and cache to buffer the whole body. Both of them register a callback
+	 * through OnComplete and share a single buffered copy once the stream reaches EOF.
+	 */
+	io.ReadCloser
+
+	url   string
+	limit int64
+
+	buffer bytes.Buffer
+
+	lock      sync.Mutex
+	state     int
+	callbacks []func(body []byte, captured bool)
+}
+
+func captureRequestBody(request *http.Request) *BodyCapture {
+	capture := newBodyCapture(request.Body, request.ContentLength, request.URL.String())
+	request.Body = capture
+	return capture
+}
+
+func captureResponseBody(response *http.Response) *BodyCapture {
+	capture := newBodyCapture(response.Body, response.ContentLength, response.Request.URL.String())
+	response.Body = capture
+	return capture
+}
+
+func newBodyCapture(body io.ReadCloser, contentLength int64, url string) *BodyCapture {
+	// Middlewares share one capture of the same body
+	if capture, ok := body.(*BodyCapture); ok {
+		return capture
+	}
+
+	capture := &BodyCapture{
+		ReadCloser: body,
+		url:        url,
+		limit:      maxCaptureBytes,
+	}
+
+	if body == nil || body == http.NoBody {
+		capture.ReadCloser = http.NoBody
+		capture.finish(CaptureComplete)
+	} else if contentLength > capture.limit {
+		capture.finish(CaptureSkipped)
+	} else if contentLength > 0 {
+		capture.buffer.Grow(int(contentLength))
+	}
+
+	return capture
+}
+
+func (capture *BodyCapture) OnComplete(callback func(body []byte, captured bool)) {
+	/*
+	 * Run callback once the full body has been read, or right away if the stream already ended
+	 * captured is false when the body was too large or the stream ended early, body is nil
+	 */
+	capture.lock.Lock()
+	if capture.state == CaptureStreaming {
+		capture.callbacks = append(capture.callbacks, callback)
+		capture.lock.Unlock()
+		return
+	}
+	capture.lock.Unlock()
+
+	callback(capture.Body())
+}
+
+func (capture *BodyCapture) Body() ([]byte, bool) {
+	/*
+	 * Captured body if the stream has already been read to the end
+	 */
+	capture.lock.Lock()
+	defer capture.lock.Unlock()
+	return capture.result()
+}
+
+func (capture *BodyCapture) Read(p []byte) (int, error) {
+	n, err := capture.ReadCloser.Read(p)
+
+	if n > 0 && capture.streaming() {
+		if int64(capture.buffer.Len()+n) > capture.limit {
+			capture.finish(CaptureSkipped)
+		} else {
+			capture.buffer.Write(p[:n])
+		}
+	}
+
+	if err == io.EOF {
+		capture.finish(CaptureComplete)
+	} else if err != nil {
+		capture.finish(CaptureAborted)
+	}
+
+	return n, err
+}
+
+func (capture *BodyCapture) Close() error {
+	err := capture.ReadCloser.Close()
+	// Client went away before the end of the body, a partial copy can't be replayed
+	capture.finish(CaptureAborted)
+	return err
+}
+
+func (capture *BodyCapture) streaming() bool {
+	capture.lock.Lock()
+	defer capture.lock.Unlock()
+	return capture.state == CaptureStreaming
+}
+
+func (capture *BodyCapture) result() ([]byte, bool) {
+	if capture.state != CaptureComplete {
+		return nil, false
+	}
+	// Distinguish an empty body from one that wasn't captured
+	body := capture.buffer.Bytes()
+	if body == nil {
+		body = []byte{}
+	}
+	return body, true
+}
+
+func (capture *BodyCapture) finish(state int) {
+	capture.lock.Lock()
+	if capture.state != CaptureStreaming {
+		capture.lock.Unlock()
+		return
+	}
+	capture.state = state
+	callbacks := capture.callbacks
+	capture.callbacks = nil
+	capture.lock.Unlock()
+
+	switch state {
+	case CaptureComplete:
+		atomic.AddInt64(&captureStats.Completed, 1)
+	case CaptureSkipped:
+		atomic.AddInt64(&captureStats.Skipped, 1)
+		recorderLog.Warnf("Body is larger than %d bytes, passing through without capture: %s", capture.limit, capture.url)
+		// Release what was buffered so far, the rest of the body streams straight through
+		capture.buffer = bytes.Buffer{}
+	case CaptureAborted:
+		atomic.AddInt64(&captureStats.Aborted, 1)
+	}
+
+	body, captured := capture.result()
+	for _, callback := range callbacks {
+		callback(body, captured)
+	}
+}
@@ -0,0 +1,109 @@
+package main
+
+import (
+	"bytes"
+	"io"
+	"net/http"
+	"net/url"
+	"strings"
+	"testing"
+)
+
+func newCaptureResponse(body io.ReadCloser, contentLength int64) *http.Response {
+	return &http.Response{
+		StatusCode:    http.StatusOK,
+		Header:        make(http.Header),
+		Body:          body,
+		ContentLength: contentLength,
+		Request:       &http.Request{URL: &url.URL{Scheme: "https", Host: "example.com"}},
+	}
+}
+
+func TestBodyCapture(t *testing.T) {
+	defer func(limit int64) { maxCaptureBytes = limit }(maxCaptureBytes)
+	maxCaptureBytes = 8
+
+	tests := []struct {
+		name          string
+		body          string
+		contentLength int64
+		closeEarly    bool
+		captured      bool
+	}{
+		{"small body", "groove", 6, false, true},
+		{"unknown length", "groove", -1, false, true},
+		{"empty body", "", 0, false, true},
+		{"declared too large", "groove proxy", 12, false, false},
+		{"grows too large", "groove proxy", -1, false, false},
+		{"closed early", "groove", 6, true, false},
+	}
+
+	for _, test := range tests {
+		response := newCaptureResponse(io.NopCloser(strings.NewReader(test.body)), test.contentLength)
+
+		var callbacks int
+		var capturedBody []byte
+		var captured bool
+
+		capture := captureResponseBody(response)
+		capture.OnComplete(func(body []byte, ok bool) {
+			callbacks++
+			capturedBody, captured = body, ok
+		})
+
+		if test.closeEarly {
+			response.Body.Read(make([]byte, 2))
+			response.Body.Close()
+		} else {
+			// The client always receives the full body, even when it isn't captured
+			clientBody, _ := io.ReadAll(response.Body)
+			response.Body.Close()
+			if string(clientBody) != test.body {
+				t.Errorf("%s: client received %q", test.name, clientBody)
+			}
+		}
+
+		if callbacks != 1 {
+			t.Fatalf("%s: expected one callback, got %d", test.name, callbacks)
+		}
+		if captured != test.captured {
+			t.Errorf("%s: expected captured=%t", test.name, test.captured)
+		}
+		if captured && string(capturedBody) != test.body {
+			t.Errorf("%s: captured %q", test.name, capturedBody)
+		}
+	}
+}
+
+func TestBodyCaptureStreams(t *testing.T) {
+	/*
+	 * Bytes reach the client as they arrive, the shared copy completes at EOF
+	 */
+	reader, writer := io.Pipe()
+	response := newCaptureResponse(reader, -1)
+
+	var recorderBody, cacheBody []byte
+	captureResponseBody(response).OnComplete(func(body []byte, captured bool) { recorderBody = body })
+	captureResponseBody(response).OnComplete(func(body []byte, captured bool) { cacheBody = body })
+
+	go func() {
+		writer.Write([]byte("first "))
+		writer.Write([]byte("second"))
+		writer.Close()
+	}()
+
+	chunk := make([]byte, 64)
+	n, _ := response.Body.Read(chunk)
+	if string(chunk[:n]) != "first " {
+		t.Fatalf("Unexpected first chunk: %q", chunk[:n])
+	}
+	if recorderBody != nil {
+		t.Fatal("Capture completed before the body was read")
+	}
+
+	io.ReadAll(response.Body)
+
+	if string(recorderBody) != "first second" || !bytes.Equal(recorderBody, cacheBody) {
+		t.Errorf("Unexpected captures: %q %q", recorderBody, cacheBody)
+	}
+}
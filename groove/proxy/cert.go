@@ -2,20 +2,29 @@
 package main
 
 import (
+	"crypto"
+	"crypto/rand"
+	"crypto/rsa"
 	"crypto/tls"
 	"crypto/x509"
+	"crypto/x509/pkix"
 	"fmt"
 	"log"
+	"math/big"
+	"net"
 	"os"
 	"os/exec"
 	"os/user"
 	"path"
 	"runtime"
+	"strings"
+	"time"
 
 	goproxy "github.com/piercefreeman/goproxy"
+	"golang.org/x/net/publicsuffix"
 )
 
-func setCA(caCert string, caKey string) error {
+func setCA(caCert string, caKey string, certStore goproxy.CertStorage, keyPool *KeyPool, wildcard bool) error {
 	// Override the default support: https://github.com/elazarl/goproxy/blob/fbd10ff4f5a16de73dca5030fc12245548f76141/https.go#L32
 	goproxyCa, err := tls.LoadX509KeyPair(caCert, caKey)
 	if err != nil {
@@ -25,13 +34,127 @@ func setCA(caCert string, caKey string) error {
 		return err
 	}
 	goproxy.GoproxyCa = goproxyCa
-	goproxy.OkConnect = &goproxy.ConnectAction{Action: goproxy.ConnectAccept, TLSConfig: goproxy.TLSConfigFromCA(&goproxyCa)}
-	goproxy.MitmConnect = &goproxy.ConnectAction{Action: goproxy.ConnectMitm, TLSConfig: goproxy.TLSConfigFromCA(&goproxyCa)}
-	goproxy.HTTPMitmConnect = &goproxy.ConnectAction{Action: goproxy.ConnectHTTPMitm, TLSConfig: goproxy.TLSConfigFromCA(&goproxyCa)}
-	goproxy.RejectConnect = &goproxy.ConnectAction{Action: goproxy.ConnectReject, TLSConfig: goproxy.TLSConfigFromCA(&goproxyCa)}
+
+	// Sign with our own key pool instead of goproxy.TLSConfigFromCA, which generates a fresh
+	// RSA key inline on every certificate miss
+	tlsConfig := TLSConfigFromCA(&goproxyCa, certStore, keyPool, wildcard)
+	goproxy.OkConnect = &goproxy.ConnectAction{Action: goproxy.ConnectAccept, TLSConfig: tlsConfig}
+	goproxy.MitmConnect = &goproxy.ConnectAction{Action: goproxy.ConnectMitm, TLSConfig: tlsConfig}
+	goproxy.HTTPMitmConnect = &goproxy.ConnectAction{Action: goproxy.ConnectHTTPMitm, TLSConfig: tlsConfig}
+	goproxy.RejectConnect = &goproxy.ConnectAction{Action: goproxy.ConnectReject, TLSConfig: tlsConfig}
 	return nil
 }
 
+func TLSConfigFromCA(
+	ca *tls.Certificate,
+	certStore goproxy.CertStorage,
+	keyPool *KeyPool,
+	wildcard bool,
+) func(host string, ctx *goproxy.ProxyCtx) (*tls.Config, error) {
+	/*
+	 * Mirrors goproxy.TLSConfigFromCA, but leaf keys come from the pre-generated pool
+	 * If wildcard is enabled, subdomains of the same registrable domain share one certificate
+	 */
+	return func(host string, ctx *goproxy.ProxyCtx) (*tls.Config, error) {
+		certKey, certHosts := certificateHosts(addressToHost(host), wildcard)
+
+		genCert := func() (*tls.Certificate, error) {
+			key, err := keyPool.Get()
+			if err != nil {
+				return nil, err
+			}
+			return signHost(*ca, certHosts, key)
+		}
+
+		cert, err := certStore.Fetch(certKey, genCert)
+		if err != nil {
+			return nil, err
+		}
+
+		return &tls.Config{
+			Certificates: []tls.Certificate{*cert},
+		}, nil
+	}
+}
+
+func certificateHosts(hostname string, wildcard bool) (certKey string, hosts []string) {
+	/*
+	 * Determine the cert store key and the SANs for the certificate that should serve hostname
+	 *
+	 * In wildcard mode a subdomain is served by a `*.parent` certificate that also lists the
+	 * parent itself, so cdn1.example.com, img.example.com, and example.com all share a single
+	 * leaf. Wildcards only match one label, so deeper hosts like a.b.example.com key on their
+	 * direct parent (b.example.com). We never wildcard a public suffix.
+	 */
+	if !wildcard || net.ParseIP(hostname) != nil {
+		return hostname, []string{hostname}
+	}
+
+	registrableDomain, err := publicsuffix.EffectiveTLDPlusOne(hostname)
+	if err != nil {
+		return hostname, []string{hostname}
+	}
+
+	parent := registrableDomain
+	if hostname != registrableDomain {
+		parent = hostname[strings.Index(hostname, ".")+1:]
+	}
+
+	return "*." + parent, []string{parent, "*." + parent}
+}
+
+func signHost(ca tls.Certificate, hosts []string, key crypto.Signer) (*tls.Certificate, error) {
+	/*
+	 * Sign a leaf certificate for the given hosts with a key that has already been generated
+	 * https://github.com/elazarl/goproxy/blob/a92cc753f88eb1d5f3ca49bd91da71fe815537ca/signer.go
+	 */
+	serial, err := rand.Int(rand.Reader, new(big.Int).Lsh(big.NewInt(1), 128))
+	if err != nil {
+		return nil, err
+	}
+
+	// Backdate the start to avoid clock skew issues with the client
+	now := time.Now()
+	template := x509.Certificate{
+		SerialNumber: serial,
+		Issuer:       ca.Leaf.Subject,
+		Subject: pkix.Name{
+			Organization: []string{"GrooveProxy"},
+		},
+		NotBefore:             now.Add(-30 * 24 * time.Hour),
+		NotAfter:              now.Add(365 * 24 * time.Hour),
+		KeyUsage:              x509.KeyUsageDigitalSignature,
+		ExtKeyUsage:           []x509.ExtKeyUsage{x509.ExtKeyUsageServerAuth},
+		BasicConstraintsValid: true,
+	}
+
+	// Key encipherment is only meaningful for RSA key exchange
+	if _, ok := key.(*rsa.PrivateKey); ok {
+		template.KeyUsage |= x509.KeyUsageKeyEncipherment
+	}
+
+	for _, host := range hosts {
+		if ip := net.ParseIP(host); ip != nil {
+			template.IPAddresses = append(template.IPAddresses, ip)
+		} else {
+			template.DNSNames = append(template.DNSNames, host)
+			if template.Subject.CommonName == "" {
+				template.Subject.CommonName = host
+			}
+		}
+	}
+
+	derBytes, err := x509.CreateCertificate(rand.Reader, &template, ca.Leaf, key.Public(), ca.PrivateKey)
+	if err != nil {
+		return nil, err
+	}
+
+	return &tls.Certificate{
+		Certificate: [][]byte{derBytes, ca.Certificate[0]},
+		PrivateKey:  key,
+	}, nil
+}
+
 func getLocalCAPaths() (localPath string, localCAPath string, localCAKey string) {
 	user, err := user.Current()
 	if err != nil {
@@ -0,0 +1,127 @@
+package main
+
+import (
+	"crypto/ecdsa"
+	"crypto/elliptic"
+	"crypto/rand"
+	"crypto/tls"
+	"crypto/x509"
+	"crypto/x509/pkix"
+	"math/big"
+	"strings"
+	"testing"
+	"time"
+)
+
+func newTestCA(t *testing.T) tls.Certificate {
+	key, err := ecdsa.GenerateKey(elliptic.P256(), rand.Reader)
+	if err != nil {
+		t.Fatal(err)
+	}
+	template := &x509.Certificate{
+		SerialNumber:          big.NewInt(1),
+		Subject:               pkix.Name{CommonName: "GrooveProxy Test CA"},
+		NotBefore:             time.Now().Add(-time.Hour),
+		NotAfter:              time.Now().Add(time.Hour),
+		IsCA:                  true,
+		KeyUsage:              x509.KeyUsageCertSign,
+		BasicConstraintsValid: true,
+	}
+	derBytes, err := x509.CreateCertificate(rand.Reader, template, template, key.Public(), key)
+	if err != nil {
+		t.Fatal(err)
+	}
+	leaf, err := x509.ParseCertificate(derBytes)
+	if err != nil {
+		t.Fatal(err)
+	}
+	return tls.Certificate{Certificate: [][]byte{derBytes}, PrivateKey: key, Leaf: leaf}
+}
+
+func TestSignHostWithPooledKeys(t *testing.T) {
+	ca := newTestCA(t)
+	roots := x509.NewCertPool()
+	roots.AddCert(ca.Leaf)
+
+	for _, keyType := range []string{KeyTypeECDSA, KeyTypeRSA} {
+		pool, err := NewKeyPool(keyType, 2)
+		if err != nil {
+			t.Fatal(err)
+		}
+		key, err := pool.Get()
+		if err != nil {
+			t.Fatal(err)
+		}
+
+		cert, err := signHost(ca, []string{"example.com"}, key)
+		if err != nil {
+			t.Fatalf("signHost (%s): %s", keyType, err)
+		}
+
+		leaf, err := x509.ParseCertificate(cert.Certificate[0])
+		if err != nil {
+			t.Fatal(err)
+		}
+		if _, err := leaf.Verify(x509.VerifyOptions{DNSName: "example.com", Roots: roots}); err != nil {
+			t.Fatalf("Signed certificate (%s) doesn't verify: %s", keyType, err)
+		}
+	}
+
+	if _, err := NewKeyPool("dsa", 1); err == nil {
+		t.Fatalf("Expected unknown key type to fail")
+	}
+}
+
+func TestCertificateHostsWildcard(t *testing.T) {
+	var tests = []struct {
+		hostname string
+		wildcard bool
+		certKey  string
+		hosts    []string
+	}{
+		// Exact host certificates when wildcard is disabled
+		{"cdn1.example.com", false, "cdn1.example.com", []string{"cdn1.example.com"}},
+		// Subdomains share the registrable domain certificate
+		{"cdn1.example.com", true, "*.example.com", []string{"example.com", "*.example.com"}},
+		{"img.example.com", true, "*.example.com", []string{"example.com", "*.example.com"}},
+		// Apex is served by the same certificate
+		{"example.com", true, "*.example.com", []string{"example.com", "*.example.com"}},
+		// Wildcards only match one label
+		{"a.b.example.com", true, "*.b.example.com", []string{"b.example.com", "*.b.example.com"}},
+		// IP addresses are never wildcarded
+		{"127.0.0.1", true, "127.0.0.1", []string{"127.0.0.1"}},
+	}
+
+	for _, tt := range tests {
+		certKey, hosts := certificateHosts(tt.hostname, tt.wildcard)
+		if certKey != tt.certKey || strings.Join(hosts, ",") != strings.Join(tt.hosts, ",") {
+			t.Fatalf("certificateHosts - `%s` (actual: %s %v, expected: %s %v)", tt.hostname, certKey, hosts, tt.certKey, tt.hosts)
+		}
+	}
+}
+
+func TestSignHostWildcard(t *testing.T) {
+	ca := newTestCA(t)
+	roots := x509.NewCertPool()
+	roots.AddCert(ca.Leaf)
+
+	key, err := generateKey(KeyTypeECDSA)
+	if err != nil {
+		t.Fatal(err)
+	}
+	_, hosts := certificateHosts("cdn1.example.com", true)
+	cert, err := signHost(ca, hosts, key)
+	if err != nil {
+		t.Fatal(err)
+	}
+	leaf, err := x509.ParseCertificate(cert.Certificate[0])
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	for _, hostname := range []string{"example.com", "cdn1.example.com", "img.example.com"} {
+		if _, err := leaf.Verify(x509.VerifyOptions{DNSName: hostname, Roots: roots}); err != nil {
+			t.Fatalf("Wildcard certificate doesn't verify for %s: %s", hostname, err)
+		}
+	}
+}
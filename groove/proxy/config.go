@@ -0,0 +1,62 @@
+package main
+
+import (
+	"sync"
+	"sync/atomic"
+)
+
+type RuntimeConfig struct {
+	/*
+	 * Settings that the control API can change while the proxy is serving traffic
+	 *
+	 * A published snapshot is never modified. Updates copy the current snapshot, change the
+	 * copy, and swap it in atomically, so request goroutines read without taking a lock and
+	 * never observe a half-applied change.
+	 */
+	CacheMode    int // CacheModeOff | CacheModeStandard | CacheModeGetAggressive | CacheModeAggressive
+	RecorderMode int // RecorderModeOff | RecorderModeRead | RecorderModeWrite
+	ReplayMode   int // ReplayModeConsume | ReplayModeFirst | ReplayModeRoundRobin
+
+	// Multiplier for the recorded network timings during replay, 0 replays as fast as possible
+	ReplayTimeScale float64
+
+	// Tape IDs recording or replaying independently of RecorderMode. Treat as read-only,
+	// replace the whole map when a tape changes mode.
+	TapeModes map[string]int
+
+	// Treat as read-only, replace the whole slice when the dialer table changes
+	Dialers []*DialerDefinition
+}
+
+type ConfigStore struct {
+	// Holds a *RuntimeConfig. atomic.Pointer would be the natural fit but needs Go 1.19.
+	current atomic.Value
+
+	// Serializes writers so concurrent control calls can't drop each other's changes
+	updateLock sync.Mutex
+}
+
+func NewConfigStore() *ConfigStore {
+	store := &ConfigStore{}
+	store.current.Store(&RuntimeConfig{
+		CacheMode:    CacheModeStandard,
+		RecorderMode: RecorderModeOff,
+		ReplayMode:   ReplayModeConsume,
+		TapeModes:    make(map[string]int),
+		Dialers:      make([]*DialerDefinition, 0),
+	})
+	return store
+}
+
+func (store *ConfigStore) Load() *RuntimeConfig {
+	return store.current.Load().(*RuntimeConfig)
+}
+
+func (store *ConfigStore) Update(update func(config *RuntimeConfig)) {
+	store.updateLock.Lock()
+	defer store.updateLock.Unlock()
+
+	next := *store.Load()
+	update(&next)
+	store.current.Store(&next)
+}
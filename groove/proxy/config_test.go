@@ -0,0 +1,68 @@
+package main
+
+import (
+	"sync"
+	"testing"
+)
+
+func TestConfigStoreConcurrentUpdates(t *testing.T) {
+	config := NewConfigStore()
+	recorder := NewRecorder(config, nil)
+	// Mode accessors only need the config, skip creating the on-disk cache
+	cache := &Cache{config: config}
+	dialerSession := NewDialerSession(config)
+
+	dialers := []*DialerDefinition{NewDialerDefinition(0, nil, nil)}
+
+	var wg sync.WaitGroup
+	for i := 0; i < 50; i++ {
+		wg.Add(4)
+		go func() {
+			defer wg.Done()
+			recorder.SetMode(RecorderModeWrite)
+		}()
+		go func() {
+			defer wg.Done()
+			cache.SetMode(CacheModeAggressive)
+		}()
+		go func() {
+			defer wg.Done()
+			dialerSession.SetDialerDefinitions(dialers)
+		}()
+		go func() {
+			defer wg.Done()
+			// Readers are lock-free and always see a complete snapshot
+			snapshot := config.Load()
+			if snapshot.Dialers == nil {
+				t.Error("Dialer table should never be nil")
+			}
+		}()
+	}
+	wg.Wait()
+
+	// Writers to separate fields must not drop each other's changes
+	if recorder.Mode() != RecorderModeWrite {
+		t.Errorf("Unexpected recorder mode: %d", recorder.Mode())
+	}
+	if cache.Mode() != CacheModeAggressive {
+		t.Errorf("Unexpected cache mode: %d", cache.Mode())
+	}
+	if len(dialerSession.DialerDefinitions()) != 1 {
+		t.Errorf("Unexpected dialer count: %d", len(dialerSession.DialerDefinitions()))
+	}
+}
+
+func TestDialerContextKeepsTable(t *testing.T) {
+	dialerSession := NewDialerSession(NewConfigStore())
+	original := NewDialerDefinition(0, nil, nil)
+	dialerSession.SetDialerDefinitions([]*DialerDefinition{original})
+
+	context := dialerSession.NewDialerContext(nil)
+
+	// Swapping the table shouldn't affect dial sequences that already started
+	dialerSession.SetDialerDefinitions([]*DialerDefinition{NewDialerDefinition(0, nil, nil)})
+
+	if dialer := dialerSession.NextDialer(context); dialer != original {
+		t.Error("Dialer context should use the table it was created with")
+	}
+}
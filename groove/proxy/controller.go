@@ -1,22 +1,64 @@
 package main
 
 import (
+	"compress/gzip"
 	"encoding/json"
+	"errors"
 	"fmt"
-	"log"
+	"io"
 	"net/http"
+	"regexp"
+	"runtime"
+	"strconv"
+	"strings"
 
 	"github.com/gin-gonic/gin"
 )
 
 type TapeRequest struct {
-	TapeID string `tapeID:"mode"`
+	TapeID string `json:"tapeID"`
+}
+
+type TapeRetrieveRequest struct {
+	TapeID string `json:"tapeID"`
+
+	// Optional filters to page through large tapes
+	UrlPattern string `json:"urlPattern"`
+	Since      uint64 `json:"since"`
+	Cursor     int    `json:"cursor"`
+	Limit      int    `json:"limit"`
+
+	// gzip level from -2 (huffman only) to 9, defaults to gzip.DefaultCompression
+	CompressionLevel *int `json:"compressionLevel"`
+	// Compress on every core, output is a multi-member gzip stream
+	Parallel bool `json:"parallel"`
+}
+
+type TapeLoadPathRequest struct {
+	// Path on the proxy's host, clients are expected to run on the same machine
+	Path   string `json:"path"`
+	TapeID string `json:"tapeID"`
 }
 
 type CacheModeRequest struct {
 	Mode int `json:"mode"`
 }
 
+type ReplayModeRequest struct {
+	Mode int `json:"mode"`
+}
+
+type ReplayMatchRequest struct {
+	IgnoreParams []string `json:"ignoreParams"`
+	Method       bool     `json:"method"`
+	Body         bool     `json:"body"`
+}
+
+type ReplayTimingRequest struct {
+	// 1 reproduces recorded timings, 2 replays twice as slow, 0 as fast as possible
+	Scale float64 `json:"scale"`
+}
+
 type DialerDefinitionRequest struct {
 	Priority int `json:"priority"`
 
@@ -32,16 +74,44 @@ type DialerDefinitionRequests struct {
 	Definitions []DialerDefinitionRequest `json:"definitions"`
 }
 
-func createController(recorder *Recorder, cache *Cache, dialerSession *DialerSession) *gin.Engine {
-	router := gin.Default()
+type BypassRequest struct {
+	HostPatterns []string `json:"hostPatterns"`
+}
+
+func createController(recorder *Recorder, cache *Cache, dialerSession *DialerSession, bypass *BypassRules, metrics *MetricsCollector, verbose bool) *gin.Engine {
+	// Control calls are frequent in test suites, only log each one when asked to
+	if !verbose {
+		gin.SetMode(gin.ReleaseMode)
+	}
+	router := gin.New()
+	router.Use(gin.Recovery())
+	if verbose {
+		router.Use(gin.Logger())
+	}
 	router.GET("/", func(c *gin.Context) {
 		c.String(http.StatusOK, "Groove is running on port.")
 	})
 
 	router.POST("/api/tape/record", func(c *gin.Context) {
+		// Body is optional, without a tape ID every tape is recorded
+		var request TapeRequest
+		if err := decodeOptionalJSON(c.Request.Body, &request); err != nil {
+			c.JSON(http.StatusBadRequest, gin.H{
+				"success": false,
+				"error":   err.Error(),
+			})
+			return
+		}
+
 		// Start to record the requests, nullifying any ones from an old session
-		recorder.mode = RecorderModeWrite
-		recorder.Clear()
+		if request.TapeID == "" {
+			recorder.SetMode(RecorderModeWrite)
+			recorder.Clear()
+		} else {
+			// Other tapes keep recording or replaying undisturbed
+			recorder.ClearTapeID(request.TapeID)
+			recorder.SetTapeMode(request.TapeID, RecorderModeWrite)
+		}
 
 		c.JSON(http.StatusOK, gin.H{
 			"success": true,
@@ -49,9 +119,22 @@ func createController(recorder *Recorder, cache *Cache, dialerSession *DialerSes
 	})
 
 	router.POST("/api/tape/stop", func(c *gin.Context) {
+		var request TapeRequest
+		if err := decodeOptionalJSON(c.Request.Body, &request); err != nil {
+			c.JSON(http.StatusBadRequest, gin.H{
+				"success": false,
+				"error":   err.Error(),
+			})
+			return
+		}
+
 		// Stop recording requests, but don't call Stop because we want to keep
 		// the tape data around in case users access it
-		recorder.mode = RecorderModeOff
+		if request.TapeID == "" {
+			recorder.SetMode(RecorderModeOff)
+		} else {
+			recorder.SetTapeMode(request.TapeID, RecorderModeOff)
+		}
 
 		c.JSON(http.StatusOK, gin.H{
 			"success": true,
@@ -59,38 +142,108 @@ func createController(recorder *Recorder, cache *Cache, dialerSession *DialerSes
 	})
 
 	router.POST("/api/tape/retrieve", func(c *gin.Context) {
-		var request TapeRequest
+		var request TapeRetrieveRequest
 		err := json.NewDecoder(c.Request.Body).Decode(&request)
 
+		if err == nil && (request.Cursor < 0 || request.Limit < 0) {
+			err = errors.New("cursor and limit can't be negative")
+		}
+
+		options := TapeExport{
+			TapeID:           request.TapeID,
+			Format:           TapeFormatJSON,
+			Since:            request.Since,
+			Cursor:           request.Cursor,
+			Limit:            request.Limit,
+			CompressionLevel: gzip.DefaultCompression,
+		}
+		if err == nil && request.UrlPattern != "" {
+			options.URLPattern, err = regexp.Compile(request.UrlPattern)
+		}
+		if request.CompressionLevel != nil {
+			options.CompressionLevel = *request.CompressionLevel
+			if err == nil && (options.CompressionLevel < gzip.HuffmanOnly || options.CompressionLevel > gzip.BestCompression) {
+				err = errors.New("compression level must be between -2 and 9")
+			}
+		}
+		if request.Parallel {
+			options.Workers = runtime.GOMAXPROCS(0)
+		}
+		contentType := "application/x-gzip"
+		if strings.Contains(c.GetHeader("Accept"), TapeBinaryContentType) {
+			options.Format = TapeFormatBinary
+			contentType = TapeBinaryContentType
+		}
+
 		if err != nil {
 			c.JSON(http.StatusBadRequest, gin.H{
 				"success": false,
-				"error":   err,
+				"error":   err.Error(),
 			})
 			return
 		}
 
-		response, err := recorder.ExportData(request.TapeID)
+		page, err := recorder.ExportData(options)
 		if err != nil {
 			c.Status(http.StatusServiceUnavailable)
 			return
 		}
 
-		c.Data(http.StatusOK, "application/x-gzip", response.Bytes())
+		// Streamed, so failures partway through can only cut the response short
+		if page.NextCursor >= 0 {
+			c.Header("Tape-Next-Cursor", strconv.Itoa(page.NextCursor))
+		}
+		c.Header("Tape-Next-Since", strconv.FormatUint(page.NextSince, 10))
+		c.Header("Content-Type", contentType)
+		c.Status(http.StatusOK)
+		if err := page.Stream(c.Writer); err != nil {
+			controlLog.Errorf("Unable to export tape: %s", err)
+		}
 	})
 
 	router.POST("/api/tape/load", func(c *gin.Context) {
-		recorder.mode = RecorderModeRead
-		recorder.Clear()
+		// Decode the upload as it arrives instead of buffering the whole form first
+		// The tape ID is in the query so it's known before the upload is read
+		tapeID := c.Query("tapeID")
+		fileHandler, err := uploadedTape(c.Request)
+		if err == nil {
+			err = recorder.LoadData(fileHandler, tapeID)
+		}
 
-		file, _ := c.FormFile("file")
+		if err != nil {
+			controlLog.Warnf("Unable to load uploaded tape: %s", err)
+			c.JSON(http.StatusBadRequest, gin.H{
+				"success": false,
+				"error":   err.Error(),
+			})
+			return
+		}
+
+		setReadMode(recorder, tapeID)
+
+		c.JSON(http.StatusOK, gin.H{
+			"success": true,
+		})
+	})
+
+	router.POST("/api/tape/load_path", func(c *gin.Context) {
+		var request TapeLoadPathRequest
+		err := json.NewDecoder(c.Request.Body).Decode(&request)
+
+		if err == nil {
+			err = recorder.LoadPath(request.Path, request.TapeID)
+		}
 
-		fileHandler, err := file.Open()
 		if err != nil {
-			fmt.Println(err)
+			controlLog.Warnf("Unable to load tape from path: %s", err)
+			c.JSON(http.StatusBadRequest, gin.H{
+				"success": false,
+				"error":   err.Error(),
+			})
+			return
 		}
 
-		recorder.LoadData(fileHandler)
+		setReadMode(recorder, request.TapeID)
 
 		c.JSON(http.StatusOK, gin.H{
 			"success": true,
@@ -114,6 +267,82 @@ func createController(recorder *Recorder, cache *Cache, dialerSession *DialerSes
 		} else {
 			recorder.ClearTapeID(request.TapeID)
 		}
+
+		c.JSON(http.StatusOK, gin.H{
+			"success": true,
+		})
+	})
+
+	router.POST("/api/tape/replay_mode", func(c *gin.Context) {
+		var request ReplayModeRequest
+		err := json.NewDecoder(c.Request.Body).Decode(&request)
+
+		if err == nil && (request.Mode < ReplayModeConsume || request.Mode > ReplayModeRoundRobin) {
+			err = fmt.Errorf("Unknown replay mode: %d", request.Mode)
+		}
+
+		if err != nil {
+			c.JSON(http.StatusBadRequest, gin.H{
+				"success": false,
+				"error":   err.Error(),
+			})
+			return
+		}
+
+		recorder.SetReplayMode(request.Mode)
+		controlLog.Infof("Replay mode set: %d", request.Mode)
+
+		c.JSON(http.StatusOK, gin.H{
+			"success": true,
+		})
+	})
+
+	router.POST("/api/tape/replay_match", func(c *gin.Context) {
+		var request ReplayMatchRequest
+		err := json.NewDecoder(c.Request.Body).Decode(&request)
+
+		if err != nil {
+			c.JSON(http.StatusBadRequest, gin.H{
+				"success": false,
+				"error":   err.Error(),
+			})
+			return
+		}
+
+		recorder.SetReplayMatch(ReplayMatch{
+			IgnoreParams: request.IgnoreParams,
+			Method:       request.Method,
+			Body:         request.Body,
+		})
+
+		c.JSON(http.StatusOK, gin.H{
+			"success": true,
+		})
+	})
+
+	router.POST("/api/tape/replay_timing", func(c *gin.Context) {
+		var request ReplayTimingRequest
+		err := json.NewDecoder(c.Request.Body).Decode(&request)
+
+		// Also rejects NaN
+		if err == nil && !(request.Scale >= 0) {
+			err = fmt.Errorf("Replay time scale can't be negative: %f", request.Scale)
+		}
+
+		if err != nil {
+			c.JSON(http.StatusBadRequest, gin.H{
+				"success": false,
+				"error":   err.Error(),
+			})
+			return
+		}
+
+		recorder.SetReplayTimeScale(request.Scale)
+		controlLog.Infof("Replay time scale set: %f", request.Scale)
+
+		c.JSON(http.StatusOK, gin.H{
+			"success": true,
+		})
 	})
 
 	router.POST("/api/cache/mode", func(c *gin.Context) {
@@ -128,8 +357,8 @@ func createController(recorder *Recorder, cache *Cache, dialerSession *DialerSes
 			return
 		}
 
-		cache.mode = request.Mode
-		log.Printf("Cache mode set: %d\n", cache.mode)
+		cache.SetMode(request.Mode)
+		controlLog.Infof("Cache mode set: %d", request.Mode)
 
 		c.JSON(http.StatusOK, gin.H{
 			"success": true,
@@ -156,13 +385,15 @@ func createController(recorder *Recorder, cache *Cache, dialerSession *DialerSes
 			return
 		}
 
-		dialerSession.DialerDefinitions = nil
+		// Build the full table before publishing it, inflight requests keep using the
+		// previous table and never see a partial one
+		definitions := make([]*DialerDefinition, 0, len(requests.Definitions))
 
 		if len(requests.Definitions) == 0 {
 			// If no requests are provided, default to passing through everything
 			// so we're guaranteed to have one valid dialer
-			dialerSession.DialerDefinitions = append(
-				dialerSession.DialerDefinitions,
+			definitions = append(
+				definitions,
 				NewDialerDefinition(0, nil, nil),
 			)
 		} else {
@@ -189,8 +420,8 @@ func createController(recorder *Recorder, cache *Cache, dialerSession *DialerSes
 					}
 				}
 
-				dialerSession.DialerDefinitions = append(
-					dialerSession.DialerDefinitions,
+				definitions = append(
+					definitions,
 					NewDialerDefinition(
 						request.Priority,
 						proxy,
@@ -200,10 +431,106 @@ func createController(recorder *Recorder, cache *Cache, dialerSession *DialerSes
 			}
 		}
 
+		dialerSession.SetDialerDefinitions(definitions)
+
 		c.JSON(http.StatusOK, gin.H{
 			"success": true,
 		})
 	})
 
+	router.POST("/api/bypass/load", func(c *gin.Context) {
+		var request BypassRequest
+		err := json.NewDecoder(c.Request.Body).Decode(&request)
+
+		if err != nil {
+			c.JSON(http.StatusBadRequest, gin.H{
+				"success": false,
+				"error":   err.Error(),
+			})
+			return
+		}
+
+		if err := bypass.Load(request.HostPatterns); err != nil {
+			c.JSON(http.StatusBadRequest, gin.H{
+				"success": false,
+				"error":   err.Error(),
+			})
+			return
+		}
+
+		c.JSON(http.StatusOK, gin.H{
+			"success": true,
+		})
+	})
+
+	router.GET("/api/bypass/stats", func(c *gin.Context) {
+		c.JSON(http.StatusOK, bypass.Stats())
+	})
+
+	router.GET("/api/metrics", func(c *gin.Context) {
+		// JSON for the groove clients, ?format=prometheus for scrapers
+		if c.Query("format") == "prometheus" {
+			c.Header("Content-Type", "text/plain; version=0.0.4")
+			c.Status(http.StatusOK)
+			metrics.WritePrometheus(c.Writer)
+			return
+		}
+
+		c.JSON(http.StatusOK, metrics.Snapshot())
+	})
+
 	return router
 }
+
+func uploadedTape(request *http.Request) (io.Reader, error) {
+	/*
+	 * Tapes are either a multipart form field or the raw request body, which clients
+	 * streaming a file send with chunked transfer encoding
+	 */
+	if strings.HasPrefix(request.Header.Get("Content-Type"), "multipart/") {
+		return multipartFile(request, "file")
+	}
+	return request.Body, nil
+}
+
+func multipartFile(request *http.Request, field string) (io.Reader, error) {
+	/*
+	 * Stream a single file field of a multipart upload
+	 */
+	reader, err := request.MultipartReader()
+	if err != nil {
+		return nil, err
+	}
+
+	for {
+		part, err := reader.NextPart()
+		if err == io.EOF {
+			return nil, fmt.Errorf("Missing upload field: %s", field)
+		}
+		if err != nil {
+			return nil, err
+		}
+		if part.FormName() == field {
+			return part, nil
+		}
+	}
+}
+
+func setReadMode(recorder *Recorder, tapeID string) {
+	if tapeID == "" {
+		recorder.SetMode(RecorderModeRead)
+	} else {
+		recorder.SetTapeMode(tapeID, RecorderModeRead)
+	}
+}
+
+func decodeOptionalJSON(body io.Reader, value interface{}) error {
+	/*
+	 * Decode a JSON request body, leaving value unchanged if the body is empty
+	 */
+	err := json.NewDecoder(body).Decode(value)
+	if err == io.EOF {
+		return nil
+	}
+	return err
+}
@@ -1,12 +1,13 @@
 package main
 
 import (
-	"log"
 	"math/rand"
 	"net"
 	"net/http"
 	"net/url"
 	"regexp"
+	"sync/atomic"
+	"time"
 
 	"github.com/google/uuid"
 )
@@ -42,7 +43,7 @@ func (definition *RequestRequiresDefinition) IsRequestValid(context *DialerConte
 
 	if definition.urlRegex != nil {
 		if definition.urlRegex.MatchString(request.URL.String()) {
-			log.Printf("Request URL matches regex %s", request.URL.String())
+			dialerLog.Debugf("Request URL matches regex %s", request.URL)
 			return true
 		}
 	}
@@ -50,13 +51,13 @@ func (definition *RequestRequiresDefinition) IsRequestValid(context *DialerConte
 	if len(definition.resourceTypes) > 0 {
 		for _, resourceType := range definition.resourceTypes {
 			if requestType == resourceType {
-				log.Printf("Resource type matches %s", requestType)
+				dialerLog.Debugf("Resource type matches %s", requestType)
 				return true
 			}
 		}
 	}
 
-	log.Println("No request match found")
+	dialerLog.Debugf("No request match found")
 	return false
 }
 
@@ -88,6 +89,27 @@ type DialerDefinition struct {
 	requestRequires *RequestRequiresDefinition
 
 	Dial func(network, addr string) (net.Conn, error)
+
+	stats *DialerStats
+}
+
+type DialerStats struct {
+	/*
+	 * Round trips made through a single dialer, kept with the definition so the counters
+	 * are dropped along with it when clients load a new dialer table
+	 */
+	Attempts int64
+	Failures int64
+
+	latency *Histogram
+}
+
+func (stats *DialerStats) RecordAttempt(start time.Time, failed bool) {
+	atomic.AddInt64(&stats.Attempts, 1)
+	if failed {
+		atomic.AddInt64(&stats.Failures, 1)
+	}
+	stats.latency.ObserveSince(start)
 }
 
 func NewDialerDefinition(
@@ -100,17 +122,17 @@ func NewDialerDefinition(
 
 	if proxy != nil {
 		if len(proxy.username) > 0 && len(proxy.password) > 0 {
-			log.Println("Creating authenticated end proxy dialer...")
+			dialerLog.Infof("Creating authenticated end proxy dialer")
 
 			connectReqHandler := func(req *http.Request) {
-				log.Printf("Will set basic auth on proxy connect %s %s\n", proxy.username, proxy.password)
+				dialerLog.Debugf("Will set basic auth on proxy connect for %s", proxy.username)
 				SetBasicAuth(proxy.username, proxy.password, req)
 			}
 			// This is an unideal dependency to have since the dialer doesn't really relate to the proxy
 			// other than forwarding some dial through the proxy's built-in dialer
 			dialer = NewConnectDialToProxyWithHandler(proxy.url, connectReqHandler)
 		} else {
-			log.Println("Creating unauthenticated end proxy dialer...")
+			dialerLog.Infof("Creating unauthenticated end proxy dialer")
 			dialer = NewConnectDialToProxyWithHandler(proxy.url, nil)
 		}
 
@@ -124,6 +146,7 @@ func NewDialerDefinition(
 		proxy:           proxy,
 		requestRequires: requestRequires,
 		Dial:            dialer,
+		stats:           &DialerStats{latency: NewHistogram()},
 	}
 }
 
@@ -156,6 +179,10 @@ type DialerContext struct {
 	// List of DialDefinitions that we have already tried
 	attemptedDialIdentifiers []string
 
+	// Dialer table at the time the context was created, retries stay within this table
+	// even if the control API swaps in a new one mid-request
+	dialers []*DialerDefinition
+
 	// Remaining dials that are available
 	remainingTries int
 }
@@ -165,7 +192,7 @@ type DialerSession struct {
 	 * Primary object and storage structure for dial generation. Only one of these should
 	 * be instantiated per groove instance.
 	 */
-	DialerDefinitions []*DialerDefinition
+	config *ConfigStore
 
 	// Attempts allowed in each context to dial a successful connection to the open internet
 	// If zero, will try all available dials
@@ -175,24 +202,41 @@ type DialerSession struct {
 	// (dialer definition, host) -> success probabilities
 }
 
-func NewDialerSession() *DialerSession {
+func NewDialerSession(config *ConfigStore) *DialerSession {
 	return &DialerSession{
-		DialerDefinitions: make([]*DialerDefinition, 0),
-		TotalTries:        0,
+		config:     config,
+		TotalTries: 0,
 	}
 }
 
+func (session *DialerSession) DialerDefinitions() []*DialerDefinition {
+	return session.config.Load().Dialers
+}
+
+func (session *DialerSession) SetDialerDefinitions(definitions []*DialerDefinition) {
+	session.config.Update(func(config *RuntimeConfig) {
+		config.Dialers = definitions
+	})
+}
+
 func (session *DialerSession) NewDialerContext(request *http.Request) *DialerContext {
+	dialers := session.DialerDefinitions()
+
 	totalTries := session.TotalTries
 	if totalTries == 0 {
-		totalTries = len(session.DialerDefinitions)
+		totalTries = len(dialers)
 	}
 
-	requestType := request.Header.Get(ProxyResourceType)
+	// Connection level dials (CONNECT tunnels) don't have a request yet
+	requestType := ""
+	if request != nil {
+		requestType = request.Header.Get(ProxyResourceType)
+	}
 
 	return &DialerContext{
 		Request:        request,
 		requestType:    requestType,
+		dialers:        dialers,
 		remainingTries: totalTries,
 	}
 }
@@ -203,7 +247,7 @@ func (session *DialerSession) candidateDialers(context *DialerContext) []*Dialer
 	 * param: request - nil if we don't know the request yet, true if we just need to open
 	 * 	a connection over the wire for a non-http protocol like for websockets
 	 */
-	candidateDialers := session.DialerDefinitions
+	candidateDialers := context.dialers
 
 	// If request is provided, attempt to filter for the possible dialers
 	if context.Request != nil {
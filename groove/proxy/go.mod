@@ -11,6 +11,7 @@ require (
 	github.com/pquerna/cachecontrol v0.1.0
 	github.com/refraction-networking/utls v1.2.0
 	golang.org/x/net v0.1.0
+	golang.org/x/sys v0.1.0
 )
 
 require (
@@ -31,7 +32,6 @@ require (
 	github.com/peterbourgon/diskv/v3 v3.0.1 // indirect
 	github.com/ugorji/go/codec v1.2.7 // indirect
 	golang.org/x/crypto v0.1.0 // indirect
-	golang.org/x/sys v0.1.0 // indirect
 	golang.org/x/text v0.4.0 // indirect
 	google.golang.org/protobuf v1.28.0 // indirect
 	gopkg.in/yaml.v2 v2.4.0 // indirect
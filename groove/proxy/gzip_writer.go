@@ -0,0 +1,127 @@
+package main
+
+import (
+	"bytes"
+	"compress/gzip"
+	"io"
+	"sync"
+)
+
+// Uncompressed bytes per gzip member, large enough that the per-member overhead is negligible
+const parallelGzipBlockSize = 1 << 20
+
+type parallelGzipWriter struct {
+	/*
+	 * Compresses fixed size blocks as independent gzip members on a pool of goroutines
+	 *
+	 * Concatenated members are a single valid gzip stream (RFC 1952 section 2.2), so the
+	 * standard readers in Go, Python and Node decompress the output like any other gzip file.
+	 * Members are written in order, at most `workers` blocks are held in memory at once.
+	 */
+	writer  io.Writer
+	level   int
+	workers int
+
+	buffer  []byte
+	written bool
+
+	// Result channels of submitted blocks, in the order they have to be written
+	queue chan chan []byte
+	done  chan struct{}
+
+	errLock sync.Mutex
+	err     error
+}
+
+func newParallelGzipWriter(writer io.Writer, level int, workers int) (*parallelGzipWriter, error) {
+	// Surface invalid levels before any goroutines start
+	if _, err := gzip.NewWriterLevel(io.Discard, level); err != nil {
+		return nil, err
+	}
+
+	gzipWriter := &parallelGzipWriter{
+		writer:  writer,
+		level:   level,
+		workers: workers,
+		buffer:  make([]byte, 0, parallelGzipBlockSize),
+		queue:   make(chan chan []byte, workers),
+		done:    make(chan struct{}),
+	}
+	go gzipWriter.writeLoop()
+
+	return gzipWriter, nil
+}
+
+func (gzipWriter *parallelGzipWriter) Write(p []byte) (int, error) {
+	if err := gzipWriter.error(); err != nil {
+		return 0, err
+	}
+
+	written := len(p)
+	for len(p) > 0 {
+		space := parallelGzipBlockSize - len(gzipWriter.buffer)
+		if space > len(p) {
+			space = len(p)
+		}
+		gzipWriter.buffer = append(gzipWriter.buffer, p[:space]...)
+		p = p[space:]
+
+		if len(gzipWriter.buffer) == parallelGzipBlockSize {
+			gzipWriter.submit()
+		}
+	}
+
+	return written, nil
+}
+
+func (gzipWriter *parallelGzipWriter) Close() error {
+	// An empty stream still needs one member to be valid gzip
+	if len(gzipWriter.buffer) > 0 || !gzipWriter.written {
+		gzipWriter.submit()
+	}
+
+	close(gzipWriter.queue)
+	<-gzipWriter.done
+
+	return gzipWriter.error()
+}
+
+func (gzipWriter *parallelGzipWriter) submit() {
+	block := gzipWriter.buffer
+	gzipWriter.buffer = make([]byte, 0, parallelGzipBlockSize)
+	gzipWriter.written = true
+
+	result := make(chan []byte, 1)
+	// Blocks once `workers` blocks are waiting to be written
+	gzipWriter.queue <- result
+
+	go func() {
+		var compressed bytes.Buffer
+		member, _ := gzip.NewWriterLevel(&compressed, gzipWriter.level)
+		member.Write(block)
+		member.Close()
+		result <- compressed.Bytes()
+	}()
+}
+
+func (gzipWriter *parallelGzipWriter) writeLoop() {
+	defer close(gzipWriter.done)
+
+	for result := range gzipWriter.queue {
+		compressed := <-result
+		if gzipWriter.error() != nil {
+			continue
+		}
+		if _, err := gzipWriter.writer.Write(compressed); err != nil {
+			gzipWriter.errLock.Lock()
+			gzipWriter.err = err
+			gzipWriter.errLock.Unlock()
+		}
+	}
+}
+
+func (gzipWriter *parallelGzipWriter) error() error {
+	gzipWriter.errLock.Lock()
+	defer gzipWriter.errLock.Unlock()
+	return gzipWriter.err
+}
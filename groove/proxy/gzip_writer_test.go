@@ -0,0 +1,54 @@
+package main
+
+import (
+	"bytes"
+	"compress/gzip"
+	"io"
+	"testing"
+)
+
+func TestParallelGzipWriter(t *testing.T) {
+	tests := []struct {
+		name string
+		size int
+	}{
+		{"empty", 0},
+		{"single block", 1000},
+		{"many blocks", 5*parallelGzipBlockSize + 17},
+	}
+
+	for _, test := range tests {
+		payload := bytes.Repeat([]byte("groove "), test.size/7+1)[:test.size]
+
+		var compressed bytes.Buffer
+		writer, err := newParallelGzipWriter(&compressed, gzip.DefaultCompression, 4)
+		if err != nil {
+			t.Fatal(err)
+		}
+		// Uneven writes cross block boundaries
+		for offset := 0; offset < len(payload); offset += 300000 {
+			writer.Write(payload[offset:minInt(offset+300000, len(payload))])
+		}
+		if err := writer.Close(); err != nil {
+			t.Fatal(err)
+		}
+
+		reader, err := gzip.NewReader(&compressed)
+		if err != nil {
+			t.Fatalf("%s: %s", test.name, err)
+		}
+		decompressed, err := io.ReadAll(reader)
+		if err != nil {
+			t.Fatalf("%s: %s", test.name, err)
+		}
+		if !bytes.Equal(decompressed, payload) {
+			t.Errorf("%s: round trip mismatch, got %d bytes", test.name, len(decompressed))
+		}
+	}
+}
+
+func TestParallelGzipWriterLevel(t *testing.T) {
+	if _, err := newParallelGzipWriter(io.Discard, 12, 4); err == nil {
+		t.Error("Expected an invalid compression level to be rejected")
+	}
+}
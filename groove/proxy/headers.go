@@ -2,6 +2,7 @@ package main
 
 import (
 	"net/http"
+	"time"
 
 	goproxy "github.com/piercefreeman/goproxy"
 )
@@ -9,6 +10,12 @@ import (
 type HeaderDefinition struct {
 	tapeID       string
 	resourceType string
+
+	// Client asked for a Server-Timing breakdown on the response
+	requestTiming bool
+
+	// Timings are collected for every request so they can be stored on tapes
+	timer *requestTimer
 }
 
 // Don't prefix with `Prefix` - chromium appears to have specific manipulation
@@ -16,6 +23,9 @@ type HeaderDefinition struct {
 const (
 	ProxyResourceType   = "Resource-Type"
 	ProxyTapeIdentifier = "Tape-ID"
+
+	// Any non-empty value will add a Server-Timing header to the response
+	ProxyRequestTiming = "Request-Timing"
 )
 
 func setupHeadersMiddleware(proxy *goproxy.ProxyHttpServer) {
@@ -24,13 +34,23 @@ func setupHeadersMiddleware(proxy *goproxy.ProxyHttpServer) {
 	 */
 	proxy.OnRequest().DoFunc(
 		func(r *http.Request, ctx *goproxy.ProxyCtx) (*http.Request, *http.Response) {
+			defer headersStage.request.ObserveSince(time.Now())
+
+			timer := newRequestTimer()
+
 			ctx.UserData = &HeaderDefinition{
-				tapeID:       r.Header.Get(ProxyTapeIdentifier),
-				resourceType: r.Header.Get(ProxyResourceType),
+				tapeID:        r.Header.Get(ProxyTapeIdentifier),
+				resourceType:  r.Header.Get(ProxyResourceType),
+				requestTiming: r.Header.Get(ProxyRequestTiming) != "",
+				timer:         timer,
 			}
 
 			// Remove the extracted keys so they're not passed on
 			r.Header.Del(ProxyTapeIdentifier)
+			r.Header.Del(ProxyRequestTiming)
+
+			// The round tripper only sees the request, it finds the timer through the context
+			r = withRequestTimer(r, timer)
 
 			// Currently ProxyResourceType is also consumed directly by the dialer, which doesn't
 			// have access to the larger context. Keep it redundant for now.
@@ -0,0 +1,93 @@
+package main
+
+import (
+	"crypto"
+	"crypto/ecdsa"
+	"crypto/elliptic"
+	"crypto/rand"
+	"crypto/rsa"
+	"fmt"
+	"time"
+)
+
+const (
+	KeyTypeRSA   = "rsa"
+	KeyTypeECDSA = "ecdsa"
+)
+
+// Wait between failed background generations, doubling up to the maximum
+const (
+	keyPoolRetryMin = 100 * time.Millisecond
+	keyPoolRetryMax = 30 * time.Second
+)
+
+type KeyPool struct {
+	/*
+	 * Bounded pool of private keys that are generated ahead of time in the background
+	 *
+	 * Key generation is the dominant cost of signing a new leaf certificate, so we keep a
+	 * handful ready to go. On a cold CONNECT the request path just pulls a key and signs.
+	 * If the pool runs dry we fall back to generating inline.
+	 */
+	keyType string
+	keys    chan crypto.Signer
+}
+
+func NewKeyPool(keyType string, size int) (*KeyPool, error) {
+	if keyType != KeyTypeRSA && keyType != KeyTypeECDSA {
+		return nil, fmt.Errorf("Unknown certificate key type: %s", keyType)
+	}
+
+	pool := &KeyPool{
+		keyType: keyType,
+		keys:    make(chan crypto.Signer, size),
+	}
+
+	// A zero-sized pool disables background generation entirely
+	if size > 0 {
+		go pool.fill()
+	}
+
+	return pool, nil
+}
+
+func (pool *KeyPool) fill() {
+	/*
+	 * Keep the pool topped up - the channel send blocks once we're at capacity
+	 * so this only does work when keys are consumed
+	 *
+	 * Failures back off instead of spinning, Get generates inline while the pool is empty.
+	 */
+	retry := keyPoolRetryMin
+	for {
+		key, err := generateKey(pool.keyType)
+		if err != nil {
+			certLog.Errorf("Unable to pre-generate certificate key, retrying in %s: %s", retry, err)
+			time.Sleep(retry)
+			retry *= 2
+			if retry > keyPoolRetryMax {
+				retry = keyPoolRetryMax
+			}
+			continue
+		}
+		retry = keyPoolRetryMin
+		pool.keys <- key
+	}
+}
+
+func (pool *KeyPool) Get() (crypto.Signer, error) {
+	select {
+	case key := <-pool.keys:
+		return key, nil
+	default:
+		// Pool is exhausted (burst of new hosts), don't wait on the background worker
+		return generateKey(pool.keyType)
+	}
+}
+
+func generateKey(keyType string) (crypto.Signer, error) {
+	if keyType == KeyTypeECDSA {
+		return ecdsa.GenerateKey(elliptic.P256(), rand.Reader)
+	}
+	return rsa.GenerateKey(rand.Reader, 2048)
+}
@@ -0,0 +1,222 @@
+package main
+
+import (
+	"bufio"
+	"bytes"
+	"context"
+	"crypto/tls"
+	"errors"
+	"io"
+	"log"
+	"net"
+	"net/http"
+	"os"
+	"strconv"
+	"sync"
+	"time"
+
+	goproxy "github.com/piercefreeman/goproxy"
+	"golang.org/x/net/http2"
+)
+
+func serveProxy(addr string, handler http.Handler, listenerCount int) error {
+	/*
+	 * Serve the proxy from listenerCount independent accept loops
+	 *
+	 * Each loop binds its own socket to the same address with SO_REUSEPORT, so the kernel
+	 * balances new connections across them instead of funneling every accept through
+	 * one socket.
+	 */
+	if listenerCount <= 1 {
+		return http.ListenAndServe(addr, handler)
+	}
+
+	listenConfig := net.ListenConfig{Control: setReusePort}
+	errs := make(chan error, listenerCount)
+
+	for i := 0; i < listenerCount; i++ {
+		listener, err := listenConfig.Listen(context.Background(), "tcp", addr)
+		if err != nil {
+			return err
+		}
+
+		go func() {
+			errs <- http.Serve(listener, handler)
+		}()
+	}
+
+	log.Printf("Serving proxy from %d SO_REUSEPORT listeners", listenerCount)
+
+	// Any accept loop failing is fatal, same as the single listener case
+	return <-errs
+}
+
+func serveControlUnix(socketPath string, handler http.Handler) error {
+	/*
+	 * Expose the control API over a unix domain socket. Clients on the same host skip
+	 * the TCP stack entirely, which matters when test suites issue thousands of calls.
+	 */
+	// Clean up a stale socket from a previous run that didn't shut down gracefully
+	if err := os.Remove(socketPath); err != nil && !os.IsNotExist(err) {
+		return err
+	}
+
+	listener, err := net.Listen("unix", socketPath)
+	if err != nil {
+		return err
+	}
+	defer os.Remove(socketPath)
+
+	return http.Serve(listener, handler)
+}
+
+func serveProxyTLS(addr string, handler http.Handler, keyPool *KeyPool) error {
+	/*
+	 * Serve the proxy over TLS with a certificate from the groove CA
+	 *
+	 * Clients that negotiate h2 can multiplex all of their requests to the proxy over a
+	 * single connection, instead of being capped to a handful of HTTP/1.1 connections
+	 * per proxy.
+	 */
+	key, err := keyPool.Get()
+	if err != nil {
+		return err
+	}
+	cert, err := signHost(goproxy.GoproxyCa, []string{"localhost", "127.0.0.1", "::1"}, key)
+	if err != nil {
+		return err
+	}
+
+	server := &http.Server{
+		Addr:    addr,
+		Handler: http2ConnectHandler(handler),
+		TLSConfig: &tls.Config{
+			Certificates: []tls.Certificate{*cert},
+		},
+	}
+
+	if err := http2.ConfigureServer(server, &http2.Server{}); err != nil {
+		return err
+	}
+
+	return server.ListenAndServeTLS("", "")
+}
+
+func http2ConnectHandler(handler http.Handler) http.Handler {
+	/*
+	 * goproxy handles CONNECT by hijacking the underlying connection, which HTTP/2 streams
+	 * don't support. For CONNECTs that arrive over h2 we hand goproxy a net.Conn backed by
+	 * the stream instead, and keep the stream open until goproxy closes that conn.
+	 */
+	return http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		if r.ProtoMajor != 2 || r.Method != http.MethodConnect {
+			handler.ServeHTTP(w, r)
+			return
+		}
+
+		writer := &http2ConnectWriter{ResponseWriter: w, request: r}
+		handler.ServeHTTP(writer, r)
+
+		// Returning from the handler ends the stream
+		if writer.conn != nil {
+			<-writer.conn.closed
+		}
+	})
+}
+
+type http2ConnectWriter struct {
+	http.ResponseWriter
+	request *http.Request
+
+	conn *http2StreamConn
+}
+
+func (w *http2ConnectWriter) Hijack() (net.Conn, *bufio.ReadWriter, error) {
+	if w.conn != nil {
+		return nil, nil, errors.New("Stream already hijacked")
+	}
+
+	w.conn = &http2StreamConn{
+		writer:     w.ResponseWriter,
+		body:       w.request.Body,
+		remoteAddr: http2StreamAddr(w.request.RemoteAddr),
+		closed:     make(chan struct{}),
+	}
+	return w.conn, bufio.NewReadWriter(bufio.NewReader(w.conn), bufio.NewWriter(w.conn)), nil
+}
+
+type http2StreamAddr string
+
+func (addr http2StreamAddr) Network() string { return "tcp" }
+func (addr http2StreamAddr) String() string  { return string(addr) }
+
+type http2StreamConn struct {
+	/*
+	 * net.Conn over a single h2 CONNECT stream. Reads come from the request body (client
+	 * DATA frames) and writes are flushed as response DATA frames.
+	 */
+	writer     http.ResponseWriter
+	body       io.ReadCloser
+	remoteAddr net.Addr
+
+	// Hijackers write an HTTP/1 status line before tunneling, h2 sends that as a HEADERS frame
+	wroteHeader bool
+
+	closed    chan struct{}
+	closeOnce sync.Once
+}
+
+func (conn *http2StreamConn) Read(b []byte) (int, error) {
+	return conn.body.Read(b)
+}
+
+func (conn *http2StreamConn) Write(b []byte) (int, error) {
+	written := len(b)
+
+	if !conn.wroteHeader {
+		conn.wroteHeader = true
+
+		statusCode := http.StatusOK
+		if bytes.HasPrefix(b, []byte("HTTP/1.")) {
+			headerEnd := bytes.Index(b, []byte("\r\n\r\n"))
+			if headerEnd == -1 {
+				return 0, errors.New("Partial status line written to h2 stream")
+			}
+			if len(b) >= 12 {
+				if code, err := strconv.Atoi(string(b[9:12])); err == nil {
+					statusCode = code
+				}
+			}
+			b = b[headerEnd+4:]
+		}
+
+		conn.writer.WriteHeader(statusCode)
+	}
+
+	if len(b) > 0 {
+		if _, err := conn.writer.Write(b); err != nil {
+			return 0, err
+		}
+	}
+	if flusher, ok := conn.writer.(http.Flusher); ok {
+		flusher.Flush()
+	}
+
+	return written, nil
+}
+
+func (conn *http2StreamConn) Close() error {
+	conn.closeOnce.Do(func() {
+		conn.body.Close()
+		close(conn.closed)
+	})
+	return nil
+}
+
+func (conn *http2StreamConn) LocalAddr() net.Addr  { return http2StreamAddr("") }
+func (conn *http2StreamConn) RemoteAddr() net.Addr { return conn.remoteAddr }
+
+// Deadlines aren't exposed on h2 response writers, the stream lifetime is owned by the server
+func (conn *http2StreamConn) SetDeadline(t time.Time) error      { return nil }
+func (conn *http2StreamConn) SetReadDeadline(t time.Time) error  { return nil }
+func (conn *http2StreamConn) SetWriteDeadline(t time.Time) error { return nil }
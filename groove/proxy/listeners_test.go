@@ -0,0 +1,58 @@
+package main
+
+import (
+	"crypto/tls"
+	"io"
+	"net/http"
+	"net/http/httptest"
+	"testing"
+)
+
+func TestHTTP2ConnectHijack(t *testing.T) {
+	// Mimics goproxy: hijack the CONNECT, write an HTTP/1 status line, then tunnel bytes
+	echoHandler := http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		conn, _, err := w.(http.Hijacker).Hijack()
+		if err != nil {
+			t.Error(err)
+			return
+		}
+		conn.Write([]byte("HTTP/1.0 200 OK\r\n\r\n"))
+		go func() {
+			io.Copy(conn, conn)
+			conn.Close()
+		}()
+	})
+
+	server := httptest.NewUnstartedServer(http2ConnectHandler(echoHandler))
+	server.EnableHTTP2 = true
+	server.StartTLS()
+	defer server.Close()
+
+	client := &http.Client{
+		Transport: &http.Transport{
+			TLSClientConfig:   &tls.Config{InsecureSkipVerify: true},
+			ForceAttemptHTTP2: true,
+		},
+	}
+
+	bodyReader, bodyWriter := io.Pipe()
+	request, _ := http.NewRequest(http.MethodConnect, server.URL, bodyReader)
+	request.Host = "example.com:443"
+
+	response, err := client.Do(request)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if response.ProtoMajor != 2 || response.StatusCode != http.StatusOK {
+		t.Fatalf("Unexpected CONNECT response: %s %d", response.Proto, response.StatusCode)
+	}
+
+	bodyWriter.Write([]byte("ping"))
+	echo := make([]byte, 4)
+	if _, err := io.ReadFull(response.Body, echo); err != nil || string(echo) != "ping" {
+		t.Fatalf("Unexpected tunnel echo: %q %v", echo, err)
+	}
+
+	bodyWriter.Close()
+	response.Body.Close()
+}
@@ -0,0 +1,144 @@
+package main
+
+import (
+	"fmt"
+	"log"
+	"strconv"
+	"strings"
+	"sync/atomic"
+)
+
+const (
+	LogLevelDebug = iota
+	LogLevelInfo  = iota
+	LogLevelWarn  = iota
+	LogLevelError = iota
+
+	// Suppress everything, including errors
+	LogLevelQuiet = iota
+)
+
+var logLevelNames = []string{"debug", "info", "warn", "error", "quiet"}
+
+// Global threshold shared by all categories, read on every log call so it's kept atomic
+var logLevel int32 = LogLevelInfo
+
+// Every category logger, keyed by name, so sample rates can be configured from flags
+var loggers = make(map[string]*Logger)
+
+type Logger struct {
+	/*
+	 * Leveled logger for a single subsystem
+	 *
+	 * Hot path code logs at debug level, so the default level keeps requests free of
+	 * formatting and stdout writes. Debug and info messages can also be sampled per category
+	 * to keep the noisiest subsystems readable when debugging under load. Warnings and
+	 * errors are never sampled.
+	 */
+	category string
+
+	// Emit 1 of every sampleRate debug/info messages, 0 and 1 both log everything
+	sampleRate uint64
+	counter    uint64
+}
+
+var (
+	cacheLog     = NewLogger("cache")
+	certLog      = NewLogger("cert")
+	controlLog   = NewLogger("control")
+	dialerLog    = NewLogger("dialer")
+	recorderLog  = NewLogger("recorder")
+	transportLog = NewLogger("transport")
+	tunnelLog    = NewLogger("tunnel")
+)
+
+func NewLogger(category string) *Logger {
+	logger := &Logger{category: category}
+	loggers[category] = logger
+	return logger
+}
+
+func configureLogging(level string, samples string) error {
+	/*
+	 * Apply command line logging settings
+	 * level: one of debug | info | warn | error | quiet
+	 * samples: comma separated category=rate pairs, ie. "cache=100,dialer=10"
+	 */
+	levelValue := -1
+	for value, name := range logLevelNames {
+		if name == level {
+			levelValue = value
+		}
+	}
+	if levelValue == -1 {
+		return fmt.Errorf("Unknown log level: %s", level)
+	}
+	atomic.StoreInt32(&logLevel, int32(levelValue))
+
+	if samples == "" {
+		return nil
+	}
+
+	for _, sample := range strings.Split(samples, ",") {
+		category, rateValue, found := strings.Cut(sample, "=")
+		if !found {
+			return fmt.Errorf("Invalid log sample, expected category=rate: %s", sample)
+		}
+
+		logger, ok := loggers[category]
+		if !ok {
+			return fmt.Errorf("Unknown log category: %s", category)
+		}
+
+		rate, err := strconv.ParseUint(rateValue, 10, 64)
+		if err != nil {
+			return fmt.Errorf("Invalid log sample rate for %s: %w", category, err)
+		}
+		atomic.StoreUint64(&logger.sampleRate, rate)
+	}
+
+	return nil
+}
+
+func (logger *Logger) Enabled(level int) bool {
+	/*
+	 * Guard for log calls whose arguments are expensive to compute
+	 */
+	return int32(level) >= atomic.LoadInt32(&logLevel)
+}
+
+func (logger *Logger) Debugf(format string, args ...interface{}) {
+	logger.output(LogLevelDebug, format, args)
+}
+
+func (logger *Logger) Infof(format string, args ...interface{}) {
+	logger.output(LogLevelInfo, format, args)
+}
+
+func (logger *Logger) Warnf(format string, args ...interface{}) {
+	logger.output(LogLevelWarn, format, args)
+}
+
+func (logger *Logger) Errorf(format string, args ...interface{}) {
+	logger.output(LogLevelError, format, args)
+}
+
+func (logger *Logger) output(level int, format string, args []interface{}) {
+	if !logger.Enabled(level) {
+		return
+	}
+
+	if level < LogLevelWarn {
+		sampleRate := atomic.LoadUint64(&logger.sampleRate)
+		if sampleRate > 1 && atomic.AddUint64(&logger.counter, 1)%sampleRate != 1 {
+			return
+		}
+	}
+
+	log.Printf(
+		"level=%s category=%s msg=%q",
+		logLevelNames[level],
+		logger.category,
+		fmt.Sprintf(format, args...),
+	)
+}
@@ -0,0 +1,159 @@
+package main
+
+import (
+	"bytes"
+	"io"
+	"log"
+	"net/http"
+	"net/http/httptest"
+	"net/url"
+	"os"
+	"strings"
+	"testing"
+	"time"
+
+	goproxy "github.com/piercefreeman/goproxy"
+)
+
+func captureLogs(t testing.TB) *bytes.Buffer {
+	var output bytes.Buffer
+	log.SetOutput(&output)
+	t.Cleanup(func() {
+		log.SetOutput(os.Stderr)
+		configureLogging("info", "")
+	})
+	return &output
+}
+
+func TestLoggerLevels(t *testing.T) {
+	output := captureLogs(t)
+	logger := NewLogger("test-levels")
+
+	tests := []struct {
+		level    string
+		expected int
+	}{
+		{"debug", 4},
+		{"info", 3},
+		{"warn", 2},
+		{"error", 1},
+		{"quiet", 0},
+	}
+
+	for _, test := range tests {
+		output.Reset()
+		if err := configureLogging(test.level, ""); err != nil {
+			t.Fatal(err)
+		}
+
+		logger.Debugf("debug")
+		logger.Infof("info")
+		logger.Warnf("warn")
+		logger.Errorf("error")
+
+		if lines := strings.Count(output.String(), "\n"); lines != test.expected {
+			t.Errorf("Level %s: expected %d lines, got %d", test.level, test.expected, lines)
+		}
+	}
+}
+
+func TestLoggerSampling(t *testing.T) {
+	output := captureLogs(t)
+	logger := NewLogger("test-sampling")
+
+	if err := configureLogging("debug", "test-sampling=10"); err != nil {
+		t.Fatal(err)
+	}
+
+	for i := 0; i < 100; i++ {
+		logger.Debugf("request %d", i)
+	}
+	if lines := strings.Count(output.String(), "\n"); lines != 10 {
+		t.Errorf("Expected 10 sampled lines, got %d", lines)
+	}
+
+	// Warnings are never sampled
+	output.Reset()
+	for i := 0; i < 100; i++ {
+		logger.Warnf("failure %d", i)
+	}
+	if lines := strings.Count(output.String(), "\n"); lines != 100 {
+		t.Errorf("Expected 100 warning lines, got %d", lines)
+	}
+}
+
+func TestConfigureLoggingInvalid(t *testing.T) {
+	captureLogs(t)
+
+	tests := []struct {
+		level   string
+		samples string
+	}{
+		{"verbose", ""},
+		{"debug", "cache"},
+		{"debug", "missing=10"},
+		{"debug", "cache=often"},
+	}
+
+	for _, test := range tests {
+		if err := configureLogging(test.level, test.samples); err == nil {
+			t.Errorf("Expected error for level=%s samples=%s", test.level, test.samples)
+		}
+	}
+}
+
+func BenchmarkProxyLogLevels(b *testing.B) {
+	/*
+	 * Requests per second through the proxy pipeline at each log level
+	 * go test -run '^$' -bench ProxyLogLevels
+	 */
+	upstream := httptest.NewServer(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		w.Write([]byte("groove"))
+	}))
+	defer upstream.Close()
+
+	for _, level := range logLevelNames {
+		b.Run(level, func(b *testing.B) {
+			// Measure the cost of producing log lines, not of the terminal consuming them
+			captureLogs(b)
+			log.SetOutput(io.Discard)
+
+			if err := configureLogging(level, ""); err != nil {
+				b.Fatal(err)
+			}
+
+			config := NewConfigStore()
+			recorder := NewRecorder(config, nil)
+			recorder.SetMode(RecorderModeWrite)
+			dialerSession := NewDialerSession(config)
+			dialerSession.SetDialerDefinitions([]*DialerDefinition{NewDialerDefinition(0, nil, nil)})
+
+			proxy := goproxy.NewProxyHttpServer()
+			proxy.Verbose = level == "debug"
+			proxy.Logger = log.New(io.Discard, "", 0)
+			proxy.RoundTripper = NewCustomRoundTripper(dialerSession)
+			setupHeadersMiddleware(proxy)
+			setupRecorderMiddleware(proxy, recorder)
+
+			proxyServer := httptest.NewServer(proxy)
+			defer proxyServer.Close()
+
+			proxyURL, _ := url.Parse(proxyServer.URL)
+			client := &http.Client{Transport: &http.Transport{Proxy: http.ProxyURL(proxyURL)}}
+
+			b.ResetTimer()
+			start := time.Now()
+
+			for i := 0; i < b.N; i++ {
+				response, err := client.Get(upstream.URL)
+				if err != nil {
+					b.Fatal(err)
+				}
+				io.Copy(io.Discard, response.Body)
+				response.Body.Close()
+			}
+
+			b.ReportMetric(float64(b.N)/time.Since(start).Seconds(), "req/s")
+		})
+	}
+}
@@ -4,6 +4,7 @@ package main
 import (
 	"flag"
 	"fmt"
+	"io"
 	"log"
 	"net"
 	"net/http"
@@ -27,10 +28,15 @@ func main() {
 	}
 
 	var (
-		verbose     = flag.Bool("v", true, "should every proxy request be logged to stdout")
+		verbose     = flag.Bool("v", false, "log every proxy request to stdout, implies -log-level debug")
 		port        = flag.Int("port", 6010, "proxy http listen address")
+		tlsPort     = flag.Int("tls-port", 0, "proxy https listen address, serves HTTP/2 to clients (0 disables)")
 		controlPort = flag.Int("control-port", 6011, "control API listen address")
 
+		// Additional listeners
+		listenerCount = flag.Int("listeners", 1, "number of SO_REUSEPORT accept loops for the proxy port")
+		controlSocket = flag.String("control-socket", "", "also serve the control API on this unix domain socket")
+
 		// Location to CA
 		caCertificate = flag.String("ca-certificate", "", "Path to CA Certificate")
 		caKey         = flag.String("ca-key", "", "Path to CA Key")
@@ -38,32 +44,89 @@ func main() {
 		// Cache size (in memory)
 		cacheMemorySize = flag.Int("cache-memory-mb", 25, "cache memory size")
 
+		// Larger bodies stream through without being recorded or cached
+		captureMaxSize = flag.Int("capture-max-mb", 64, "largest request or response body to keep for tapes and the cache")
+
+		// Write recordings ahead to disk instead of holding them in memory
+		tapeDirectory = flag.String("tape-dir", "", "record tapes to segment files in this directory, recovered on restart")
+
+		// Leaf certificate generation
+		certKeyType     = flag.String("cert-key-type", KeyTypeECDSA, "Key type for generated host certificates (ecdsa | rsa)")
+		certKeyPoolSize = flag.Int("cert-key-pool", 16, "Number of host certificate keys to pre-generate in the background")
+		certWildcard    = flag.Bool("cert-wildcard", false, "Share one wildcard certificate across subdomains of the same registrable domain")
+
+		// Logging
+		logLevel  = flag.String("log-level", "info", "minimum level to log (debug | info | warn | error | quiet)")
+		logSample = flag.String("log-sample", "", "log 1 of every N debug and info messages per category, ie. cache=100,dialer=10")
+
+		// Profiling
+		profiling     = flag.Bool("profiling", false, "serve pprof and execution trace endpoints under /debug/pprof on the control API")
+		mutexFraction = flag.Int("profile-mutex-fraction", 5, "with -profiling, report 1 in every N contended mutex events")
+		blockRate     = flag.Int("profile-block-rate", 10000, "with -profiling, sample 1 blocking event per N nanoseconds blocked")
+
 		// Require authentication to access this proxy
 		//authUsername = flag.String("auth-username", "", "Require authentication to the current server")
 		//authPassword = flag.String("auth-password", "", "Require authentication to the current server")
 	)
 	flag.Parse()
 
-	log.Printf("Verbose: %v", *verbose)
+	if *verbose {
+		*logLevel = "debug"
+	}
+	if err := configureLogging(*logLevel, *logSample); err != nil {
+		log.Fatal(err)
+	}
+	if *logLevel == "quiet" {
+		// Startup messages and dependencies log through the standard logger
+		log.SetOutput(io.Discard)
+	}
+
+	if *profiling {
+		enableProfiling(*mutexFraction, *blockRate)
+	}
+
+	// Our other implementations cache the certificates for some length of time, so we do the
+	// same here for equality in benchmarking
+	certStore := NewOptimizedCertStore()
+
+	keyPool, err := NewKeyPool(*certKeyType, *certKeyPoolSize)
+	if err != nil {
+		log.Fatal(fmt.Errorf("Error creating key pool: %w", err))
+	}
 
 	if len(*caCertificate) == 0 || len(*caKey) == 0 {
 		log.Println("Falling back to default CA certificate")
 		_, localCAPath, localCAKey := getLocalCAPaths()
-		if err := setCA(localCAPath, localCAKey); err != nil {
+		if err := setCA(localCAPath, localCAKey, certStore, keyPool, *certWildcard); err != nil {
 			log.Fatal(fmt.Errorf("Error setting CA: %w", err))
 		}
 	} else {
 		// Set our own CA instead of the one that's default bundled with the proxy
-		if err := setCA(*caCertificate, *caKey); err != nil {
+		if err := setCA(*caCertificate, *caKey, certStore, keyPool, *certWildcard); err != nil {
 			log.Fatal(fmt.Errorf("Error setting CA: %w", err))
 		}
 	}
 
-	recorder := NewRecorder()
-	cache := NewCache(uint64(*cacheMemorySize))
+	maxCaptureBytes = int64(*captureMaxSize) << 20
+
+	config := NewConfigStore()
+
+	var tapeStore *TapeStore
+	if *tapeDirectory != "" {
+		tapeStore, err = OpenTapeStore(*tapeDirectory)
+		if err != nil {
+			log.Fatal(fmt.Errorf("Error opening tape directory: %w", err))
+		}
+	}
+
+	recorder := NewRecorder(config, tapeStore)
+	cache := NewCache(uint64(*cacheMemorySize), config)
 
 	proxy := goproxy.NewProxyHttpServer()
 	proxy.Verbose = *verbose
+	if *logLevel == "quiet" {
+		proxy.Logger = log.New(io.Discard, "", 0)
+	}
 
 	// If specified, protect the proxy with an auth login
 	// @pierce - Currently failing on MITM because of repeat CONNECTs, some without auth
@@ -76,18 +139,15 @@ func main() {
 		log.Println("Creating unauthenticated proxy")
 	}*/
 
-	// Our other implementations cache the certificates for some length of time, so we do the
-	// same here for equality in benchmarking
-	proxy.CertStore = NewOptimizedCertStore()
+	proxy.CertStore = certStore
 
-	dialerSession := NewDialerSession()
+	dialerSession := NewDialerSession(config)
 
 	// Default the session to a full passthrough from local -> Internet
 	// This will get overridden by clients when they provide values
-	dialerSession.DialerDefinitions = append(
-		dialerSession.DialerDefinitions,
+	dialerSession.SetDialerDefinitions([]*DialerDefinition{
 		NewDialerDefinition(0, nil, nil),
-	)
+	})
 
 	roundTripper := NewCustomRoundTripper(dialerSession)
 
@@ -102,7 +162,12 @@ func main() {
 		return dialDefinition.Dial(network, addr)
 	}
 
-	controller := createController(recorder, cache, dialerSession)
+	bypass := NewBypassRules()
+
+	metrics := NewMetricsCollector(cache, certStore, dialerSession, bypass)
+
+	controller := createController(recorder, cache, dialerSession, bypass, metrics, *verbose)
+	mountProfiling(controller, *profiling)
 
 	// Cast the custom roundtripper implementation to a standard http.RoundTripper
 	proxy.RoundTripper = http.RoundTripper(roundTripper)
@@ -114,6 +179,7 @@ func main() {
 	setupHeadersMiddleware(proxy)
 	setupRecorderMiddleware(proxy, recorder)
 	setupCacheMiddleware(proxy, cache, recorder)
+	setupTimingMiddleware(proxy)
 
 	proxy.NonproxyHandler = http.HandlerFunc(func(w http.ResponseWriter, req *http.Request) {
 		if req.Host == "" {
@@ -125,6 +191,8 @@ func main() {
 		proxy.ServeHTTP(w, req)
 	})
 
+	// Hosts on the bypass list are tunneled directly, everything else is intercepted
+	setupBypassMiddleware(proxy, bypass, dialerSession)
 	proxy.OnRequest(goproxy.ReqHostMatches(regexp.MustCompile("^.*$"))).
 		HandleConnect(goproxy.AlwaysMitm)
 
@@ -132,17 +200,36 @@ func main() {
 		controller.Run(":" + strconv.Itoa(*controlPort))
 	}()
 
+	if *controlSocket != "" {
+		go func() {
+			log.Fatalln(serveControlUnix(*controlSocket, controller))
+		}()
+	}
+
 	go func() {
-		// Host on TLS so clients can use http/2 multiplexing - required for the requests
-		// that block the system lock
-		log.Fatalln(http.ListenAndServe(":"+strconv.Itoa(*port), proxy))
+		log.Fatalln(serveProxy(":"+strconv.Itoa(*port), proxy, *listenerCount))
 	}()
 
+	if *tlsPort != 0 {
+		go func() {
+			// Host on TLS so clients can use http/2 multiplexing - required for the requests
+			// that block the system lock
+			log.Fatalln(serveProxyTLS(":"+strconv.Itoa(*tlsPort), proxy, keyPool))
+		}()
+	}
+
 	sigc := make(chan os.Signal, 1)
 	signal.Notify(sigc, os.Interrupt)
 
 	<-sigc
 
 	log.Println("groove: shutting down")
+
+	// Recordings still queued for disk would otherwise be lost, unlike after a crash
+	if tapeStore != nil {
+		if err := tapeStore.Close(); err != nil {
+			log.Printf("groove: unable to close tape directory: %s", err)
+		}
+	}
 	os.Exit(0)
 }
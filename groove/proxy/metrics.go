@@ -0,0 +1,308 @@
+package main
+
+import (
+	"fmt"
+	"io"
+	"runtime"
+	"strconv"
+	"sync/atomic"
+	"time"
+
+	lrucache "grooveproxy/cache"
+)
+
+// Upper bounds in seconds, shared by every latency histogram so they can be compared
+var latencyBuckets = []float64{0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10}
+
+type Histogram struct {
+	/*
+	 * Lock-free latency histogram with fixed buckets
+	 *
+	 * Bucket counts are stored non-cumulative so an observation only touches one bucket,
+	 * the cumulative view is computed when snapshotting.
+	 */
+	bucketCounts   []uint64 // len(latencyBuckets) + 1, the last bucket catches everything above
+	count          uint64
+	sumNanoseconds int64
+}
+
+type HistogramBucket struct {
+	UpperBound float64 `json:"upperBound"`
+	Count      uint64  `json:"count"`
+}
+
+type HistogramSnapshot struct {
+	Count      uint64  `json:"count"`
+	SumSeconds float64 `json:"sumSeconds"`
+
+	// Cumulative, the implicit +Inf bucket equals Count
+	Buckets []HistogramBucket `json:"buckets"`
+}
+
+func NewHistogram() *Histogram {
+	return &Histogram{
+		bucketCounts: make([]uint64, len(latencyBuckets)+1),
+	}
+}
+
+func (histogram *Histogram) Observe(duration time.Duration) {
+	seconds := duration.Seconds()
+
+	bucket := len(latencyBuckets)
+	for i, upperBound := range latencyBuckets {
+		if seconds <= upperBound {
+			bucket = i
+			break
+		}
+	}
+
+	atomic.AddUint64(&histogram.bucketCounts[bucket], 1)
+	atomic.AddUint64(&histogram.count, 1)
+	atomic.AddInt64(&histogram.sumNanoseconds, int64(duration))
+}
+
+func (histogram *Histogram) ObserveSince(start time.Time) {
+	histogram.Observe(time.Since(start))
+}
+
+func (histogram *Histogram) Snapshot() HistogramSnapshot {
+	buckets := make([]HistogramBucket, len(latencyBuckets))
+	cumulative := uint64(0)
+	for i, upperBound := range latencyBuckets {
+		cumulative += atomic.LoadUint64(&histogram.bucketCounts[i])
+		buckets[i] = HistogramBucket{UpperBound: upperBound, Count: cumulative}
+	}
+
+	return HistogramSnapshot{
+		Count:      atomic.LoadUint64(&histogram.count),
+		SumSeconds: time.Duration(atomic.LoadInt64(&histogram.sumNanoseconds)).Seconds(),
+		Buckets:    buckets,
+	}
+}
+
+type StageMetrics struct {
+	/*
+	 * Time spent in one middleware stage, split by the request and response handlers
+	 */
+	stage    string
+	request  *Histogram
+	response *Histogram
+}
+
+var (
+	headersStage   = NewStageMetrics("headers")
+	recorderStage  = NewStageMetrics("recorder")
+	cacheStage     = NewStageMetrics("cache")
+	roundTripStage = NewStageMetrics("roundtrip")
+
+	stages = []*StageMetrics{headersStage, recorderStage, cacheStage, roundTripStage}
+)
+
+func NewStageMetrics(stage string) *StageMetrics {
+	return &StageMetrics{
+		stage:    stage,
+		request:  NewHistogram(),
+		response: NewHistogram(),
+	}
+}
+
+type StageSnapshot struct {
+	Stage    string            `json:"stage"`
+	Request  HistogramSnapshot `json:"request"`
+	Response HistogramSnapshot `json:"response"`
+}
+
+type DialerSnapshot struct {
+	Identifier string            `json:"identifier"`
+	Priority   int               `json:"priority"`
+	Proxy      string            `json:"proxy"`
+	Attempts   int64             `json:"attempts"`
+	Failures   int64             `json:"failures"`
+	Latency    HistogramSnapshot `json:"latency"`
+}
+
+type RuntimeSnapshot struct {
+	Goroutines     int    `json:"goroutines"`
+	HeapAllocBytes uint64 `json:"heapAllocBytes"`
+	HeapInuseBytes uint64 `json:"heapInuseBytes"`
+	HeapObjects    uint64 `json:"heapObjects"`
+	GCCycles       uint32 `json:"gcCycles"`
+}
+
+type MetricsSnapshot struct {
+	Stages       []StageSnapshot    `json:"stages"`
+	Cache        CacheStats         `json:"cache"`
+	CacheTiers   lrucache.TierStats `json:"cacheTiers"`
+	Dialers      []DialerSnapshot   `json:"dialers"`
+	Certificates CertStoreStats     `json:"certificates"`
+	Tunnels      TunnelStats        `json:"tunnels"`
+	Captures     CaptureStats       `json:"captures"`
+	Runtime      RuntimeSnapshot    `json:"runtime"`
+}
+
+type MetricsCollector struct {
+	/*
+	 * Gathers the counters that each component keeps for itself into one report
+	 */
+	cache         *Cache
+	certStore     *OptimizedCertStore
+	dialerSession *DialerSession
+	bypass        *BypassRules
+}
+
+func NewMetricsCollector(cache *Cache, certStore *OptimizedCertStore, dialerSession *DialerSession, bypass *BypassRules) *MetricsCollector {
+	return &MetricsCollector{
+		cache:         cache,
+		certStore:     certStore,
+		dialerSession: dialerSession,
+		bypass:        bypass,
+	}
+}
+
+func (collector *MetricsCollector) Snapshot() MetricsSnapshot {
+	stageSnapshots := make([]StageSnapshot, 0, len(stages))
+	for _, stage := range stages {
+		stageSnapshots = append(stageSnapshots, StageSnapshot{
+			Stage:    stage.stage,
+			Request:  stage.request.Snapshot(),
+			Response: stage.response.Snapshot(),
+		})
+	}
+
+	// Only the active dialer table is reported, replaced dialers take their counters with them
+	dialerSnapshots := make([]DialerSnapshot, 0)
+	for _, dialer := range collector.dialerSession.DialerDefinitions() {
+		proxy := ""
+		if dialer.proxy != nil {
+			proxy = dialer.proxy.url
+		}
+
+		dialerSnapshots = append(dialerSnapshots, DialerSnapshot{
+			Identifier: dialer.identifier,
+			Priority:   dialer.priority,
+			Proxy:      proxy,
+			Attempts:   atomic.LoadInt64(&dialer.stats.Attempts),
+			Failures:   atomic.LoadInt64(&dialer.stats.Failures),
+			Latency:    dialer.stats.latency.Snapshot(),
+		})
+	}
+
+	var memStats runtime.MemStats
+	runtime.ReadMemStats(&memStats)
+
+	return MetricsSnapshot{
+		Stages:       stageSnapshots,
+		Cache:        collector.cache.Stats(),
+		CacheTiers:   collector.cache.cacheDiskCache.Stats(),
+		Dialers:      dialerSnapshots,
+		Certificates: collector.certStore.Stats(),
+		Tunnels:      collector.bypass.Stats(),
+		Captures:     loadCaptureStats(),
+		Runtime: RuntimeSnapshot{
+			Goroutines:     runtime.NumGoroutine(),
+			HeapAllocBytes: memStats.HeapAlloc,
+			HeapInuseBytes: memStats.HeapInuse,
+			HeapObjects:    memStats.HeapObjects,
+			GCCycles:       memStats.NumGC,
+		},
+	}
+}
+
+func (collector *MetricsCollector) WritePrometheus(writer io.Writer) {
+	/*
+	 * Render a snapshot in the Prometheus text exposition format
+	 */
+	snapshot := collector.Snapshot()
+
+	writeMetricHeader(writer, "groove_stage_duration_seconds", "histogram", "Time spent in each middleware stage")
+	for _, stage := range snapshot.Stages {
+		writeHistogram(writer, "groove_stage_duration_seconds", fmt.Sprintf(`stage=%q,phase="request"`, stage.Stage), stage.Request)
+		writeHistogram(writer, "groove_stage_duration_seconds", fmt.Sprintf(`stage=%q,phase="response"`, stage.Stage), stage.Response)
+	}
+
+	writeMetricHeader(writer, "groove_cache_lookups_total", "counter", "Cache lookups by result")
+	fmt.Fprintf(writer, "groove_cache_lookups_total{result=\"hit\"} %d\n", snapshot.Cache.Hits)
+	fmt.Fprintf(writer, "groove_cache_lookups_total{result=\"miss\"} %d\n", snapshot.Cache.Misses)
+	fmt.Fprintf(writer, "groove_cache_lookups_total{result=\"expired\"} %d\n", snapshot.Cache.Expired)
+
+	writeMetricHeader(writer, "groove_cache_tier_hits_total", "counter", "Cache reads served by each storage tier")
+	fmt.Fprintf(writer, "groove_cache_tier_hits_total{tier=\"memory\"} %d\n", snapshot.CacheTiers.MemoryHits)
+	fmt.Fprintf(writer, "groove_cache_tier_hits_total{tier=\"disk\"} %d\n", snapshot.CacheTiers.DiskHits)
+
+	writeMetricHeader(writer, "groove_cache_tier_misses_total", "counter", "Cache reads that no storage tier could serve")
+	fmt.Fprintf(writer, "groove_cache_tier_misses_total %d\n", snapshot.CacheTiers.Misses)
+
+	writeMetricHeader(writer, "groove_cache_coalesced_waiters_total", "counter", "Requests that waited on an inflight request for the same URL")
+	fmt.Fprintf(writer, "groove_cache_coalesced_waiters_total %d\n", snapshot.Cache.CoalescedWaiters)
+
+	writeMetricHeader(writer, "groove_cache_waiting", "gauge", "Requests currently waiting on an inflight request for the same URL")
+	fmt.Fprintf(writer, "groove_cache_waiting %d\n", snapshot.Cache.Waiting)
+
+	writeMetricHeader(writer, "groove_dialer_attempts_total", "counter", "Round trips attempted through each dialer")
+	for _, dialer := range snapshot.Dialers {
+		fmt.Fprintf(writer, "groove_dialer_attempts_total{%s} %d\n", dialerLabels(dialer), dialer.Attempts)
+	}
+
+	writeMetricHeader(writer, "groove_dialer_failures_total", "counter", "Round trips through each dialer that errored or returned an invalid status")
+	for _, dialer := range snapshot.Dialers {
+		fmt.Fprintf(writer, "groove_dialer_failures_total{%s} %d\n", dialerLabels(dialer), dialer.Failures)
+	}
+
+	writeMetricHeader(writer, "groove_dialer_duration_seconds", "histogram", "Round trip latency through each dialer")
+	for _, dialer := range snapshot.Dialers {
+		writeHistogram(writer, "groove_dialer_duration_seconds", dialerLabels(dialer), dialer.Latency)
+	}
+
+	writeMetricHeader(writer, "groove_cert_store_lookups_total", "counter", "Leaf certificate lookups by result")
+	fmt.Fprintf(writer, "groove_cert_store_lookups_total{result=\"hit\"} %d\n", snapshot.Certificates.Hits)
+	fmt.Fprintf(writer, "groove_cert_store_lookups_total{result=\"miss\"} %d\n", snapshot.Certificates.Misses)
+
+	writeMetricHeader(writer, "groove_tunnel_connections_total", "counter", "CONNECTs tunneled without interception")
+	fmt.Fprintf(writer, "groove_tunnel_connections_total %d\n", snapshot.Tunnels.Connections)
+	writeMetricHeader(writer, "groove_tunnel_failures_total", "counter", "Bypass tunnels that failed to connect")
+	fmt.Fprintf(writer, "groove_tunnel_failures_total %d\n", snapshot.Tunnels.Failures)
+	writeMetricHeader(writer, "groove_tunnel_bytes_total", "counter", "Bytes copied through bypass tunnels")
+	fmt.Fprintf(writer, "groove_tunnel_bytes_total{direction=\"sent\"} %d\n", snapshot.Tunnels.BytesSent)
+	fmt.Fprintf(writer, "groove_tunnel_bytes_total{direction=\"received\"} %d\n", snapshot.Tunnels.BytesReceived)
+
+	writeMetricHeader(writer, "groove_body_captures_total", "counter", "Bodies teed for the recorder and cache by result")
+	fmt.Fprintf(writer, "groove_body_captures_total{result=\"completed\"} %d\n", snapshot.Captures.Completed)
+	fmt.Fprintf(writer, "groove_body_captures_total{result=\"skipped\"} %d\n", snapshot.Captures.Skipped)
+	fmt.Fprintf(writer, "groove_body_captures_total{result=\"aborted\"} %d\n", snapshot.Captures.Aborted)
+
+	writeMetricHeader(writer, "groove_goroutines", "gauge", "Number of goroutines")
+	fmt.Fprintf(writer, "groove_goroutines %d\n", snapshot.Runtime.Goroutines)
+	writeMetricHeader(writer, "groove_heap_alloc_bytes", "gauge", "Bytes of allocated heap objects")
+	fmt.Fprintf(writer, "groove_heap_alloc_bytes %d\n", snapshot.Runtime.HeapAllocBytes)
+	writeMetricHeader(writer, "groove_heap_inuse_bytes", "gauge", "Bytes in in-use heap spans")
+	fmt.Fprintf(writer, "groove_heap_inuse_bytes %d\n", snapshot.Runtime.HeapInuseBytes)
+	writeMetricHeader(writer, "groove_heap_objects", "gauge", "Number of allocated heap objects")
+	fmt.Fprintf(writer, "groove_heap_objects %d\n", snapshot.Runtime.HeapObjects)
+	writeMetricHeader(writer, "groove_gc_cycles_total", "counter", "Completed garbage collection cycles")
+	fmt.Fprintf(writer, "groove_gc_cycles_total %d\n", snapshot.Runtime.GCCycles)
+}
+
+func writeMetricHeader(writer io.Writer, name string, metricType string, help string) {
+	fmt.Fprintf(writer, "# HELP %s %s\n# TYPE %s %s\n", name, help, name, metricType)
+}
+
+func writeHistogram(writer io.Writer, name string, labels string, histogram HistogramSnapshot) {
+	for _, bucket := range histogram.Buckets {
+		fmt.Fprintf(writer, "%s_bucket{%s,le=%q} %d\n", name, labels, formatFloat(bucket.UpperBound), bucket.Count)
+	}
+	fmt.Fprintf(writer, "%s_bucket{%s,le=\"+Inf\"} %d\n", name, labels, histogram.Count)
+	fmt.Fprintf(writer, "%s_sum{%s} %s\n", name, labels, formatFloat(histogram.SumSeconds))
+	fmt.Fprintf(writer, "%s_count{%s} %d\n", name, labels, histogram.Count)
+}
+
+func dialerLabels(dialer DialerSnapshot) string {
+	proxy := dialer.Proxy
+	if proxy == "" {
+		proxy = "direct"
+	}
+	return fmt.Sprintf("dialer=%q,proxy=%q,priority=\"%d\"", dialer.Identifier, proxy, dialer.Priority)
+}
+
+func formatFloat(value float64) string {
+	return strconv.FormatFloat(value, 'g', -1, 64)
+}
@@ -0,0 +1,89 @@
+package main
+
+import (
+	"bytes"
+	"io/ioutil"
+	"strings"
+	"sync"
+	"testing"
+	"time"
+
+	lrucache "grooveproxy/cache"
+)
+
+func TestHistogramBuckets(t *testing.T) {
+	histogram := NewHistogram()
+
+	tests := []time.Duration{
+		100 * time.Microsecond,
+		3 * time.Millisecond,
+		3 * time.Millisecond,
+		2 * time.Second,
+		time.Minute,
+	}
+	for _, duration := range tests {
+		histogram.Observe(duration)
+	}
+
+	snapshot := histogram.Snapshot()
+	if snapshot.Count != 5 {
+		t.Errorf("Unexpected count: %d", snapshot.Count)
+	}
+
+	// Buckets are cumulative
+	expected := map[float64]uint64{
+		0.0005: 1,
+		0.005:  3,
+		2.5:    4,
+		10:     4,
+	}
+	for _, bucket := range snapshot.Buckets {
+		if count, ok := expected[bucket.UpperBound]; ok && count != bucket.Count {
+			t.Errorf("Bucket %v: expected %d, got %d", bucket.UpperBound, count, bucket.Count)
+		}
+	}
+}
+
+func TestMetricsPrometheus(t *testing.T) {
+	cacheDirectory, err := ioutil.TempDir("", "")
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	config := NewConfigStore()
+	cache := &Cache{
+		config:             config,
+		cacheDiskCache:     lrucache.NewCacheInvalidator(cacheDirectory, 1, 1, 10),
+		inflightRequests:   map[string]*sync.Mutex{},
+		lockGeneration:     &sync.Mutex{},
+		blockingLocks:      make(map[string]int),
+		blockingLocksMutex: &sync.RWMutex{},
+	}
+	dialerSession := NewDialerSession(config)
+	dialerSession.SetDialerDefinitions([]*DialerDefinition{NewDialerDefinition(0, nil, nil)})
+
+	dialerSession.DialerDefinitions()[0].stats.RecordAttempt(time.Now(), true)
+
+	collector := NewMetricsCollector(cache, NewOptimizedCertStore(), dialerSession, NewBypassRules())
+
+	var output bytes.Buffer
+	collector.WritePrometheus(&output)
+
+	expectedLines := []string{
+		"# TYPE groove_stage_duration_seconds histogram",
+		`groove_stage_duration_seconds_bucket{stage="cache",phase="request",le="+Inf"}`,
+		`groove_cache_tier_hits_total{tier="disk"} 0`,
+		`,proxy="direct",priority="0"} 1`,
+		"# TYPE groove_goroutines gauge",
+	}
+	for _, line := range expectedLines {
+		if !strings.Contains(output.String(), line) {
+			t.Errorf("Missing from prometheus output: %s", line)
+		}
+	}
+
+	snapshot := collector.Snapshot()
+	if len(snapshot.Dialers) != 1 || snapshot.Dialers[0].Failures != 1 {
+		t.Errorf("Unexpected dialer metrics: %+v", snapshot.Dialers)
+	}
+}
@@ -5,15 +5,22 @@ package main
 
 import (
 	"crypto/tls"
-	"fmt"
 	"sync"
+	"sync/atomic"
 )
 
+type CertStoreStats struct {
+	Hits   int64 `json:"hits"`
+	Misses int64 `json:"misses"`
+}
+
 type OptimizedCertStore struct {
 	certs    map[string]*tls.Certificate
 	locks    map[string]*sync.Mutex
 	certLock *sync.RWMutex
 
+	stats CertStoreStats
+
 	sync.Mutex
 }
 
@@ -26,7 +33,7 @@ func NewOptimizedCertStore() *OptimizedCertStore {
 }
 
 func (s *OptimizedCertStore) Fetch(host string, genCert func() (*tls.Certificate, error)) (*tls.Certificate, error) {
-	fmt.Printf("Fetching certificate for %s\n", host)
+	certLog.Debugf("Fetching certificate for %s", host)
 
 	hostLock := s.hostLock(host)
 	hostLock.Lock()
@@ -37,7 +44,8 @@ func (s *OptimizedCertStore) Fetch(host string, genCert func() (*tls.Certificate
 	s.certLock.RUnlock()
 	var err error
 	if !ok {
-		fmt.Printf("cache miss: %s\n", host)
+		certLog.Debugf("Certificate cache miss: %s", host)
+		atomic.AddInt64(&s.stats.Misses, 1)
 
 		cert, err = genCert()
 		if err != nil {
@@ -47,11 +55,19 @@ func (s *OptimizedCertStore) Fetch(host string, genCert func() (*tls.Certificate
 		s.certs[host] = cert
 		s.certLock.Unlock()
 	} else {
-		fmt.Printf("cache hit: %s\n", host)
+		certLog.Debugf("Certificate cache hit: %s", host)
+		atomic.AddInt64(&s.stats.Hits, 1)
 	}
 	return cert, nil
 }
 
+func (s *OptimizedCertStore) Stats() CertStoreStats {
+	return CertStoreStats{
+		Hits:   atomic.LoadInt64(&s.stats.Hits),
+		Misses: atomic.LoadInt64(&s.stats.Misses),
+	}
+}
+
 func (s *OptimizedCertStore) hostLock(host string) *sync.Mutex {
 	// Only one host lock should be generated at one time
 	s.Lock()
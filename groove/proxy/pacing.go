@@ -0,0 +1,87 @@
+package main
+
+import (
+	"io"
+	"sync"
+	"time"
+)
+
+// Largest read a paced body hands out at once, smaller reads give a smoother rate at the cost
+// of more wakeups
+const pacedChunkSize = 16 << 10
+
+type pacedBody struct {
+	/*
+	 * Replays a body at the rate it was originally transferred
+	 *
+	 * Each read is held back until the bytes delivered so far would have arrived in the
+	 * recording, so the client sees the original throughput instead of a single burst. The
+	 * clock starts on the first read, once the client is actually consuming the body.
+	 */
+	io.ReadCloser
+
+	size     int64
+	duration time.Duration
+
+	start     time.Time
+	delivered int64
+
+	closed    chan struct{}
+	closeOnce sync.Once
+}
+
+func newPacedBody(body io.ReadCloser, size int64, duration time.Duration) io.ReadCloser {
+	if size <= 0 || duration <= 0 {
+		return body
+	}
+
+	return &pacedBody{
+		ReadCloser: body,
+		size:       size,
+		duration:   duration,
+		closed:     make(chan struct{}),
+	}
+}
+
+func (body *pacedBody) Read(p []byte) (int, error) {
+	if body.start.IsZero() {
+		body.start = time.Now()
+	}
+	if len(p) > pacedChunkSize {
+		p = p[:pacedChunkSize]
+	}
+
+	n, err := body.ReadCloser.Read(p)
+	body.delivered += int64(n)
+
+	due := body.start.Add(time.Duration(float64(body.duration) * float64(body.delivered) / float64(body.size)))
+	sleepUntil(due, body.closed)
+
+	return n, err
+}
+
+func (body *pacedBody) Close() error {
+	// Wake a pending read so an abandoned replay doesn't hold its goroutine
+	body.closeOnce.Do(func() { close(body.closed) })
+	return body.ReadCloser.Close()
+}
+
+func sleepUntil(deadline time.Time, cancel <-chan struct{}) bool {
+	/*
+	 * Sleep until deadline, returns false if cancel was closed first
+	 */
+	wait := time.Until(deadline)
+	if wait <= 0 {
+		return true
+	}
+
+	timer := time.NewTimer(wait)
+	defer timer.Stop()
+
+	select {
+	case <-timer.C:
+		return true
+	case <-cancel:
+		return false
+	}
+}
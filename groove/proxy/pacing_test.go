@@ -0,0 +1,56 @@
+package main
+
+import (
+	"bytes"
+	"io"
+	"testing"
+	"time"
+)
+
+func TestPacedBody(t *testing.T) {
+	tests := []struct {
+		name     string
+		size     int
+		duration time.Duration
+	}{
+		{"single chunk", 100, 50 * time.Millisecond},
+		{"several chunks", 4 * pacedChunkSize, 80 * time.Millisecond},
+		{"unpaced", 4 * pacedChunkSize, 0},
+	}
+
+	for _, test := range tests {
+		payload := bytes.Repeat([]byte("g"), test.size)
+		body := newPacedBody(io.NopCloser(bytes.NewReader(payload)), int64(test.size), test.duration)
+
+		start := time.Now()
+		received, err := io.ReadAll(body)
+		elapsed := time.Since(start)
+
+		if err != nil || !bytes.Equal(received, payload) {
+			t.Fatalf("%s: body changed while pacing: %v", test.name, err)
+		}
+		if elapsed < test.duration {
+			t.Errorf("%s: expected at least %s, took %s", test.name, test.duration, elapsed)
+		}
+		if elapsed > test.duration+time.Second {
+			t.Errorf("%s: pacing overshot, took %s", test.name, elapsed)
+		}
+	}
+}
+
+func TestPacedBodyClose(t *testing.T) {
+	payload := bytes.Repeat([]byte("g"), 2*pacedChunkSize)
+	body := newPacedBody(io.NopCloser(bytes.NewReader(payload)), int64(len(payload)), time.Hour)
+
+	// Closing wakes a read that would otherwise wait for most of the hour
+	go func() {
+		time.Sleep(20 * time.Millisecond)
+		body.Close()
+	}()
+
+	start := time.Now()
+	body.Read(make([]byte, pacedChunkSize))
+	if elapsed := time.Since(start); elapsed > time.Second {
+		t.Errorf("Read wasn't woken by close after %s", elapsed)
+	}
+}
@@ -0,0 +1,61 @@
+package main
+
+import (
+	"net/http"
+	"net/http/pprof"
+	"runtime"
+	"strings"
+
+	"github.com/gin-gonic/gin"
+)
+
+func enableProfiling(mutexFraction int, blockRate int) {
+	/*
+	 * Contention sampling is off by default in the runtime because it costs a little on
+	 * every lock and channel operation. Only turned on when the proxy is launched for profiling.
+	 *
+	 * mutexFraction: report 1 in every N contended mutex events
+	 * blockRate: sample 1 blocking event per N nanoseconds spent blocked
+	 */
+	runtime.SetMutexProfileFraction(mutexFraction)
+	runtime.SetBlockProfileRate(blockRate)
+}
+
+func profileHandler(name string) http.Handler {
+	/*
+	 * Map a /debug/pprof/<name> path onto the standard library handlers
+	 *
+	 * Named profiles (heap, mutex, block, goroutine, allocs) are served by the index,
+	 * which accepts ?seconds=N to return the delta over that window.
+	 */
+	switch strings.TrimPrefix(name, "/") {
+	case "profile":
+		return http.HandlerFunc(pprof.Profile)
+	case "trace":
+		return http.HandlerFunc(pprof.Trace)
+	case "cmdline":
+		return http.HandlerFunc(pprof.Cmdline)
+	case "symbol":
+		return http.HandlerFunc(pprof.Symbol)
+	default:
+		return http.HandlerFunc(pprof.Index)
+	}
+}
+
+func mountProfiling(router *gin.Engine, enabled bool) {
+	/*
+	 * Profiles expose memory contents and command line arguments, so the routes only
+	 * respond when the proxy was launched with -profiling
+	 */
+	router.Any("/debug/pprof/*profile", func(c *gin.Context) {
+		if !enabled {
+			c.JSON(http.StatusForbidden, gin.H{
+				"success": false,
+				"error":   "Profiling is disabled, launch with -profiling",
+			})
+			return
+		}
+
+		profileHandler(c.Param("profile")).ServeHTTP(c.Writer, c.Request)
+	})
+}
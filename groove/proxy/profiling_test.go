@@ -0,0 +1,48 @@
+package main
+
+import (
+	"net/http/httptest"
+	"strings"
+	"testing"
+)
+
+func TestProfileHandler(t *testing.T) {
+	enableProfiling(1, 1)
+	defer enableProfiling(0, 0)
+
+	tests := []struct {
+		name     string
+		path     string
+		contains string
+	}{
+		{"/mutex", "/debug/pprof/mutex?debug=1", "--- mutex:"},
+		{"/block", "/debug/pprof/block?debug=1", "--- contention:"},
+		{"/goroutine", "/debug/pprof/goroutine?debug=1", "goroutine profile:"},
+		{"/cmdline", "/debug/pprof/cmdline", ""},
+	}
+
+	for _, test := range tests {
+		recorder := httptest.NewRecorder()
+		profileHandler(test.name).ServeHTTP(recorder, httptest.NewRequest("GET", test.path, nil))
+
+		if recorder.Code != 200 {
+			t.Fatalf("%s: unexpected status %d: %s", test.name, recorder.Code, recorder.Body.String())
+		}
+		if !strings.Contains(recorder.Body.String(), test.contains) {
+			t.Fatalf("%s: missing %q in %s", test.name, test.contains, recorder.Body.String())
+		}
+	}
+}
+
+func TestTraceHandler(t *testing.T) {
+	recorder := httptest.NewRecorder()
+	request := httptest.NewRequest("GET", "/debug/pprof/trace?seconds=0.05", nil)
+	profileHandler("/trace").ServeHTTP(recorder, request)
+
+	if recorder.Code != 200 {
+		t.Fatalf("Unexpected status %d: %s", recorder.Code, recorder.Body.String())
+	}
+	if !strings.HasPrefix(recorder.Body.String(), "go ") {
+		t.Fatalf("Expected an execution trace, got %d bytes", recorder.Body.Len())
+	}
+}
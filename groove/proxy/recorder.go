@@ -1,13 +1,17 @@
 package main
 
 import (
-	"bytes"
+	"bufio"
 	"compress/gzip"
-	"encoding/json"
+	"errors"
+	"fmt"
 	"io"
-	"io/ioutil"
-	"log"
 	"net/http"
+	"os"
+	"regexp"
+	"sync"
+	"sync/atomic"
+	"time"
 
 	goproxy "github.com/piercefreeman/goproxy"
 )
@@ -18,6 +22,15 @@ const (
 	RecorderModeWrite = iota
 )
 
+const (
+	// Each record plays back once, duplicates of a URL are served in tape order
+	ReplayModeConsume = iota
+
+	// Records are served read-only so one loaded tape can feed any number of clients
+	ReplayModeFirst      = iota
+	ReplayModeRoundRobin = iota
+)
+
 type RecordedRecord struct {
 	Request  ArchivedRequest  `json:"request"`
 	Response ArchivedResponse `json:"response"`
@@ -25,153 +38,698 @@ type RecordedRecord struct {
 	// Optional tape ID to tag this request with a certain tape
 	TapeID string `json:"tape_id"`
 
-	//inflightMilliseconds int
+	// Increases with every record the proxy adds, never reused within a process even across
+	// clears, so clients can poll for records newer than the last one they saw
+	Sequence uint64 `json:"sequence"`
+
+	// Only the final hop of a redirect chain has timings
+	Timing *RequestTiming `json:"timing,omitempty"`
+
+	// Content hashes of the bodies, known once they're shared through a bodyStore or read
+	// from a tape that references them
+	requestBodyKey  bodyKey
+	responseBodyKey bodyKey
 }
 
+// Returned by FindMatchingResponse when the client disconnects during a timed replay
+var errReplayCanceled = errors.New("Client went away during replay")
+
 type Recorder struct {
 	/*
 	 * Tape recorder and replayer
 	 *
-	 * A recorder supports multiple concurrent tape writes but only playback from one tape at a time.
+	 * Each tape ID is its own namespace. Requests tagged with a tape ID that was started or
+	 * loaded on its own follow that tape's mode, so one proxy can record some tapes while
+	 * replaying others. Untagged requests and all other tapes follow the global mode.
 	 */
-	mode    int // RecorderModeRead | RecorderModeWrite
+	config  *ConfigStore
 	records []*RecordedRecord
 
-	// Record indexes that are already consumed
-	consumedRecords []*RecordedRecord
+	// Records by tape ID and match key in tape order, so playback doesn't scan the whole tape
+	replayIndex map[replayKey]*replayEntry
+
+	// How the replay index is keyed, guarded by recordsLock
+	match ReplayMatch
+
+	// Records that were already played back
+	consumedRecords map[*RecordedRecord]bool
+
+	// Records in memory share identical bodies
+	bodies *bodyStore
+
+	// Records are added from whichever goroutine finishes streaming the response body
+	recordsLock sync.RWMutex
+
+	// When set, new recordings are written ahead to disk instead of kept in records. Tapes
+	// loaded for playback are still held in memory.
+	store *TapeStore
+
+	// Last assigned sequence number, only changed atomically
+	sequence uint64
+
+	// Keeps disk writes in sequence order, records in memory are ordered by recordsLock
+	sequenceLock sync.Mutex
 }
 
-func NewRecorder() *Recorder {
-	return &Recorder{
-		mode:            RecorderModeOff,
+type replayKey struct {
+	tapeID string
+
+	// Computed by ReplayMatch, the exact URL by default
+	match string
+}
+
+type replayEntry struct {
+	records []*RecordedRecord
+
+	// Requests served in round-robin replay, only changed atomically
+	served uint64
+}
+
+func NewRecorder(config *ConfigStore, store *TapeStore) *Recorder {
+	recorder := &Recorder{
+		config:          config,
 		records:         make([]*RecordedRecord, 0),
-		consumedRecords: make([]*RecordedRecord, 0),
+		replayIndex:     make(map[replayKey]*replayEntry),
+		consumedRecords: make(map[*RecordedRecord]bool),
+		bodies:          newBodyStore(),
+		store:           store,
+	}
+
+	// Continue numbering after a recording recovered from disk
+	if store != nil {
+		recorder.sequence = store.LastSequence()
 	}
+
+	return recorder
 }
 
-func (r *Recorder) LogPair(request *http.Request, requestHeaders *HeaderDefinition, response *http.Response) {
+func (r *Recorder) nextSequence() uint64 {
+	return atomic.AddUint64(&r.sequence, 1)
+}
+
+func (r *Recorder) Mode() int {
+	return r.config.Load().RecorderMode
+}
+
+func (r *Recorder) ModeFor(tapeID string) int {
+	/*
+	 * Mode that applies to requests tagged with tapeID
+	 */
+	config := r.config.Load()
+	if mode, ok := config.TapeModes[tapeID]; ok {
+		return mode
+	}
+	return config.RecorderMode
+}
+
+func (r *Recorder) ReplayMode() int {
+	return r.config.Load().ReplayMode
+}
+
+func (r *Recorder) SetReplayMode(mode int) {
+	r.config.Update(func(config *RuntimeConfig) {
+		config.ReplayMode = mode
+	})
+}
+
+func (r *Recorder) SetReplayTimeScale(scale float64) {
+	r.config.Update(func(config *RuntimeConfig) {
+		config.ReplayTimeScale = scale
+	})
+}
+
+func (r *Recorder) SetMode(mode int) {
+	/*
+	 * Set the mode of every tape, including those that were controlled on their own
+	 */
+	r.config.Update(func(config *RuntimeConfig) {
+		config.RecorderMode = mode
+		config.TapeModes = make(map[string]int)
+	})
+}
+
+func (r *Recorder) SetTapeMode(tapeID string, mode int) {
+	r.config.Update(func(config *RuntimeConfig) {
+		tapeModes := make(map[string]int, len(config.TapeModes)+1)
+		for existingID, existingMode := range config.TapeModes {
+			tapeModes[existingID] = existingMode
+		}
+
+		// A tape back on the global mode doesn't need an entry, so finished sessions don't
+		// accumulate in long running proxies
+		if mode == config.RecorderMode {
+			delete(tapeModes, tapeID)
+		} else {
+			tapeModes[tapeID] = mode
+		}
+		config.TapeModes = tapeModes
+	})
+}
+
+func (r *Recorder) LogPair(request *http.Request, requestHeaders *HeaderDefinition, response *http.Response, timer *requestTimer) {
+	/*
+	 * The response is still streaming to the client at this point, the record is added
+	 * once its body has been read to the end
+	 */
 	archivedRequest := requestToArchivedRequest(request)
-	archivedResponse := responseToArchivedResponse(response)
 
-	if archivedRequest != nil && archivedResponse != nil {
-		r.records = append(
-			r.records,
-			&RecordedRecord{
-				Request:  *archivedRequest,
-				Response: *archivedResponse,
-				TapeID:   requestHeaders.tapeID,
-			},
-		)
+	captureResponseBody(response).OnComplete(func(body []byte, captured bool) {
+		if !captured {
+			recorderLog.Debugf("Response body wasn't captured, skipping record: %s", archivedRequest.Url)
+			return
+		}
+
+		record := &RecordedRecord{
+			Request:  *archivedRequest,
+			Response: *responseToArchivedResponse(response, body),
+			TapeID:   requestHeaders.tapeID,
+		}
+		// The body has been drained so the transfer timing is complete
+		if timer != nil {
+			timing := timer.Snapshot()
+			record.Timing = &timing
+		}
+
+		r.addRecord(record)
+	})
+}
+
+func (r *Recorder) addRecord(record *RecordedRecord) {
+	if r.store != nil {
+		r.sequenceLock.Lock()
+		record.Sequence = r.nextSequence()
+		err := r.store.Append(record)
+		r.sequenceLock.Unlock()
+
+		if err != nil {
+			recorderLog.Errorf("Unable to write record: %s", err)
+		}
+		return
+	}
+
+	r.bodies.Add(record)
+
+	r.recordsLock.Lock()
+	record.Sequence = r.nextSequence()
+	r.records = append(r.records, record)
+	indexRecord(r.replayIndex, record, &r.match)
+	r.recordsLock.Unlock()
+}
+
+func (r *Recorder) SetReplayMatch(match ReplayMatch) {
+	/*
+	 * Change how requests are matched to records, re-keying the records already loaded
+	 */
+	r.recordsLock.Lock()
+	defer r.recordsLock.Unlock()
+
+	r.match = match
+	r.replayIndex = make(map[replayKey]*replayEntry)
+	for _, record := range r.records {
+		indexRecord(r.replayIndex, record, &r.match)
+	}
+
+	if r.store != nil {
+		r.store.SetReplayMatch(match)
+	}
+}
+
+type TapeExport struct {
+	/*
+	 * Which records to export and how to encode them
+	 */
+	TapeID string
+
+	// Only export records whose URL matches, nil matches everything
+	URLPattern *regexp.Regexp
+
+	// Only export records with a higher sequence number
+	Since uint64
+
+	// Skip this many matching records, and export at most Limit of the rest (0 for no limit)
+	Cursor int
+	Limit  int
+
+	// TapeFormatJSON or TapeFormatBinary, both are gzipped
+	Format           int
+	CompressionLevel int
+
+	// Compress blocks on this many goroutines as separate gzip members, 0 or 1 compresses inline
+	Workers int
+}
+
+type TapeExportPage struct {
+	/*
+	 * Records selected for one export, resolved before anything is written so the response
+	 * headers can say whether another page follows
+	 */
+	recorder *Recorder
+	options  TapeExport
+
+	// In sequence order
+	items []tapeExportItem
+
+	// Cursor for the following page, -1 once the tape is exhausted
+	NextCursor int
+
+	// Sequence number of the last exported record, pass as Since to poll for newer ones
+	NextSince uint64
+}
+
+type tapeExportItem struct {
+	// Either a loaded record or the location of one recorded to disk
+	record *RecordedRecord
+	entry  *tapeIndexEntry
+}
+
+func (item tapeExportItem) sequence() uint64 {
+	if item.record != nil {
+		return item.record.Sequence
 	}
+	return item.entry.sequence
 }
 
-func (r *Recorder) ExportData(tapeID string) (response *bytes.Buffer, err error) {
+func (r *Recorder) ExportData(options TapeExport) (*TapeExportPage, error) {
 	/*
-	 * Formats data in a readable payload, gzipped for space savings
+	 * Select records for a readable payload, gzipped for space savings
 	 * If tapeID is blank, will export all recorded items
 	 * If tapeID is provided, will export items with that tape ID and those with no tape flagged. We include
 	 * items with no tape flagged because some requests cannot be tagged with a tape via request interception
 	 * because of browser control limitations.
 	 */
-	var recordsToExport []*RecordedRecord
+	include := func(recordTapeID string, url string, sequence uint64) bool {
+		if options.Since > 0 && sequence <= options.Since {
+			return false
+		}
+		if len(options.TapeID) > 0 && recordTapeID != options.TapeID && recordTapeID != "" {
+			return false
+		}
+		return options.URLPattern == nil || options.URLPattern.MatchString(url)
+	}
 
-	if len(tapeID) == 0 {
-		recordsToExport = r.records
-	} else {
-		recordsToExport = filterSlice(r.records, func(record *RecordedRecord) bool {
-			return record.TapeID == tapeID || record.TapeID == ""
-		})
+	r.recordsLock.RLock()
+	records := filterSlice(r.records, func(record *RecordedRecord) bool {
+		return include(record.TapeID, record.Request.Url, record.Sequence)
+	})
+	r.recordsLock.RUnlock()
+
+	entries := make([]*tapeIndexEntry, 0)
+	if r.store != nil {
+		// Include records still queued for the writer
+		if err := r.store.Sync(); err != nil {
+			return nil, err
+		}
+		entries = r.store.Select(include)
+	}
+
+	// Loaded and recorded sequences interleave, so paging and polling need them merged
+	// Both are already in sequence order
+	items := make([]tapeExportItem, 0, len(records)+len(entries))
+	for len(records) > 0 || len(entries) > 0 {
+		if len(entries) == 0 || (len(records) > 0 && records[0].Sequence <= entries[0].sequence) {
+			items = append(items, tapeExportItem{record: records[0]})
+			records = records[1:]
+		} else {
+			items = append(items, tapeExportItem{entry: entries[0]})
+			entries = entries[1:]
+		}
 	}
 
-	log.Printf("Total requests: %d", len(recordsToExport))
-	json, err := json.Marshal(recordsToExport)
+	total := len(items)
+	start := minInt(options.Cursor, total)
+	end := total
+	if options.Limit > 0 {
+		end = minInt(start+options.Limit, total)
+	}
 
-	if err != nil {
-		log.Println("Unable to export json payload")
-		return nil, err
+	page := &TapeExportPage{
+		recorder:   r,
+		options:    options,
+		NextCursor: -1,
+	}
+	if end < total {
+		page.NextCursor = end
 	}
 
-	var buf bytes.Buffer
-	gz := gzip.NewWriter(&buf)
-	gz.Write(json)
-	gz.Close()
+	page.items = items[start:end]
 
-	return &buf, nil
+	// Polling with nothing new keeps the same position
+	page.NextSince = options.Since
+	if len(page.items) > 0 {
+		page.NextSince = page.items[len(page.items)-1].sequence()
+	}
+
+	return page, nil
 }
 
-func (r *Recorder) LoadData(fileHandler io.Reader) (err error) {
-	gzreader, err := gzip.NewReader(fileHandler)
+func (page *TapeExportPage) Stream(writer io.Writer) (err error) {
+	/*
+	 * Stream the page as a gzipped tape, encoding one record at a time
+	 */
+	var gz io.WriteCloser
+	if page.options.Workers > 1 {
+		gz, err = newParallelGzipWriter(writer, page.options.CompressionLevel, page.options.Workers)
+	} else {
+		gz, err = gzip.NewWriterLevel(writer, page.options.CompressionLevel)
+	}
 	if err != nil {
 		return err
 	}
+	// Also on errors, typically a client that went away, so parallel workers are stopped
+	defer func() {
+		if closeErr := gz.Close(); err == nil {
+			err = closeErr
+		}
+	}()
 
-	output, err := ioutil.ReadAll(gzreader)
+	encoder := newTapeEncoder(gz, page.options.Format)
+
+	var payload []byte
+	for _, item := range page.items {
+		if item.record != nil {
+			if err := encoder.Write(item.record); err != nil {
+				recorderLog.Errorf("Unable to export record: %s", err)
+				return err
+			}
+			continue
+		}
+
+		payload, err = page.recorder.store.ReadPayload(item.entry, payload)
+		if err != nil {
+			recorderLog.Errorf("Unable to read recorded tape: %s", err)
+			return err
+		}
+		if err := encoder.WritePayload(payload); err != nil {
+			return err
+		}
+	}
+
+	if err := encoder.Close(); err != nil {
+		return err
+	}
+
+	recorderLog.Infof("Total requests: %d", encoder.count)
+	return nil
+}
+
+func (r *Recorder) LoadData(fileHandler io.Reader, tapeID string) error {
+	/*
+	 * Replace the current records with a gzipped tape, in either tape format
+	 *
+	 * The tape is decoded one record at a time and indexed as it's read, so loading never holds
+	 * a second copy of the whole tape. Repeated bodies are shared as soon as they're read.
+	 * Current records are kept if the tape can't be decoded.
+	 *
+	 * If tapeID is provided, every loaded record is tagged with it and only the records of that
+	 * tape are replaced.
+	 */
+	gzreader, err := gzip.NewReader(fileHandler)
+	if err != nil {
+		return fmt.Errorf("Tape isn't gzipped: %w", err)
+	}
+	nextRecord, err := newTapeDecoder(gzreader)
 	if err != nil {
 		return err
 	}
 
-	// Wipe old data
-	r.Clear()
+	r.recordsLock.RLock()
+	match := r.match
+	r.recordsLock.RUnlock()
+
+	records := make([]*RecordedRecord, 0)
+	replayIndex := make(map[replayKey]*replayEntry)
 
-	// Load fresh records into the structs
-	json.Unmarshal(output, &r.records)
+	for {
+		record, err := nextRecord()
+		if err == io.EOF {
+			break
+		}
+		if err != nil {
+			r.bodies.Release(records)
+			return fmt.Errorf("Unable to decode tape record %d: %w", len(records), err)
+		}
+
+		if tapeID != "" {
+			record.TapeID = tapeID
+		}
+		r.bodies.Add(record)
+		records = append(records, record)
+		indexRecord(replayIndex, record, &match)
+	}
+
+	// Wipe old data
+	r.clearStore(tapeID)
+
+	// Records added while the tape was decoding are replaced too, in the same critical section
+	// so none of them slip in between the clear and the swap
+	r.recordsLock.Lock()
+	if tapeID == "" {
+		r.clearRecords()
+		r.records = records
+		r.replayIndex = replayIndex
+	} else {
+		r.removeTapeID(tapeID)
+		r.records = append(r.records, records...)
+		for key, entry := range replayIndex {
+			r.replayIndex[key] = entry
+		}
+	}
+	// Renumber so loaded records follow everything this process has already handed out,
+	// under the lock to keep the records in sequence order
+	for _, record := range records {
+		record.Sequence = r.nextSequence()
+	}
+	r.recordsLock.Unlock()
 
+	recorderLog.Infof("Loaded tape: %d records", len(records))
 	return nil
 }
 
+func (r *Recorder) LoadPath(path string, tapeID string) error {
+	/*
+	 * Load a tape straight off the local disk, for clients on the same host as the proxy
+	 */
+	file, err := os.Open(path)
+	if err != nil {
+		return err
+	}
+	defer file.Close()
+
+	return r.LoadData(bufio.NewReaderSize(file, 1<<20), tapeID)
+}
+
 func (r *Recorder) Clear() {
-	r.records = nil
-	r.consumedRecords = nil
+	r.recordsLock.Lock()
+	r.clearRecords()
+	r.recordsLock.Unlock()
+
+	r.clearStore("")
 }
 
 func (r *Recorder) ClearTapeID(tapeID string) {
 	/*
 	 * Remove all records with the given tape ID
 	 */
+	r.recordsLock.Lock()
+	r.removeTapeID(tapeID)
+	r.recordsLock.Unlock()
+
+	r.clearStore(tapeID)
+}
+
+func (r *Recorder) clearRecords() {
+	/*
+	 * Drop every record from memory, the caller holds recordsLock
+	 */
+	r.bodies.Release(r.records)
+	r.records = nil
+	r.replayIndex = make(map[replayKey]*replayEntry)
+	r.consumedRecords = make(map[*RecordedRecord]bool)
+}
+
+func (r *Recorder) clearStore(tapeID string) {
+	/*
+	 * Drop the records recorded to disk, all of them unless a tape ID is given
+	 */
+	if r.store == nil {
+		return
+	}
+	if tapeID == "" {
+		if err := r.store.Clear(); err != nil {
+			recorderLog.Errorf("Unable to clear recorded tape: %s", err)
+		}
+	} else if err := r.store.ClearTapeID(tapeID); err != nil {
+		recorderLog.Errorf("Unable to clear recorded tape %s: %s", tapeID, err)
+	}
+}
+
+func (r *Recorder) removeTapeID(tapeID string) {
+	/*
+	 * Drop the tape's records from memory, the caller holds recordsLock
+	 */
+	removed := make([]*RecordedRecord, 0)
 	r.records = filterSlice(r.records, func(record *RecordedRecord) bool {
-		return record.TapeID != tapeID
-	})
-	r.consumedRecords = filterSlice(r.consumedRecords, func(record *RecordedRecord) bool {
-		return record.TapeID != tapeID
+		if record.TapeID == tapeID {
+			removed = append(removed, record)
+			return false
+		}
+		return true
 	})
+	r.bodies.Release(removed)
+	for key, entry := range r.replayIndex {
+		if key.tapeID != tapeID {
+			continue
+		}
+		for _, record := range entry.records {
+			delete(r.consumedRecords, record)
+		}
+		delete(r.replayIndex, key)
+	}
 }
 
-func (r *Recorder) FindMatchingResponse(request *http.Request, requestHeaders *HeaderDefinition) *http.Response {
+func (r *Recorder) FindMatchingResponse(request *http.Request, requestHeaders *HeaderDefinition) (*http.Response, error) {
 	/*
 	 * Given a new request, determine if we have a match in the tape to handle it
+	 *
+	 * Returns errReplayCanceled if the client went away while a timed replay held the response.
+	 * A consumed record is handed back so a retry of the request still plays it.
 	 */
-	log.Printf("Record size: %d\n", len(r.records))
-	for _, record := range r.records {
-		// If we are looking for a tape, limit ourselves to just that tape
-		// Otherwise we are free to use any matching item if it's not linked to a tape
-		if record.TapeID != requestHeaders.tapeID {
-			continue
+	config := r.config.Load()
+
+	r.recordsLock.RLock()
+	match := r.match
+	r.recordsLock.RUnlock()
+
+	key := replayKey{tapeID: requestHeaders.tapeID, match: match.requestKey(request)}
+
+	record := r.matchRecord(key, config.ReplayMode)
+	fromStore := false
+
+	// Fall back to anything recorded to disk since the last load
+	if record == nil && r.store != nil {
+		var err error
+		record, err = r.store.Match(key, config.ReplayMode)
+		if err != nil {
+			return nil, err
 		}
+		fromStore = true
+	}
+
+	if record == nil {
+		return nil, nil
+	}
 
-		if record.Request.Url == request.URL.String() {
-			// Only allow each request to be played back one time
-			if contains(r.consumedRecords, record) {
-				log.Printf("Already seen record, continuing: %s\n", request.URL.String())
-				continue
+	// Format the archived response as a full http response
+	response := archivedResponseToResponse(request, &record.Response)
+	if config.ReplayTimeScale > 0 && record.Timing != nil {
+		if !replayTiming(request, response, record.Timing, config.ReplayTimeScale) {
+			if config.ReplayMode == ReplayModeConsume {
+				r.unconsume(key, record, fromStore)
 			}
+			return nil, errReplayCanceled
+		}
+	}
+	return response, nil
+}
+
+func (r *Recorder) unconsume(key replayKey, record *RecordedRecord, fromStore bool) {
+	/*
+	 * Make a consumed record playable again, for a client that never received it
+	 */
+	if fromStore {
+		r.store.Unconsume(key, record.Sequence)
+		return
+	}
+
+	r.recordsLock.Lock()
+	delete(r.consumedRecords, record)
+	r.recordsLock.Unlock()
+}
+
+func replayTiming(request *http.Request, response *http.Response, timing *RequestTiming, scale float64) bool {
+	/*
+	 * Hold the response for as long as upstream took to answer, then pace the body over the
+	 * recorded transfer time. Returns false if the client went away while waiting.
+	 */
+	scaled := func(milliseconds float64) time.Duration {
+		return time.Duration(milliseconds * scale * float64(time.Millisecond))
+	}
+
+	// Time spent inside the proxy (cache lookups, lock waits) isn't part of the network
+	firstByte := scaled(timing.DialMs + timing.TLSMs + timing.TTFBMs)
+	if !sleepUntil(time.Now().Add(firstByte), request.Context().Done()) {
+		return false
+	}
 
-			// Don't allow this same record to be played back again
-			r.consumedRecords = append(r.consumedRecords, record)
+	response.Body = newPacedBody(response.Body, response.ContentLength, scaled(timing.TransferMs))
+	return true
+}
 
-			// Format the archived response as a full http response
-			resp := archivedResponseToResponse(request, &record.Response)
-			return resp
+func (r *Recorder) matchRecord(key replayKey, replayMode int) *RecordedRecord {
+	/*
+	 * If we are looking for a tape, limit ourselves to just that tape
+	 * Otherwise we are free to use any matching item if it's not linked to a tape
+	 */
+	if replayMode != ReplayModeConsume {
+		// Read-only lookups, concurrent clients only contend on the round-robin counter
+		r.recordsLock.RLock()
+		defer r.recordsLock.RUnlock()
+
+		entry := r.replayIndex[key]
+		if entry == nil {
+			return nil
+		}
+		if replayMode == ReplayModeRoundRobin {
+			served := atomic.AddUint64(&entry.served, 1) - 1
+			return entry.records[served%uint64(len(entry.records))]
 		}
+		return entry.records[0]
+	}
+
+	r.recordsLock.Lock()
+	defer r.recordsLock.Unlock()
+
+	entry := r.replayIndex[key]
+	if entry == nil {
+		return nil
+	}
+
+	for _, record := range entry.records {
+		// Only allow each request to be played back one time
+		if r.consumedRecords[record] {
+			recorderLog.Debugf("Already seen record, continuing: %s", key.match)
+			continue
+		}
+
+		// Don't allow this same record to be played back again
+		r.consumedRecords[record] = true
+		return record
 	}
 
 	return nil
 }
 
+func indexRecord(replayIndex map[replayKey]*replayEntry, record *RecordedRecord, match *ReplayMatch) {
+	key := replayKey{tapeID: record.TapeID, match: match.recordKey(record)}
+	entry := replayIndex[key]
+	if entry == nil {
+		entry = &replayEntry{}
+		replayIndex[key] = entry
+	}
+	entry.records = append(entry.records, record)
+}
+
 func (r *Recorder) Print() {
-	log.Printf("Total requests: %d", len(r.records))
+	r.recordsLock.RLock()
+	defer r.recordsLock.RUnlock()
+
+	recorderLog.Infof("Total requests: %d", len(r.records))
+	if r.store != nil {
+		recorderLog.Infof("Requests recorded to disk: %d", r.store.Len())
+	}
 
 	for _, record := range r.records {
-		log.Printf("Request archive: %s %s (response size: %d)\n", record.Request.Url, record.Request.Method, len(record.Response.Body))
+		recorderLog.Infof("Request archive: %s %s (response size: %d)", record.Request.Url, record.Request.Method, len(record.Response.Body))
 	}
 }
 
@@ -181,19 +739,34 @@ func setupRecorderMiddleware(proxy *goproxy.ProxyHttpServer, recorder *Recorder)
 		 * Recorder
 		 */
 		func(r *http.Request, ctx *goproxy.ProxyCtx) (*http.Request, *http.Response) {
-			// Only handle responses during write mode
-			log.Printf("Recorder get mode... %d\n", recorder.mode)
-			if recorder.mode != RecorderModeRead {
+			defer recorderStage.request.ObserveSince(time.Now())
+
+			requestHeaders := ctx.UserData.(*HeaderDefinition)
+
+			switch recorder.ModeFor(requestHeaders.tapeID) {
+			case RecorderModeWrite:
+				// The body is only readable once, keep a copy as the transport sends it upstream
+				captureRequestBody(r)
+				return r, nil
+			case RecorderModeOff:
 				return r, nil
 			}
 
-			recordResult := recorder.FindMatchingResponse(r, ctx.UserData.(*HeaderDefinition))
+			recordResult, err := recorder.FindMatchingResponse(r, requestHeaders)
+			if err == errReplayCanceled {
+				// Nobody reads this response, it only stops the request from going upstream
+				recorderLog.Debugf("Client went away during replay: %s", r.URL)
+				return r, goproxy.NewResponse(r, goproxy.ContentTypeText, http.StatusServiceUnavailable, "Client went away")
+			}
+			if err != nil {
+				recorderLog.Errorf("Unable to read recorded tape: %s", err)
+			}
 
 			if recordResult != nil {
-				log.Printf("Record found: %s\n", r.URL.String())
+				recorderLog.Debugf("Record found: %s", r.URL)
 				return r, recordResult
 			} else {
-				log.Printf("No matching record found: %s\n", r.URL.String())
+				recorderLog.Infof("No matching record found: %s", r.URL)
 				// Implementation specific - for now fail result if we can't find a
 				// playback entry in the tape
 				return r, goproxy.NewResponse(
@@ -213,22 +786,30 @@ func setupRecorderMiddleware(proxy *goproxy.ProxyHttpServer, recorder *Recorder)
 		 * Recorder
 		 */
 		func(response *http.Response, ctx *goproxy.ProxyCtx) *http.Response {
+			defer recorderStage.response.ObserveSince(time.Now())
+
+			requestHeaders := ctx.UserData.(*HeaderDefinition)
+
 			// Only handle responses during write mode
-			if recorder.mode != RecorderModeWrite {
+			if recorder.ModeFor(requestHeaders.tapeID) != RecorderModeWrite {
 				return response
 			}
 
-			log.Println("Record request/response...")
-			requestHistory, responseHistory := getRedirectHistory(response)
-
 			// When replaying this we want to replay it in order to capture all the
 			// event history and test redirect handlers
+			requestHistory, responseHistory := getRedirectHistory(response)
+
 			for i := 0; i < len(requestHistory); i++ {
 				request := requestHistory[i]
 				response := responseHistory[i]
 
-				recorder.LogPair(request, ctx.UserData.(*HeaderDefinition), response)
-				log.Println("Added record log.")
+				var timer *requestTimer
+				if i == len(requestHistory)-1 {
+					timer = requestHeaders.timer
+				}
+
+				recorder.LogPair(request, requestHeaders, response, timer)
+				recorderLog.Debugf("Added record: %s", request.URL)
 			}
 
 			return response
@@ -0,0 +1,555 @@
+package main
+
+import (
+	"bytes"
+	"compress/gzip"
+	"context"
+	"encoding/json"
+	"errors"
+	"fmt"
+	"io"
+	"net/http"
+	"regexp"
+	"runtime"
+	"strings"
+	"sync"
+	"sync/atomic"
+	"testing"
+	"time"
+)
+
+func TestExportPaging(t *testing.T) {
+	store, err := OpenTapeStore(t.TempDir())
+	if err != nil {
+		t.Fatal(err)
+	}
+	recorder := NewRecorder(NewConfigStore(), store)
+
+	// Without sequences, loaded records are paged before the ones recorded to disk
+	for i := 0; i < 3; i++ {
+		recorder.records = append(recorder.records, newStoreRecord(fmt.Sprintf("https://example.com/loaded/%d", i), ""))
+		store.Append(newStoreRecord(fmt.Sprintf("https://example.com/recorded/%d", i), ""))
+	}
+
+	tests := []struct {
+		name       string
+		options    TapeExport
+		expected   int
+		first      string
+		nextCursor int
+	}{
+		{"everything", TapeExport{}, 6, "https://example.com/loaded/0", -1},
+		{"first page", TapeExport{Limit: 4}, 4, "https://example.com/loaded/0", 4},
+		{"spans both", TapeExport{Cursor: 2, Limit: 2}, 2, "https://example.com/loaded/2", 4},
+		{"last page", TapeExport{Cursor: 4, Limit: 4}, 2, "https://example.com/recorded/1", -1},
+		{"past the end", TapeExport{Cursor: 10}, 0, "", -1},
+		{"url filter", TapeExport{URLPattern: regexp.MustCompile("/recorded/"), Limit: 1}, 1, "https://example.com/recorded/0", 1},
+		{"parallel", TapeExport{Workers: 4, CompressionLevel: gzip.BestSpeed}, 6, "https://example.com/loaded/0", -1},
+	}
+
+	for _, test := range tests {
+		page, err := recorder.ExportData(test.options)
+		if err != nil {
+			t.Fatal(err)
+		}
+
+		var buffer bytes.Buffer
+		if err := page.Stream(&buffer); err != nil {
+			t.Fatal(err)
+		}
+		reader, err := gzip.NewReader(&buffer)
+		if err != nil {
+			t.Fatal(err)
+		}
+		var records []*RecordedRecord
+		if err := json.NewDecoder(reader).Decode(&records); err != nil {
+			t.Fatalf("%s: %s", test.name, err)
+		}
+
+		if len(records) != test.expected {
+			t.Errorf("%s: expected %d records, got %d", test.name, test.expected, len(records))
+		}
+		if len(records) > 0 && records[0].Request.Url != test.first {
+			t.Errorf("%s: unexpected first record %s", test.name, records[0].Request.Url)
+		}
+		if page.NextCursor != test.nextCursor {
+			t.Errorf("%s: expected next cursor %d, got %d", test.name, test.nextCursor, page.NextCursor)
+		}
+	}
+}
+
+type failingWriter struct{}
+
+func (failingWriter) Write(p []byte) (int, error) {
+	return 0, errors.New("client went away")
+}
+
+func TestExportAbortStopsWorkers(t *testing.T) {
+	recorder := NewRecorder(NewConfigStore(), nil)
+	for i := 0; i < 50; i++ {
+		record := newStoreRecord(fmt.Sprintf("https://example.com/%d", i), "")
+		record.Response.Body = bytes.Repeat([]byte{byte(i)}, parallelGzipBlockSize/4)
+		recorder.records = append(recorder.records, record)
+	}
+
+	before := runtime.NumGoroutine()
+	page, err := recorder.ExportData(TapeExport{Workers: 4, CompressionLevel: gzip.BestSpeed})
+	if err != nil {
+		t.Fatal(err)
+	}
+	if err := page.Stream(failingWriter{}); err == nil {
+		t.Fatal("Expected the export to fail")
+	}
+
+	// Compression goroutines finish shortly after the writer loop stops
+	deadline := time.Now().Add(5 * time.Second)
+	for runtime.NumGoroutine() > before && time.Now().Before(deadline) {
+		time.Sleep(10 * time.Millisecond)
+	}
+	if after := runtime.NumGoroutine(); after > before {
+		t.Errorf("Expected %d goroutines after an aborted export, got %d", before, after)
+	}
+}
+
+func TestLoadData(t *testing.T) {
+	compress := func(payload string) *bytes.Buffer {
+		var buffer bytes.Buffer
+		writer := gzip.NewWriter(&buffer)
+		writer.Write([]byte(payload))
+		writer.Close()
+		return &buffer
+	}
+
+	tests := []struct {
+		name    string
+		tape    io.Reader
+		records int
+		valid   bool
+	}{
+		{"records", compress(`[{"request": {"url": "https://example.com/1"}, "tape_id": "Tape1"}, {"request": {"url": "https://example.com/2"}}]`), 2, true},
+		{"empty", compress(`[]`), 0, true},
+		{"not gzipped", strings.NewReader(`[]`), 0, false},
+		{"not an array", compress(`{"request": {}}`), 0, false},
+		{"corrupt record", compress(`[{"request": {"url": 5}}]`), 0, false},
+		{"truncated", compress(`[{"request": {"url": "https://example.com/1"}}`), 0, false},
+	}
+
+	for _, test := range tests {
+		recorder := NewRecorder(NewConfigStore(), nil)
+		existing := newStoreRecord("https://example.com/existing", "")
+		recorder.records = []*RecordedRecord{existing}
+
+		err := recorder.LoadData(test.tape, "")
+		if (err == nil) != test.valid {
+			t.Fatalf("%s: unexpected error %v", test.name, err)
+		}
+
+		if !test.valid {
+			// A failed load keeps what was there before
+			if len(recorder.records) != 1 || recorder.records[0] != existing {
+				t.Errorf("%s: existing records were replaced", test.name)
+			}
+			continue
+		}
+		if len(recorder.records) != test.records {
+			t.Errorf("%s: expected %d records, got %d", test.name, test.records, len(recorder.records))
+		}
+	}
+}
+
+func TestReplayIndex(t *testing.T) {
+	recorder := NewRecorder(NewConfigStore(), nil)
+	var tape bytes.Buffer
+	writer := gzip.NewWriter(&tape)
+	writer.Write([]byte(`[
+		{"request": {"url": "https://example.com/1"}, "response": {"status": 200, "body": "Zmlyc3Q="}, "tape_id": "Tape1"},
+		{"request": {"url": "https://example.com/1"}, "response": {"status": 200, "body": "c2Vjb25k"}, "tape_id": "Tape1"},
+		{"request": {"url": "https://example.com/1"}, "response": {"status": 200, "body": "b3RoZXI="}, "tape_id": "Tape2"}
+	]`))
+	writer.Close()
+	if err := recorder.LoadData(&tape, ""); err != nil {
+		t.Fatal(err)
+	}
+
+	request, _ := http.NewRequest("GET", "https://example.com/1", nil)
+	headers := &HeaderDefinition{tapeID: "Tape1"}
+
+	// Duplicate URLs play back in tape order, once each
+	for _, expected := range []string{"first", "second"} {
+		response, _ := recorder.FindMatchingResponse(request, headers)
+		if response == nil {
+			t.Fatalf("Expected a match for %s", expected)
+		}
+		body, _ := io.ReadAll(response.Body)
+		if string(body) != expected {
+			t.Errorf("Expected %s, got %s", expected, body)
+		}
+	}
+	if response, _ := recorder.FindMatchingResponse(request, headers); response != nil {
+		t.Error("Records should only play back once")
+	}
+
+	recorder.ClearTapeID("Tape2")
+	if response, _ := recorder.FindMatchingResponse(request, &HeaderDefinition{tapeID: "Tape2"}); response != nil {
+		t.Error("Cleared tape should not play back")
+	}
+}
+
+func TestExportSince(t *testing.T) {
+	store, err := OpenTapeStore(t.TempDir())
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	tests := []struct {
+		name     string
+		recorder *Recorder
+	}{
+		{"memory", NewRecorder(NewConfigStore(), nil)},
+		{"disk", NewRecorder(NewConfigStore(), store)},
+	}
+
+	for _, test := range tests {
+		poll := func(since uint64) ([]*RecordedRecord, uint64) {
+			page, err := test.recorder.ExportData(TapeExport{Since: since})
+			if err != nil {
+				t.Fatal(err)
+			}
+			var buffer bytes.Buffer
+			page.Stream(&buffer)
+			reader, _ := gzip.NewReader(&buffer)
+			var records []*RecordedRecord
+			json.NewDecoder(reader).Decode(&records)
+			return records, page.NextSince
+		}
+
+		test.recorder.addRecord(newStoreRecord("https://example.com/1", ""))
+		test.recorder.addRecord(newStoreRecord("https://example.com/2", ""))
+
+		records, since := poll(0)
+		if len(records) != 2 || since != 2 {
+			t.Fatalf("%s: expected two records up to 2, got %d up to %d", test.name, len(records), since)
+		}
+
+		// Nothing new keeps the cursor in place
+		if records, next := poll(since); len(records) != 0 || next != since {
+			t.Errorf("%s: expected no new records, got %d up to %d", test.name, len(records), next)
+		}
+
+		// Sequences keep increasing across a clear
+		test.recorder.Clear()
+		test.recorder.addRecord(newStoreRecord("https://example.com/3", ""))
+
+		records, since = poll(since)
+		if len(records) != 1 || records[0].Request.Url != "https://example.com/3" || since != 3 {
+			t.Errorf("%s: expected only the newest record, got %d up to %d", test.name, len(records), since)
+		}
+	}
+}
+
+func TestExportSinceMixed(t *testing.T) {
+	store, err := OpenTapeStore(t.TempDir())
+	if err != nil {
+		t.Fatal(err)
+	}
+	recorder := NewRecorder(NewConfigStore(), store)
+
+	// Sequences 1 and 2 on disk, then a loaded tape gets 3 and 4, then 5 on disk again
+	recorder.addRecord(newStoreRecord("https://example.com/recorded/1", ""))
+	recorder.addRecord(newStoreRecord("https://example.com/recorded/2", ""))
+	var tape bytes.Buffer
+	writer := gzip.NewWriter(&tape)
+	json.NewEncoder(writer).Encode([]*RecordedRecord{
+		newStoreRecord("https://example.com/loaded/3", "Tape1"),
+		newStoreRecord("https://example.com/loaded/4", "Tape1"),
+	})
+	writer.Close()
+	if err := recorder.LoadData(&tape, "Tape1"); err != nil {
+		t.Fatal(err)
+	}
+	recorder.addRecord(newStoreRecord("https://example.com/recorded/5", ""))
+
+	// Polling in pages returns every record once, in sequence order
+	var urls []string
+	since := uint64(0)
+	for i := 0; i < 10; i++ {
+		page, err := recorder.ExportData(TapeExport{Since: since, Limit: 2})
+		if err != nil {
+			t.Fatal(err)
+		}
+		var buffer bytes.Buffer
+		page.Stream(&buffer)
+		reader, _ := gzip.NewReader(&buffer)
+		var records []*RecordedRecord
+		json.NewDecoder(reader).Decode(&records)
+		if len(records) == 0 {
+			break
+		}
+		for _, record := range records {
+			urls = append(urls, record.Request.Url)
+		}
+		since = page.NextSince
+	}
+
+	expected := []string{
+		"https://example.com/recorded/1",
+		"https://example.com/recorded/2",
+		"https://example.com/loaded/3",
+		"https://example.com/loaded/4",
+		"https://example.com/recorded/5",
+	}
+	if strings.Join(urls, " ") != strings.Join(expected, " ") {
+		t.Errorf("Expected %v, got %v", expected, urls)
+	}
+}
+
+func TestTapeNamespaces(t *testing.T) {
+	recorder := NewRecorder(NewConfigStore(), nil)
+	recorder.SetMode(RecorderModeWrite)
+	recorder.addRecord(newStoreRecord("https://example.com/1", "Tape1"))
+
+	var tape bytes.Buffer
+	writer := gzip.NewWriter(&tape)
+	writer.Write([]byte(`[{"request": {"url": "https://example.com/1"}, "response": {"status": 200}, "tape_id": "Recorded"}]`))
+	writer.Close()
+
+	// Loading one tape leaves the others recording
+	if err := recorder.LoadData(&tape, "Tape2"); err != nil {
+		t.Fatal(err)
+	}
+	recorder.SetTapeMode("Tape2", RecorderModeRead)
+
+	tests := []struct {
+		tapeID string
+		mode   int
+		urls   []string
+	}{
+		{"Tape1", RecorderModeWrite, []string{"https://example.com/1"}},
+		{"Tape2", RecorderModeRead, []string{"https://example.com/1"}},
+		{"", RecorderModeWrite, []string{"https://example.com/1", "https://example.com/1"}},
+	}
+
+	for _, test := range tests {
+		if mode := recorder.ModeFor(test.tapeID); mode != test.mode {
+			t.Errorf("Tape %q: expected mode %d, got %d", test.tapeID, test.mode, mode)
+		}
+		if urls := exportedURLs(t, recorder, test.tapeID); len(urls) != len(test.urls) {
+			t.Errorf("Tape %q: expected %v, got %v", test.tapeID, test.urls, urls)
+		}
+	}
+
+	// Loaded records are replayed under the tape they were loaded into
+	request, _ := http.NewRequest("GET", "https://example.com/1", nil)
+	if response, _ := recorder.FindMatchingResponse(request, &HeaderDefinition{tapeID: "Tape2"}); response == nil {
+		t.Error("Expected loaded record to play back")
+	}
+
+	// A tape back on the global mode releases its entry
+	recorder.SetTapeMode("Tape2", RecorderModeWrite)
+	if _, ok := recorder.config.Load().TapeModes["Tape2"]; ok {
+		t.Error("Tape on the global mode should not keep an entry")
+	}
+
+	// Setting the global mode applies to every tape
+	recorder.SetTapeMode("Tape1", RecorderModeOff)
+	recorder.SetMode(RecorderModeRead)
+	if mode := recorder.ModeFor("Tape1"); mode != RecorderModeRead {
+		t.Errorf("Expected the global mode, got %d", mode)
+	}
+}
+
+func TestReplayModes(t *testing.T) {
+	store, err := OpenTapeStore(t.TempDir())
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	tests := []struct {
+		name     string
+		recorder *Recorder
+		mode     int
+		expected []string
+	}{
+		{"memory consume", NewRecorder(NewConfigStore(), nil), ReplayModeConsume, []string{"1", "2", ""}},
+		{"memory first", NewRecorder(NewConfigStore(), nil), ReplayModeFirst, []string{"1", "1", "1"}},
+		{"memory round-robin", NewRecorder(NewConfigStore(), nil), ReplayModeRoundRobin, []string{"1", "2", "1"}},
+		{"disk first", NewRecorder(NewConfigStore(), store), ReplayModeFirst, []string{"1", "1", "1"}},
+		{"disk round-robin", NewRecorder(NewConfigStore(), store), ReplayModeRoundRobin, []string{"1", "2", "1"}},
+	}
+
+	request, _ := http.NewRequest("GET", "https://example.com/1", nil)
+	headers := &HeaderDefinition{}
+
+	for _, test := range tests {
+		test.recorder.SetReplayMode(test.mode)
+		test.recorder.Clear()
+		for _, body := range []string{"1", "2"} {
+			record := newStoreRecord("https://example.com/1", "")
+			record.Response.Body = []byte(body)
+			test.recorder.addRecord(record)
+		}
+		if test.recorder.store != nil {
+			store.Sync()
+		}
+
+		for i, expected := range test.expected {
+			var body []byte
+			if response, _ := test.recorder.FindMatchingResponse(request, headers); response != nil {
+				body, _ = io.ReadAll(response.Body)
+			}
+			if string(body) != expected {
+				t.Errorf("%s: request %d expected %q, got %q", test.name, i, expected, body)
+			}
+		}
+	}
+}
+
+func TestConcurrentReplay(t *testing.T) {
+	recorder := NewRecorder(NewConfigStore(), nil)
+	recorder.SetReplayMode(ReplayModeRoundRobin)
+	recorder.addRecord(newStoreRecord("https://example.com/1", ""))
+
+	// Read-only replay serves every client from the same tape
+	var wg sync.WaitGroup
+	var misses int64
+	for i := 0; i < 100; i++ {
+		wg.Add(1)
+		go func() {
+			defer wg.Done()
+			request, _ := http.NewRequest("GET", "https://example.com/1", nil)
+			if response, _ := recorder.FindMatchingResponse(request, &HeaderDefinition{}); response == nil {
+				atomic.AddInt64(&misses, 1)
+			}
+		}()
+	}
+	wg.Wait()
+
+	if misses > 0 {
+		t.Errorf("%d clients missed the shared record", misses)
+	}
+}
+
+func TestReplayTiming(t *testing.T) {
+	tests := []struct {
+		name    string
+		scale   float64
+		minimum time.Duration
+	}{
+		{"as fast as possible", 0, 0},
+		{"as recorded", 1, 60 * time.Millisecond},
+		{"scaled", 2, 120 * time.Millisecond},
+	}
+
+	for _, test := range tests {
+		recorder := NewRecorder(NewConfigStore(), nil)
+		recorder.SetReplayTimeScale(test.scale)
+
+		record := newStoreRecord("https://example.com/1", "")
+		record.Timing = &RequestTiming{DialMs: 10, TTFBMs: 20, TransferMs: 30}
+		recorder.addRecord(record)
+
+		request, _ := http.NewRequest("GET", "https://example.com/1", nil)
+
+		start := time.Now()
+		response, _ := recorder.FindMatchingResponse(request, &HeaderDefinition{})
+		if response == nil {
+			t.Fatalf("%s: expected a match", test.name)
+		}
+		io.ReadAll(response.Body)
+		elapsed := time.Since(start)
+
+		if elapsed < test.minimum {
+			t.Errorf("%s: expected at least %s, took %s", test.name, test.minimum, elapsed)
+		}
+		if test.scale == 0 && elapsed > 50*time.Millisecond {
+			t.Errorf("%s: unpaced replay took %s", test.name, elapsed)
+		}
+	}
+}
+
+func TestReplayTimingCanceled(t *testing.T) {
+	store, err := OpenTapeStore(t.TempDir())
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	tests := []struct {
+		name     string
+		recorder *Recorder
+	}{
+		{"memory", NewRecorder(NewConfigStore(), nil)},
+		{"disk", NewRecorder(NewConfigStore(), store)},
+	}
+
+	for _, test := range tests {
+		test.recorder.SetReplayTimeScale(1)
+		record := newStoreRecord("https://example.com/1", "")
+		record.Timing = &RequestTiming{TTFBMs: 1000}
+		test.recorder.addRecord(record)
+		store.Sync()
+
+		// The client disconnects while the response is held back
+		ctx, cancel := context.WithCancel(context.Background())
+		request, _ := http.NewRequestWithContext(ctx, "GET", "https://example.com/1", nil)
+		time.AfterFunc(10*time.Millisecond, cancel)
+		if response, err := test.recorder.FindMatchingResponse(request, &HeaderDefinition{}); response != nil || err != errReplayCanceled {
+			t.Errorf("%s: expected a canceled replay, got %v %v", test.name, response, err)
+		}
+
+		// The record was never delivered, so a retry still gets it
+		test.recorder.SetReplayTimeScale(0)
+		request, _ = http.NewRequest("GET", "https://example.com/1", nil)
+		if response, err := test.recorder.FindMatchingResponse(request, &HeaderDefinition{}); response == nil || err != nil {
+			t.Errorf("%s: expected the record to be replayed again, got %v %v", test.name, response, err)
+		}
+	}
+}
+
+func TestReplayMatchIndex(t *testing.T) {
+	store, err := OpenTapeStore(t.TempDir())
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	tests := []struct {
+		name     string
+		recorder *Recorder
+	}{
+		{"memory", NewRecorder(NewConfigStore(), nil)},
+		{"disk", NewRecorder(NewConfigStore(), store)},
+	}
+
+	for _, test := range tests {
+		test.recorder.SetReplayMode(ReplayModeFirst)
+		for _, query := range []string{"first", "second"} {
+			record := newStoreRecord("https://example.com/graphql?ts=1", "")
+			record.Request.Method = "POST"
+			record.Request.Body = []byte(query)
+			record.Response.Body = []byte(query)
+			test.recorder.addRecord(record)
+		}
+		store.Sync()
+
+		replay := func(query string) string {
+			request, _ := http.NewRequest("POST", "https://example.com/graphql?ts=2", strings.NewReader(query))
+			response, _ := test.recorder.FindMatchingResponse(request, &HeaderDefinition{})
+			if response == nil {
+				return ""
+			}
+			body, _ := io.ReadAll(response.Body)
+			return string(body)
+		}
+
+		if body := replay("second"); body != "" {
+			t.Errorf("%s: exact matching should miss a changed timestamp, got %q", test.name, body)
+		}
+
+		// Records already indexed are re-keyed
+		test.recorder.SetReplayMatch(ReplayMatch{IgnoreParams: []string{"ts"}, Body: true})
+		for _, query := range []string{"second", "first"} {
+			if body := replay(query); body != query {
+				t.Errorf("%s: expected %q, got %q", test.name, query, body)
+			}
+		}
+	}
+}
@@ -0,0 +1,86 @@
+package main
+
+import (
+	"bytes"
+	"crypto/sha256"
+	"encoding/hex"
+	"io"
+	"net/http"
+	"net/url"
+)
+
+type ReplayMatch struct {
+	/*
+	 * Which parts of a request select the record it replays
+	 *
+	 * The zero value matches on the exact URL. Keys are computed once per record when it's
+	 * indexed, so looser matching still resolves with a single map lookup.
+	 */
+
+	// Query parameters left out of the key, typically cache busters and timestamps. Remaining
+	// parameters are sorted so their order doesn't matter either.
+	IgnoreParams []string
+
+	// Tell apart requests to the same URL, for APIs like GraphQL that POST every query to a
+	// single endpoint
+	Method bool
+	Body   bool
+}
+
+func (match *ReplayMatch) recordKey(record *RecordedRecord) string {
+	var bodyHash string
+	if match.Body {
+		bodyHash = hashBody(record.Request.Body)
+	}
+	return match.key(record.Request.Method, record.Request.Url, bodyHash)
+}
+
+func (match *ReplayMatch) requestKey(request *http.Request) string {
+	var bodyHash string
+	if match.Body {
+		// Replayed requests never reach upstream, but keep the body readable for other middlewares
+		var body []byte
+		if request.Body != nil {
+			body, _ = io.ReadAll(request.Body)
+			request.Body.Close()
+			request.Body = io.NopCloser(bytes.NewReader(body))
+		}
+		bodyHash = hashBody(body)
+	}
+	return match.key(request.Method, request.URL.String(), bodyHash)
+}
+
+func (match *ReplayMatch) key(method string, rawURL string, bodyHash string) string {
+	key := rawURL
+	if len(match.IgnoreParams) > 0 {
+		key = stripQueryParams(rawURL, match.IgnoreParams)
+	}
+	if match.Method {
+		key = method + " " + key
+	}
+	if match.Body {
+		key += " " + bodyHash
+	}
+	return key
+}
+
+func stripQueryParams(rawURL string, params []string) string {
+	parsed, err := url.Parse(rawURL)
+	if err != nil {
+		return rawURL
+	}
+
+	query := parsed.Query()
+	for _, param := range params {
+		query.Del(param)
+	}
+	// Encode sorts by key
+	parsed.RawQuery = query.Encode()
+
+	return parsed.String()
+}
+
+func hashBody(body []byte) string {
+	sum := sha256.Sum256(body)
+	return hex.EncodeToString(sum[:])
+}
@@ -0,0 +1,50 @@
+package main
+
+import (
+	"io"
+	"net/http"
+	"strings"
+	"testing"
+)
+
+func TestReplayMatchKey(t *testing.T) {
+	tests := []struct {
+		name     string
+		match    ReplayMatch
+		recorded string
+		request  string
+		method   string
+		body     string
+		matches  bool
+	}{
+		{"exact url", ReplayMatch{}, "https://example.com/a?b=1", "https://example.com/a?b=1", "GET", "", true},
+		{"changed param", ReplayMatch{}, "https://example.com/a?b=1", "https://example.com/a?b=2", "GET", "", false},
+		{"ignored param", ReplayMatch{IgnoreParams: []string{"_"}}, "https://example.com/a?b=1&_=100", "https://example.com/a?_=200&b=1", "GET", "", true},
+		{"ignored only param", ReplayMatch{IgnoreParams: []string{"_"}}, "https://example.com/a?_=100", "https://example.com/a?_=200", "GET", "", true},
+		{"other param", ReplayMatch{IgnoreParams: []string{"_"}}, "https://example.com/a?b=1", "https://example.com/a?b=2", "GET", "", false},
+		{"ignored method", ReplayMatch{}, "https://example.com/a", "https://example.com/a", "HEAD", "", true},
+		{"method", ReplayMatch{Method: true}, "https://example.com/a", "https://example.com/a", "HEAD", "", false},
+		{"same body", ReplayMatch{Body: true}, "https://example.com/graphql", "https://example.com/graphql", "POST", "query", true},
+		{"other body", ReplayMatch{Body: true}, "https://example.com/graphql", "https://example.com/graphql", "POST", "mutation", false},
+	}
+
+	for _, test := range tests {
+		record := newStoreRecord(test.recorded, "")
+		record.Request.Method = "GET"
+		if test.method == "POST" {
+			record.Request.Method = "POST"
+		}
+		record.Request.Body = []byte("query")
+
+		request, _ := http.NewRequest(test.method, test.request, strings.NewReader(test.body))
+		matches := test.match.recordKey(record) == test.match.requestKey(request)
+		if matches != test.matches {
+			t.Errorf("%s: expected match=%t", test.name, test.matches)
+		}
+
+		// Hashing the body leaves it readable
+		if body, _ := io.ReadAll(request.Body); string(body) != test.body {
+			t.Errorf("%s: request body changed to %q", test.name, body)
+		}
+	}
+}
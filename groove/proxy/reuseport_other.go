@@ -0,0 +1,12 @@
+//go:build !linux && !darwin
+
+package main
+
+import (
+	"errors"
+	"syscall"
+)
+
+func setReusePort(network, address string, rawConnection syscall.RawConn) error {
+	return errors.New("SO_REUSEPORT is not supported on this platform")
+}
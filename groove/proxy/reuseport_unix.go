@@ -0,0 +1,20 @@
+//go:build linux || darwin
+
+package main
+
+import (
+	"syscall"
+
+	"golang.org/x/sys/unix"
+)
+
+func setReusePort(network, address string, rawConnection syscall.RawConn) error {
+	var socketErr error
+	err := rawConnection.Control(func(fd uintptr) {
+		socketErr = unix.SetsockoptInt(int(fd), unix.SOL_SOCKET, unix.SO_REUSEPORT, 1)
+	})
+	if err != nil {
+		return err
+	}
+	return socketErr
+}
@@ -0,0 +1,26 @@
+//go:build linux || darwin
+
+package main
+
+import (
+	"context"
+	"net"
+	"testing"
+)
+
+func TestReusePortListeners(t *testing.T) {
+	listenConfig := net.ListenConfig{Control: setReusePort}
+
+	first, err := listenConfig.Listen(context.Background(), "tcp", "127.0.0.1:0")
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer first.Close()
+
+	// Binding the same port twice only works when SO_REUSEPORT is set on both sockets
+	second, err := listenConfig.Listen(context.Background(), "tcp", first.Addr().String())
+	if err != nil {
+		t.Fatalf("Unable to bind second listener: %s", err)
+	}
+	defer second.Close()
+}
@@ -0,0 +1,293 @@
+package main
+
+import (
+	"bufio"
+	"bytes"
+	"encoding/binary"
+	"encoding/json"
+	"errors"
+	"fmt"
+	"io"
+)
+
+const (
+	// Gzipped JSON array with base64 bodies, readable by every client version
+	TapeFormatJSON = iota
+
+	// Gzipped length-prefixed frames with raw bodies
+	TapeFormatBinary = iota
+)
+
+// Clients ask for the binary format with this Accept header
+const TapeBinaryContentType = "application/x-groove-tape"
+
+// Start of an uncompressed binary tape, the last byte is the format version
+var tapeBinaryMagic = []byte("GRVT\x02")
+
+// Version 1 tapes have no body references and are still read
+var tapeBinaryMagicV1 = []byte("GRVT\x01")
+
+// Set on the length of a body frame that refers to an earlier body instead, the remaining
+// bits are the body's index in the order bodies first appeared on the tape
+const tapeBodyReference = 1 << 31
+
+type tapeEncoder struct {
+	/*
+	 * Writes records to an uncompressed tape stream
+	 *
+	 * The binary format is the magic header followed by one frame per record:
+	 *
+	 *   [uint32 length][record JSON without bodies]
+	 *   [uint32 length][raw request body]
+	 *   [uint32 length][raw response body]
+	 *
+	 * Lengths are big endian. Bodies skip the base64 step, which inflates them by a third
+	 * before compression and dominates encode and decode time for large tapes.
+	 *
+	 * Each distinct body is only written once. Later records with the same body get a frame
+	 * that's just its length field, with tapeBodyReference set. Empty bodies are always inline.
+	 */
+	writer io.Writer
+	format int
+	count  int
+
+	// Index of every body written so far, by content hash
+	bodies map[bodyKey]uint32
+
+	header [4]byte
+}
+
+func newTapeEncoder(writer io.Writer, format int) *tapeEncoder {
+	return &tapeEncoder{writer: writer, format: format, bodies: make(map[bodyKey]uint32)}
+}
+
+func (encoder *tapeEncoder) Write(record *RecordedRecord) error {
+	if encoder.format == TapeFormatJSON {
+		payload, err := json.Marshal(record)
+		if err != nil {
+			return err
+		}
+		return encoder.WritePayload(payload)
+	}
+
+	if encoder.count == 0 {
+		if _, err := encoder.writer.Write(tapeBinaryMagic); err != nil {
+			return err
+		}
+	}
+	encoder.count += 1
+
+	// Shallow copy so the shared record keeps its bodies
+	metadata := *record
+	metadata.Request.Body = nil
+	metadata.Response.Body = nil
+	payload, err := json.Marshal(&metadata)
+	if err != nil {
+		return err
+	}
+
+	if err := encoder.writeFrame(payload); err != nil {
+		return err
+	}
+	if err := encoder.writeBody(record.Request.Body, record.requestBodyKey); err != nil {
+		return err
+	}
+	return encoder.writeBody(record.Response.Body, record.responseBodyKey)
+}
+
+func (encoder *tapeEncoder) WritePayload(payload []byte) error {
+	/*
+	 * Write a record that's already JSON encoded, as kept by the disk store
+	 */
+	if encoder.format == TapeFormatBinary {
+		var record RecordedRecord
+		if err := json.Unmarshal(payload, &record); err != nil {
+			return err
+		}
+		return encoder.Write(&record)
+	}
+
+	separator := ","
+	if encoder.count == 0 {
+		separator = "["
+	}
+	encoder.count += 1
+
+	if _, err := io.WriteString(encoder.writer, separator); err != nil {
+		return err
+	}
+	_, err := encoder.writer.Write(payload)
+	return err
+}
+
+func (encoder *tapeEncoder) Close() error {
+	/*
+	 * Finish the stream, an empty binary tape is just the magic header
+	 */
+	if encoder.format == TapeFormatBinary {
+		if encoder.count == 0 {
+			_, err := encoder.writer.Write(tapeBinaryMagic)
+			return err
+		}
+		return nil
+	}
+
+	closing := "]"
+	if encoder.count == 0 {
+		closing = "[]"
+	}
+	_, err := io.WriteString(encoder.writer, closing)
+	return err
+}
+
+func (encoder *tapeEncoder) writeBody(body []byte, key bodyKey) error {
+	/*
+	 * Records shared through a bodyStore already know their keys, others are hashed here
+	 */
+	if len(body) == 0 {
+		return encoder.writeFrame(body)
+	}
+	if key == (bodyKey{}) {
+		key = newBodyKey(body)
+	}
+
+	if index, ok := encoder.bodies[key]; ok {
+		binary.BigEndian.PutUint32(encoder.header[:], tapeBodyReference|index)
+		_, err := encoder.writer.Write(encoder.header[:])
+		return err
+	}
+
+	if len(body) >= tapeBodyReference || len(encoder.bodies) >= tapeBodyReference {
+		return fmt.Errorf("Body of %d bytes doesn't fit in a tape", len(body))
+	}
+	encoder.bodies[key] = uint32(len(encoder.bodies))
+	return encoder.writeFrame(body)
+}
+
+func (encoder *tapeEncoder) writeFrame(frame []byte) error {
+	binary.BigEndian.PutUint32(encoder.header[:], uint32(len(frame)))
+	if _, err := encoder.writer.Write(encoder.header[:]); err != nil {
+		return err
+	}
+	_, err := encoder.writer.Write(frame)
+	return err
+}
+
+func newTapeDecoder(reader io.Reader) (func() (*RecordedRecord, error), error) {
+	/*
+	 * Iterate over the records of an uncompressed tape in either format
+	 * The returned function gives io.EOF once the tape ends cleanly.
+	 */
+	buffered := bufio.NewReader(reader)
+
+	magic, _ := buffered.Peek(len(tapeBinaryMagic))
+	if bytes.Equal(magic, tapeBinaryMagic) || bytes.Equal(magic, tapeBinaryMagicV1) {
+		buffered.Discard(len(tapeBinaryMagic))
+		return binaryTapeDecoder(buffered), nil
+	}
+
+	decoder := json.NewDecoder(buffered)
+	if token, err := decoder.Token(); err != nil || token != json.Delim('[') {
+		return nil, fmt.Errorf("Tape should be a JSON array of records")
+	}
+
+	return func() (*RecordedRecord, error) {
+		if !decoder.More() {
+			if _, err := decoder.Token(); err != nil {
+				return nil, fmt.Errorf("Tape is truncated: %w", err)
+			}
+			return nil, io.EOF
+		}
+
+		record := &RecordedRecord{}
+		if err := decoder.Decode(record); err != nil {
+			return nil, err
+		}
+		return record, nil
+	}, nil
+}
+
+type decodedBody struct {
+	body []byte
+	key  bodyKey
+}
+
+func binaryTapeDecoder(reader *bufio.Reader) func() (*RecordedRecord, error) {
+	/*
+	 * Referenced bodies are shared between the decoded records, which also get their keys
+	 * so a bodyStore doesn't need to hash them again
+	 */
+	var header [4]byte
+	bodies := make([]decodedBody, 0)
+
+	readHeader := func() (uint32, error) {
+		if _, err := io.ReadFull(reader, header[:]); err != nil {
+			return 0, err
+		}
+		return binary.BigEndian.Uint32(header[:]), nil
+	}
+
+	readFrame := func(length uint32) ([]byte, error) {
+		frame := make([]byte, length)
+		if _, err := io.ReadFull(reader, frame); err != nil {
+			return nil, err
+		}
+		return frame, nil
+	}
+
+	readBody := func() (decodedBody, error) {
+		length, err := readHeader()
+		if err != nil {
+			return decodedBody{}, err
+		}
+		if length&tapeBodyReference != 0 {
+			index := int(length &^ tapeBodyReference)
+			if index >= len(bodies) {
+				return decodedBody{}, fmt.Errorf("Tape refers to missing body %d", index)
+			}
+			return bodies[index], nil
+		}
+
+		body, err := readFrame(length)
+		if err != nil || length == 0 {
+			return decodedBody{body: body}, err
+		}
+		decoded := decodedBody{body: body, key: newBodyKey(body)}
+		bodies = append(bodies, decoded)
+		return decoded, nil
+	}
+
+	return func() (*RecordedRecord, error) {
+		length, err := readHeader()
+		if err == io.EOF {
+			return nil, io.EOF
+		}
+
+		var metadata []byte
+		if err == nil {
+			metadata, err = readFrame(length)
+		}
+
+		record := &RecordedRecord{}
+		if err == nil {
+			err = json.Unmarshal(metadata, record)
+		}
+		var request, response decodedBody
+		if err == nil {
+			request, err = readBody()
+		}
+		if err == nil {
+			response, err = readBody()
+		}
+		record.Request.Body, record.requestBodyKey = request.body, request.key
+		record.Response.Body, record.responseBodyKey = response.body, response.key
+
+		if errors.Is(err, io.EOF) || errors.Is(err, io.ErrUnexpectedEOF) {
+			return nil, fmt.Errorf("Tape is truncated: %w", io.ErrUnexpectedEOF)
+		}
+		if err != nil {
+			return nil, err
+		}
+		return record, nil
+	}
+}
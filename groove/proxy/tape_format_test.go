@@ -0,0 +1,133 @@
+package main
+
+import (
+	"bytes"
+	"compress/gzip"
+	"testing"
+)
+
+func TestTapeFormats(t *testing.T) {
+	store, err := OpenTapeStore(t.TempDir())
+	if err != nil {
+		t.Fatal(err)
+	}
+	recorder := NewRecorder(NewConfigStore(), store)
+
+	// One loaded record and one recorded to disk, with bodies that aren't valid UTF-8
+	loaded := newStoreRecord("https://example.com/loaded", "Tape1")
+	loaded.Request.Body = []byte{0, 1, 2}
+	loaded.Response.Body = []byte{0xff, 0xfe}
+	loaded.Timing = &RequestTiming{TTFBMs: 12}
+	recorder.records = append(recorder.records, loaded)
+	store.Append(newStoreRecord("https://example.com/recorded", "Tape1"))
+
+	for _, format := range []int{TapeFormatJSON, TapeFormatBinary} {
+		page, err := recorder.ExportData(TapeExport{Format: format, CompressionLevel: gzip.DefaultCompression})
+		if err != nil {
+			t.Fatal(err)
+		}
+		var tape bytes.Buffer
+		if err := page.Stream(&tape); err != nil {
+			t.Fatal(err)
+		}
+
+		loader := NewRecorder(NewConfigStore(), nil)
+		if err := loader.LoadData(&tape, ""); err != nil {
+			t.Fatalf("Format %d: %s", format, err)
+		}
+
+		if len(loader.records) != 2 {
+			t.Fatalf("Format %d: expected 2 records, got %d", format, len(loader.records))
+		}
+		first, second := loader.records[0], loader.records[1]
+		if first.Request.Url != loaded.Request.Url || !bytes.Equal(first.Request.Body, loaded.Request.Body) || !bytes.Equal(first.Response.Body, loaded.Response.Body) {
+			t.Errorf("Format %d: loaded record changed: %+v", format, first)
+		}
+		if first.TapeID != "Tape1" || first.Timing == nil || first.Timing.TTFBMs != 12 {
+			t.Errorf("Format %d: metadata wasn't kept: %+v", format, first)
+		}
+		if second.Request.Url != "https://example.com/recorded" || string(second.Response.Body) != "body https://example.com/recorded" {
+			t.Errorf("Format %d: recorded record changed: %+v", format, second)
+		}
+	}
+}
+
+func TestBinaryTapeDecoding(t *testing.T) {
+	encode := func(records ...*RecordedRecord) []byte {
+		var buffer bytes.Buffer
+		encoder := newTapeEncoder(&buffer, TapeFormatBinary)
+		for _, record := range records {
+			encoder.Write(record)
+		}
+		encoder.Close()
+		return buffer.Bytes()
+	}
+	compress := func(payload []byte) *bytes.Buffer {
+		var buffer bytes.Buffer
+		writer := gzip.NewWriter(&buffer)
+		writer.Write(payload)
+		writer.Close()
+		return &buffer
+	}
+
+	tape := encode(newStoreRecord("https://example.com/1", ""), newStoreRecord("https://example.com/2", ""))
+
+	tests := []struct {
+		name    string
+		payload []byte
+		records int
+		valid   bool
+	}{
+		{"records", tape, 2, true},
+		{"empty", encode(), 0, true},
+		{"truncated body", tape[:len(tape)-3], 0, false},
+		{"truncated header", tape[:len(tape)-len("body https://example.com/2")-2], 0, false},
+		{"corrupt metadata", append(append([]byte{}, tapeBinaryMagic...), 0, 0, 0, 1, '{'), 0, false},
+		{"missing body", append(append([]byte{}, tapeBinaryMagic...), 0, 0, 0, 2, '{', '}', 0x80, 0, 0, 0), 0, false},
+		{"version 1", append(append([]byte{}, tapeBinaryMagicV1...), 0, 0, 0, 2, '{', '}', 0, 0, 0, 0, 0, 0, 0, 1, 'a'), 1, true},
+	}
+
+	for _, test := range tests {
+		recorder := NewRecorder(NewConfigStore(), nil)
+		err := recorder.LoadData(compress(test.payload), "")
+		if (err == nil) != test.valid {
+			t.Fatalf("%s: unexpected error %v", test.name, err)
+		}
+		if len(recorder.records) != test.records {
+			t.Errorf("%s: expected %d records, got %d", test.name, test.records, len(recorder.records))
+		}
+	}
+}
+
+func TestBinaryTapeBodyReferences(t *testing.T) {
+	var tape bytes.Buffer
+	encoder := newTapeEncoder(&tape, TapeFormatBinary)
+	for _, url := range []string{"https://example.com/1", "https://example.com/2", "https://example.com/3"} {
+		record := newStoreRecord(url, "")
+		record.Response.Body = []byte("repeated body")
+		encoder.Write(record)
+	}
+	encoder.Close()
+
+	if count := bytes.Count(tape.Bytes(), []byte("repeated body")); count != 1 {
+		t.Errorf("Expected the body to be written once, found it %d times", count)
+	}
+
+	var compressed bytes.Buffer
+	writer := gzip.NewWriter(&compressed)
+	writer.Write(tape.Bytes())
+	writer.Close()
+
+	recorder := NewRecorder(NewConfigStore(), nil)
+	if err := recorder.LoadData(&compressed, ""); err != nil {
+		t.Fatal(err)
+	}
+	if len(recorder.records) != 3 {
+		t.Fatalf("Expected 3 records, got %d", len(recorder.records))
+	}
+	for _, record := range recorder.records {
+		if string(record.Response.Body) != "repeated body" || &record.Response.Body[0] != &recorder.records[0].Response.Body[0] {
+			t.Errorf("Expected a shared body, got %q", record.Response.Body)
+		}
+	}
+}
@@ -0,0 +1,684 @@
+package main
+
+import (
+	"bufio"
+	"encoding/binary"
+	"encoding/json"
+	"errors"
+	"fmt"
+	"io"
+	"os"
+	"path/filepath"
+	"sort"
+	"sync"
+	"sync/atomic"
+)
+
+const (
+	// Frame kinds written to the segment files
+	TapeFrameRecord    = iota
+	TapeFrameClearTape = iota
+)
+
+const (
+	tapeOperationAppend    = iota
+	tapeOperationClearTape = iota
+	tapeOperationClear     = iota
+	tapeOperationSync      = iota
+)
+
+// Frame header is the frame kind followed by the big endian payload length
+const tapeFrameHeaderSize = 5
+
+// Start a new segment file once the current one passes this size
+const tapeSegmentSize = 64 << 20
+
+const tapeSegmentPattern = "%06d.segment"
+
+// Returned when reading a record that was deleted by Clear while it was being looked up
+var errTapeEntryCleared = errors.New("Tape record was cleared")
+
+var errTapeStoreClosed = errors.New("Tape store is closed")
+
+type tapeIndexEntry struct {
+	// Segment numbers restart after a reset, so the generation tells which files they refer to
+	generation uint64
+	segment    int
+	offset     int64
+	length     uint32
+
+	tapeID   string
+	url      string
+	method   string
+	bodyHash string
+	sequence uint64
+
+	consumed bool
+}
+
+type tapeOperation struct {
+	kind     int
+	tapeID   string
+	url      string
+	method   string
+	bodyHash string
+	sequence uint64
+	payload  []byte
+
+	// Closed once the operation has been applied and flushed
+	done chan error
+}
+
+type TapeStore struct {
+	/*
+	 * Write-ahead log for tape recordings, so long recordings don't have to fit in memory
+	 *
+	 * Records are appended as length-prefixed frames to segment files by a single background
+	 * writer, memory only holds an index of where each one lives. The writer flushes whenever its
+	 * queue drains and only then publishes the new records to the index, so a record is either
+	 * readable or still queued. After a crash, reopening the directory rebuilds the index from the
+	 * segments, dropping a partially written frame at the tail.
+	 */
+	directory string
+
+	operations chan *tapeOperation
+
+	// Senders hold the read lock so Close can't close operations under them
+	closeLock sync.RWMutex
+	closed    bool
+	stopped   chan error
+
+	// Only touched by the writer goroutine
+	segment int
+	file    *os.File
+	writer  *bufio.Writer
+	size    int64
+	pending []*tapeIndexEntry
+
+	// Guards the index, replay index and generation. Read handles are only used under the read
+	// lock so reset can close them, readersLock serializes opening them.
+	lock        sync.RWMutex
+	index       []*tapeIndexEntry
+	generation  uint64
+	readersLock sync.Mutex
+	readers     map[int]*os.File
+
+	// Entries by tape ID and match key in recording order, so playback doesn't scan the index.
+	// Keyed with match, which only changes under lock and bumps matchVersion.
+	replayIndex  map[replayKey][]*tapeIndexEntry
+	match        ReplayMatch
+	matchVersion uint64
+
+	// Round-robin counters by replayKey, each a *uint64 only changed atomically
+	served sync.Map
+}
+
+func OpenTapeStore(directory string) (*TapeStore, error) {
+	if err := os.MkdirAll(directory, 0755); err != nil {
+		return nil, err
+	}
+
+	store := &TapeStore{
+		directory:   directory,
+		operations:  make(chan *tapeOperation, 1024),
+		stopped:     make(chan error, 1),
+		index:       make([]*tapeIndexEntry, 0),
+		readers:     make(map[int]*os.File),
+		replayIndex: make(map[replayKey][]*tapeIndexEntry),
+	}
+
+	segments, err := store.listSegments()
+	if err != nil {
+		return nil, err
+	}
+
+	for _, segment := range segments {
+		if err := store.recoverSegment(segment); err != nil {
+			return nil, err
+		}
+	}
+
+	// Continue appending to the newest segment
+	if len(segments) > 0 {
+		store.segment = segments[len(segments)-1]
+	}
+	if err := store.openSegment(store.segment); err != nil {
+		return nil, err
+	}
+
+	go store.writeLoop()
+
+	return store, nil
+}
+
+func (store *TapeStore) Append(record *RecordedRecord) error {
+	/*
+	 * Queue a record to be written, blocks only when the writer has fallen behind
+	 */
+	payload, err := json.Marshal(record)
+	if err != nil {
+		return err
+	}
+
+	return store.send(&tapeOperation{
+		kind:     tapeOperationAppend,
+		tapeID:   record.TapeID,
+		url:      record.Request.Url,
+		method:   record.Request.Method,
+		bodyHash: hashBody(record.Request.Body),
+		sequence: record.Sequence,
+		payload:  payload,
+	})
+}
+
+func (store *TapeStore) ClearTapeID(tapeID string) error {
+	return store.wait(&tapeOperation{kind: tapeOperationClearTape, tapeID: tapeID})
+}
+
+func (store *TapeStore) Clear() error {
+	return store.wait(&tapeOperation{kind: tapeOperationClear})
+}
+
+func (store *TapeStore) Sync() error {
+	/*
+	 * Wait until every record queued so far is on disk and in the index
+	 */
+	return store.wait(&tapeOperation{kind: tapeOperationSync})
+}
+
+func (store *TapeStore) Close() error {
+	/*
+	 * Write out everything still queued or buffered and close the segment
+	 *
+	 * Later appends fail with errTapeStoreClosed instead of being dropped silently.
+	 */
+	store.closeLock.Lock()
+	if store.closed {
+		store.closeLock.Unlock()
+		return errTapeStoreClosed
+	}
+	store.closed = true
+	close(store.operations)
+	store.closeLock.Unlock()
+
+	return <-store.stopped
+}
+
+func (store *TapeStore) LastSequence() uint64 {
+	/*
+	 * Highest sequence number on disk, so numbering continues after a restart
+	 */
+	store.lock.RLock()
+	defer store.lock.RUnlock()
+
+	last := uint64(0)
+	for _, entry := range store.index {
+		if entry.sequence > last {
+			last = entry.sequence
+		}
+	}
+	return last
+}
+
+func (store *TapeStore) Len() int {
+	store.lock.RLock()
+	defer store.lock.RUnlock()
+	return len(store.index)
+}
+
+func (store *TapeStore) Select(include func(tapeID string, url string, sequence uint64) bool) []*tapeIndexEntry {
+	/*
+	 * Index entries of the matching records, in recording order
+	 */
+	store.lock.RLock()
+	defer store.lock.RUnlock()
+
+	return filterSlice(store.index, func(entry *tapeIndexEntry) bool {
+		return include(entry.tapeID, entry.url, entry.sequence)
+	})
+}
+
+func (store *TapeStore) ReadPayload(entry *tapeIndexEntry, buffer []byte) ([]byte, error) {
+	/*
+	 * Raw JSON of one record, reusing buffer when it's large enough
+	 */
+	if cap(buffer) < int(entry.length) {
+		buffer = make([]byte, entry.length)
+	}
+	buffer = buffer[:entry.length]
+
+	if err := store.readPayload(entry, buffer); err != nil {
+		return nil, err
+	}
+	return buffer, nil
+}
+
+func (store *TapeStore) SetReplayMatch(match ReplayMatch) {
+	/*
+	 * Re-key the replay index, keys of records still being flushed are recomputed on publish
+	 */
+	store.lock.Lock()
+	defer store.lock.Unlock()
+
+	store.match = match
+	store.matchVersion += 1
+	store.replayIndex = make(map[replayKey][]*tapeIndexEntry)
+	for _, entry := range store.index {
+		store.indexEntry(entry, store.replayKey(entry))
+	}
+}
+
+func (store *TapeStore) Match(key replayKey, replayMode int) (*RecordedRecord, error) {
+	/*
+	 * Find the record to play back for this match key and tape
+	 *
+	 * ReplayModeConsume takes the first unplayed record and marks it as played, the other modes
+	 * leave the index untouched.
+	 */
+	var match *tapeIndexEntry
+	if replayMode == ReplayModeConsume {
+		store.lock.Lock()
+		for _, entry := range store.replayIndex[key] {
+			if !entry.consumed {
+				entry.consumed = true
+				match = entry
+				break
+			}
+		}
+		store.lock.Unlock()
+	} else {
+		store.lock.RLock()
+		candidates := store.replayIndex[key]
+		store.lock.RUnlock()
+
+		if len(candidates) > 0 {
+			match = candidates[0]
+			if replayMode == ReplayModeRoundRobin {
+				served, _ := store.served.LoadOrStore(key, new(uint64))
+				match = candidates[(atomic.AddUint64(served.(*uint64), 1)-1)%uint64(len(candidates))]
+			}
+		}
+	}
+
+	if match == nil {
+		return nil, nil
+	}
+
+	payload := make([]byte, match.length)
+	if err := store.readPayload(match, payload); err == errTapeEntryCleared {
+		return nil, nil
+	} else if err != nil {
+		return nil, err
+	}
+
+	var record RecordedRecord
+	if err := json.Unmarshal(payload, &record); err != nil {
+		return nil, err
+	}
+	return &record, nil
+}
+
+func (store *TapeStore) send(operation *tapeOperation) error {
+	store.closeLock.RLock()
+	defer store.closeLock.RUnlock()
+
+	if store.closed {
+		return errTapeStoreClosed
+	}
+	store.operations <- operation
+	return nil
+}
+
+func (store *TapeStore) Unconsume(key replayKey, sequence uint64) {
+	/*
+	 * Let ReplayModeConsume play the record with this sequence again
+	 */
+	store.lock.Lock()
+	defer store.lock.Unlock()
+
+	for _, entry := range store.replayIndex[key] {
+		if entry.sequence == sequence {
+			entry.consumed = false
+			return
+		}
+	}
+}
+
+func (store *TapeStore) wait(operation *tapeOperation) error {
+	operation.done = make(chan error, 1)
+	if err := store.send(operation); err != nil {
+		return err
+	}
+	return <-operation.done
+}
+
+func (store *TapeStore) writeLoop() {
+	for operation := range store.operations {
+		err := store.apply(operation)
+
+		// Batch writes while the queue is busy, flush as soon as it drains
+		if err == nil && (len(store.operations) == 0 || operation.done != nil) {
+			err = store.flush()
+		}
+		if err != nil {
+			recorderLog.Errorf("Unable to write tape segment: %s", err)
+		}
+
+		if operation.done != nil {
+			operation.done <- err
+		}
+	}
+
+	// Operations is closed and drained, retry the flush in case the last one failed
+	err := store.flush()
+	if closeErr := store.file.Close(); err == nil {
+		err = closeErr
+	}
+	store.stopped <- err
+}
+
+func (store *TapeStore) apply(operation *tapeOperation) error {
+	switch operation.kind {
+	case tapeOperationAppend:
+		entry := &tapeIndexEntry{
+			tapeID:   operation.tapeID,
+			url:      operation.url,
+			method:   operation.method,
+			bodyHash: operation.bodyHash,
+			sequence: operation.sequence,
+		}
+		if err := store.writeFrame(TapeFrameRecord, operation.payload, entry); err != nil {
+			return err
+		}
+		store.pending = append(store.pending, entry)
+	case tapeOperationClearTape:
+		// Persist the clear so recovery drops the same records
+		if err := store.writeFrame(TapeFrameClearTape, []byte(operation.tapeID), nil); err != nil {
+			return err
+		}
+		if err := store.flush(); err != nil {
+			return err
+		}
+
+		store.lock.Lock()
+		store.removeTapeID(operation.tapeID)
+		store.lock.Unlock()
+	case tapeOperationClear:
+		return store.reset()
+	}
+
+	return nil
+}
+
+func (store *TapeStore) writeFrame(kind int, payload []byte, entry *tapeIndexEntry) error {
+	if store.size >= tapeSegmentSize {
+		if err := store.flush(); err != nil {
+			return err
+		}
+		if err := store.openSegment(store.segment + 1); err != nil {
+			return err
+		}
+	}
+
+	header := make([]byte, tapeFrameHeaderSize)
+	header[0] = byte(kind)
+	binary.BigEndian.PutUint32(header[1:], uint32(len(payload)))
+
+	if _, err := store.writer.Write(header); err != nil {
+		return err
+	}
+	if _, err := store.writer.Write(payload); err != nil {
+		return err
+	}
+
+	if entry != nil {
+		entry.generation = store.generation
+		entry.segment = store.segment
+		entry.offset = store.size + tapeFrameHeaderSize
+		entry.length = uint32(len(payload))
+	}
+	store.size += int64(tapeFrameHeaderSize + len(payload))
+
+	return nil
+}
+
+func (store *TapeStore) flush() error {
+	if err := store.writer.Flush(); err != nil {
+		return err
+	}
+
+	if len(store.pending) > 0 {
+		// Key outside the lock, replays only wait if the match changed in the meantime
+		store.lock.RLock()
+		match, version := store.match, store.matchVersion
+		store.lock.RUnlock()
+
+		keys := make([]replayKey, len(store.pending))
+		for i, entry := range store.pending {
+			keys[i] = entryReplayKey(entry, &match)
+		}
+
+		store.lock.Lock()
+		for i, entry := range store.pending {
+			if store.matchVersion != version {
+				keys[i] = store.replayKey(entry)
+			}
+			store.index = append(store.index, entry)
+			store.indexEntry(entry, keys[i])
+		}
+		store.lock.Unlock()
+		store.pending = nil
+	}
+
+	return nil
+}
+
+func (store *TapeStore) replayKey(entry *tapeIndexEntry) replayKey {
+	return entryReplayKey(entry, &store.match)
+}
+
+func entryReplayKey(entry *tapeIndexEntry, match *ReplayMatch) replayKey {
+	return replayKey{tapeID: entry.tapeID, match: match.key(entry.method, entry.url, entry.bodyHash)}
+}
+
+func (store *TapeStore) indexEntry(entry *tapeIndexEntry, key replayKey) {
+	/*
+	 * The caller holds lock
+	 */
+	store.replayIndex[key] = append(store.replayIndex[key], entry)
+}
+
+func (store *TapeStore) removeTapeID(tapeID string) {
+	/*
+	 * Drop the tape's entries from both indexes, the caller holds lock
+	 */
+	store.index = filterSlice(store.index, func(entry *tapeIndexEntry) bool {
+		return entry.tapeID != tapeID
+	})
+	for key := range store.replayIndex {
+		if key.tapeID == tapeID {
+			delete(store.replayIndex, key)
+		}
+	}
+}
+
+func (store *TapeStore) reset() error {
+	/*
+	 * Delete every segment and start over with an empty index
+	 */
+	store.file.Close()
+	store.file = nil
+
+	// Waits for in-flight reads, entries they looked up before the reset are now stale
+	store.lock.Lock()
+	for _, reader := range store.readers {
+		reader.Close()
+	}
+	store.readers = make(map[int]*os.File)
+	store.index = make([]*tapeIndexEntry, 0)
+	store.replayIndex = make(map[replayKey][]*tapeIndexEntry)
+	store.generation += 1
+	store.lock.Unlock()
+	store.pending = nil
+	store.served.Range(func(key, _ interface{}) bool {
+		store.served.Delete(key)
+		return true
+	})
+
+	segments, err := store.listSegments()
+	if err != nil {
+		return err
+	}
+	for _, segment := range segments {
+		if err := os.Remove(store.segmentPath(segment)); err != nil {
+			return err
+		}
+	}
+
+	return store.openSegment(0)
+}
+
+func (store *TapeStore) openSegment(segment int) error {
+	if store.file != nil {
+		store.file.Close()
+	}
+
+	file, err := os.OpenFile(store.segmentPath(segment), os.O_CREATE|os.O_WRONLY|os.O_APPEND, 0644)
+	if err != nil {
+		return err
+	}
+	info, err := file.Stat()
+	if err != nil {
+		file.Close()
+		return err
+	}
+
+	store.segment = segment
+	store.file = file
+	store.writer = bufio.NewWriterSize(file, 256*1024)
+	store.size = info.Size()
+	return nil
+}
+
+func (store *TapeStore) readPayload(entry *tapeIndexEntry, payload []byte) error {
+	// Hold the read lock for the whole read, concurrent replays share it and reset waits for them
+	store.lock.RLock()
+	defer store.lock.RUnlock()
+
+	if entry.generation != store.generation {
+		return errTapeEntryCleared
+	}
+
+	store.readersLock.Lock()
+	reader, ok := store.readers[entry.segment]
+	if !ok {
+		var err error
+		reader, err = os.Open(store.segmentPath(entry.segment))
+		if err != nil {
+			store.readersLock.Unlock()
+			return err
+		}
+		store.readers[entry.segment] = reader
+	}
+	store.readersLock.Unlock()
+
+	_, err := reader.ReadAt(payload, entry.offset)
+	return err
+}
+
+func (store *TapeStore) recoverSegment(segment int) error {
+	/*
+	 * Rebuild the index from one segment, truncating a frame that was cut off mid-write
+	 */
+	path := store.segmentPath(segment)
+	file, err := os.Open(path)
+	if err != nil {
+		return err
+	}
+	defer file.Close()
+
+	reader := bufio.NewReader(file)
+	header := make([]byte, tapeFrameHeaderSize)
+	offset := int64(0)
+
+	for {
+		if _, err := io.ReadFull(reader, header); err != nil {
+			if err == io.EOF {
+				return nil
+			}
+			return store.truncateSegment(path, offset, err)
+		}
+
+		kind := int(header[0])
+		length := binary.BigEndian.Uint32(header[1:])
+		payload := make([]byte, length)
+		if _, err := io.ReadFull(reader, payload); err != nil {
+			return store.truncateSegment(path, offset, err)
+		}
+
+		switch kind {
+		case TapeFrameRecord:
+			var summary struct {
+				Request struct {
+					Url    string `json:"url"`
+					Method string `json:"method"`
+					Body   []byte `json:"body"`
+				} `json:"request"`
+				TapeID   string `json:"tape_id"`
+				Sequence uint64 `json:"sequence"`
+			}
+			if err := json.Unmarshal(payload, &summary); err != nil {
+				return fmt.Errorf("Corrupt tape record in %s at %d: %w", path, offset, err)
+			}
+			entry := &tapeIndexEntry{
+				segment:  segment,
+				offset:   offset + tapeFrameHeaderSize,
+				length:   length,
+				tapeID:   summary.TapeID,
+				url:      summary.Request.Url,
+				method:   summary.Request.Method,
+				bodyHash: hashBody(summary.Request.Body),
+				sequence: summary.Sequence,
+			}
+			store.index = append(store.index, entry)
+			store.indexEntry(entry, store.replayKey(entry))
+		case TapeFrameClearTape:
+			store.removeTapeID(string(payload))
+		default:
+			return fmt.Errorf("Unknown tape frame kind %d in %s at %d", kind, path, offset)
+		}
+
+		offset += int64(tapeFrameHeaderSize) + int64(length)
+	}
+}
+
+func (store *TapeStore) truncateSegment(path string, offset int64, readErr error) error {
+	if !errors.Is(readErr, io.ErrUnexpectedEOF) && !errors.Is(readErr, io.EOF) {
+		return readErr
+	}
+
+	recorderLog.Warnf("Dropping partially written tape frame in %s at %d", path, offset)
+	return os.Truncate(path, offset)
+}
+
+func (store *TapeStore) listSegments() ([]int, error) {
+	paths, err := filepath.Glob(filepath.Join(store.directory, "*.segment"))
+	if err != nil {
+		return nil, err
+	}
+
+	segments := make([]int, 0, len(paths))
+	for _, path := range paths {
+		var segment int
+		if _, err := fmt.Sscanf(filepath.Base(path), tapeSegmentPattern, &segment); err == nil {
+			segments = append(segments, segment)
+		}
+	}
+	sort.Ints(segments)
+
+	return segments, nil
+}
+
+func (store *TapeStore) segmentPath(segment int) string {
+	return filepath.Join(store.directory, fmt.Sprintf(tapeSegmentPattern, segment))
+}
@@ -0,0 +1,240 @@
+package main
+
+import (
+	"bytes"
+	"compress/gzip"
+	"encoding/json"
+	"fmt"
+	"os"
+	"path/filepath"
+	"testing"
+)
+
+func newStoreRecord(url string, tapeID string) *RecordedRecord {
+	return &RecordedRecord{
+		Request:  ArchivedRequest{Url: url, Method: "GET"},
+		Response: ArchivedResponse{Status: 200, Body: []byte("body " + url)},
+		TapeID:   tapeID,
+	}
+}
+
+func exportedURLs(t *testing.T, recorder *Recorder, tapeID string) []string {
+	var buffer bytes.Buffer
+	page, err := recorder.ExportData(TapeExport{TapeID: tapeID, CompressionLevel: gzip.DefaultCompression})
+	if err != nil {
+		t.Fatal(err)
+	}
+	if err := page.Stream(&buffer); err != nil {
+		t.Fatal(err)
+	}
+
+	reader, err := gzip.NewReader(&buffer)
+	if err != nil {
+		t.Fatal(err)
+	}
+	var records []*RecordedRecord
+	if err := json.NewDecoder(reader).Decode(&records); err != nil {
+		t.Fatal(err)
+	}
+
+	urls := make([]string, 0)
+	for _, record := range records {
+		urls = append(urls, record.Request.Url)
+	}
+	return urls
+}
+
+func TestTapeStoreRecovery(t *testing.T) {
+	directory := t.TempDir()
+
+	store, err := OpenTapeStore(directory)
+	if err != nil {
+		t.Fatal(err)
+	}
+	store.Append(newStoreRecord("https://example.com/1", ""))
+	store.Append(newStoreRecord("https://example.com/2", "Tape1"))
+	store.Append(newStoreRecord("https://example.com/3", "Tape2"))
+	store.ClearTapeID("Tape1")
+	store.Sync()
+
+	// Simulate a crash partway through writing the next frame
+	segment := filepath.Join(directory, "000000.segment")
+	file, _ := os.OpenFile(segment, os.O_WRONLY|os.O_APPEND, 0644)
+	file.Write([]byte{TapeFrameRecord, 0, 0, 1, 0, '{'})
+	file.Close()
+
+	recovered, err := OpenTapeStore(directory)
+	if err != nil {
+		t.Fatal(err)
+	}
+	recorder := NewRecorder(NewConfigStore(), recovered)
+
+	tests := []struct {
+		tapeID   string
+		expected []string
+	}{
+		{"", []string{"https://example.com/1", "https://example.com/3"}},
+		{"Tape2", []string{"https://example.com/1", "https://example.com/3"}},
+		{"Tape1", []string{"https://example.com/1"}},
+	}
+	for _, test := range tests {
+		urls := exportedURLs(t, recorder, test.tapeID)
+		if len(urls) != len(test.expected) {
+			t.Fatalf("Tape %q: expected %v, got %v", test.tapeID, test.expected, urls)
+		}
+		for i := range urls {
+			if urls[i] != test.expected[i] {
+				t.Errorf("Tape %q: expected %v, got %v", test.tapeID, test.expected, urls)
+			}
+		}
+	}
+
+	// Appends continue after the truncated frame
+	recovered.Append(newStoreRecord("https://example.com/4", ""))
+	if urls := exportedURLs(t, recorder, ""); len(urls) != 3 {
+		t.Errorf("Expected appends after recovery, got %v", urls)
+	}
+}
+
+func TestTapeStoreReplay(t *testing.T) {
+	store, err := OpenTapeStore(t.TempDir())
+	if err != nil {
+		t.Fatal(err)
+	}
+	store.Append(newStoreRecord("https://example.com/1", "Tape1"))
+	store.Sync()
+
+	key := replayKey{tapeID: "Tape1", match: "https://example.com/1"}
+	record, err := store.Match(key, ReplayModeConsume)
+	if err != nil || record == nil || string(record.Response.Body) != "body https://example.com/1" {
+		t.Fatalf("Unexpected match: %v %v", record, err)
+	}
+
+	// Each record only plays back once
+	if record, _ := store.Match(key, ReplayModeConsume); record != nil {
+		t.Error("Record was played back twice")
+	}
+
+	store.Clear()
+	if store.Len() != 0 {
+		t.Errorf("Expected an empty store after clear, got %d", store.Len())
+	}
+}
+
+func TestTapeStoreReplayIndex(t *testing.T) {
+	directory := t.TempDir()
+	store, err := OpenTapeStore(directory)
+	if err != nil {
+		t.Fatal(err)
+	}
+	store.Append(newStoreRecord("https://example.com/page?ts=1", "Tape1"))
+	store.Append(newStoreRecord("https://example.com/page?ts=2", "Tape2"))
+	store.Sync()
+
+	// Records published before and after the match changes are both keyed with it
+	match := ReplayMatch{IgnoreParams: []string{"ts"}}
+	store.SetReplayMatch(match)
+	store.Append(newStoreRecord("https://example.com/other?ts=3", "Tape1"))
+	store.Sync()
+
+	reopened, err := OpenTapeStore(directory)
+	if err != nil {
+		t.Fatal(err)
+	}
+	reopened.SetReplayMatch(match)
+
+	tests := []struct {
+		name    string
+		store   *TapeStore
+		key     replayKey
+		matches bool
+	}{
+		{"ignored param", store, replayKey{tapeID: "Tape1", match: "https://example.com/page"}, true},
+		{"flushed after change", store, replayKey{tapeID: "Tape1", match: "https://example.com/other"}, true},
+		{"other tape", store, replayKey{tapeID: "Tape3", match: "https://example.com/page"}, false},
+		{"recovered", reopened, replayKey{tapeID: "Tape2", match: "https://example.com/page"}, true},
+	}
+
+	for _, test := range tests {
+		record, err := test.store.Match(test.key, ReplayModeFirst)
+		if err != nil {
+			t.Fatal(err)
+		}
+		if (record != nil) != test.matches {
+			t.Errorf("%s: expected match %v, got %v", test.name, test.matches, record)
+		}
+	}
+
+	store.ClearTapeID("Tape1")
+	if record, _ := store.Match(replayKey{tapeID: "Tape1", match: "https://example.com/page"}, ReplayModeFirst); record != nil {
+		t.Error("Expected cleared tape to leave the replay index")
+	}
+}
+
+func TestTapeStoreReset(t *testing.T) {
+	store, err := OpenTapeStore(t.TempDir())
+	if err != nil {
+		t.Fatal(err)
+	}
+	key := replayKey{tapeID: "Tape1", match: "https://example.com/1"}
+	store.Append(newStoreRecord("https://example.com/1", "Tape1"))
+	store.Append(newStoreRecord("https://example.com/1", "Tape1"))
+	store.Sync()
+	store.Match(key, ReplayModeRoundRobin)
+	stale := store.Select(func(string, string, uint64) bool { return true })[0]
+
+	// Replays racing the reset either find the record or nothing
+	done := make(chan bool)
+	go func() {
+		for i := 0; i < 100; i++ {
+			if _, err := store.Match(key, ReplayModeFirst); err != nil {
+				t.Error(err)
+			}
+		}
+		done <- true
+	}()
+	store.Clear()
+	<-done
+
+	// The next records reuse the same segment and offsets
+	first := newStoreRecord("https://example.com/1", "Tape1")
+	first.Response.Body = []byte("first")
+	store.Append(first)
+	store.Append(newStoreRecord("https://example.com/1", "Tape1"))
+	store.Sync()
+
+	if _, err := store.ReadPayload(stale, nil); err != errTapeEntryCleared {
+		t.Errorf("Expected a cleared entry to stay unreadable, got %v", err)
+	}
+	record, err := store.Match(key, ReplayModeRoundRobin)
+	if err != nil || record == nil || string(record.Response.Body) != "first" {
+		t.Errorf("Expected round robin to start over after a reset, got %v %v", record, err)
+	}
+}
+
+func TestTapeStoreClose(t *testing.T) {
+	directory := t.TempDir()
+	store, err := OpenTapeStore(directory)
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	// Queued without waiting for the writer
+	for i := 0; i < 100; i++ {
+		store.Append(newStoreRecord(fmt.Sprintf("https://example.com/%d", i), ""))
+	}
+	if err := store.Close(); err != nil {
+		t.Fatal(err)
+	}
+	if err := store.Append(newStoreRecord("https://example.com/late", "")); err != errTapeStoreClosed {
+		t.Errorf("Expected appends after closing to fail, got %v", err)
+	}
+
+	reopened, err := OpenTapeStore(directory)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if reopened.Len() != 100 {
+		t.Errorf("Expected every queued record to be written, got %d", reopened.Len())
+	}
+}
@@ -0,0 +1,205 @@
+package main
+
+import (
+	"context"
+	"fmt"
+	"io"
+	"net/http"
+	"net/http/httptrace"
+	"strings"
+	"sync/atomic"
+	"time"
+
+	goproxy "github.com/piercefreeman/goproxy"
+)
+
+const (
+	TimingCacheLookup = iota
+	TimingLockWait    = iota
+	TimingDial        = iota
+	TimingTLS         = iota
+	TimingConnect     = iota
+	TimingTTFB        = iota
+	TimingTransfer    = iota
+
+	timingStageCount = iota
+)
+
+type RequestTiming struct {
+	/*
+	 * Where the time went for a single proxied request, in milliseconds
+	 * Stages that didn't run for this request (cache hits never dial) are left at zero
+	 */
+	CacheLookupMs float64 `json:"cacheLookupMs"`
+	LockWaitMs    float64 `json:"lockWaitMs"`
+	DialMs        float64 `json:"dialMs"`
+	TLSMs         float64 `json:"tlsMs"`
+	TTFBMs        float64 `json:"ttfbMs"`
+	TransferMs    float64 `json:"transferMs"`
+
+	// Whether the upstream connection was reused from the pool, dial and TLS will be zero
+	ConnectionReused bool `json:"connectionReused"`
+}
+
+type requestTimer struct {
+	/*
+	 * Live timings for an inflight request, shared between the middlewares and the round tripper
+	 *
+	 * Durations are nanoseconds and only touched atomically. Connection dials run on transport
+	 * goroutines and can still finish after the request that started them has moved on.
+	 */
+	durations [timingStageCount]int64
+	reused    int32
+}
+
+type requestTimerKey struct{}
+
+func newRequestTimer() *requestTimer {
+	return &requestTimer{}
+}
+
+func withRequestTimer(request *http.Request, timer *requestTimer) *http.Request {
+	return request.WithContext(context.WithValue(request.Context(), requestTimerKey{}, timer))
+}
+
+func requestTimerFromContext(ctx context.Context) *requestTimer {
+	// Nil when the request didn't pass through the headers middleware
+	timer, _ := ctx.Value(requestTimerKey{}).(*requestTimer)
+	return timer
+}
+
+func (timer *requestTimer) Record(stage int, start time.Time) {
+	if timer == nil {
+		return
+	}
+	atomic.StoreInt64(&timer.durations[stage], int64(time.Since(start)))
+}
+
+func (timer *requestTimer) ClientTrace() *httptrace.ClientTrace {
+	/*
+	 * Connection and first byte timings for one attempt of the round trip
+	 */
+	var getConn, gotConn time.Time
+
+	return &httptrace.ClientTrace{
+		GetConn: func(hostPort string) {
+			getConn = time.Now()
+		},
+		GotConn: func(info httptrace.GotConnInfo) {
+			gotConn = time.Now()
+			timer.Record(TimingConnect, getConn)
+
+			reused := int32(0)
+			if info.Reused {
+				reused = 1
+			}
+			atomic.StoreInt32(&timer.reused, reused)
+		},
+		GotFirstResponseByte: func() {
+			timer.Record(TimingTTFB, gotConn)
+		},
+	}
+}
+
+func (timer *requestTimer) TimeBody(response *http.Response) {
+	/*
+	 * Body transfer only finishes once a middleware or the client drains the body
+	 */
+	response.Body = &timedBody{
+		ReadCloser: response.Body,
+		timer:      timer,
+		start:      time.Now(),
+	}
+}
+
+func (timer *requestTimer) duration(stage int) int64 {
+	return atomic.LoadInt64(&timer.durations[stage])
+}
+
+func (timer *requestTimer) Snapshot() RequestTiming {
+	dial := timer.duration(TimingDial)
+	tlsHandshake := timer.duration(TimingTLS)
+	reused := atomic.LoadInt32(&timer.reused) == 1
+
+	// HTTP/2 transports dial without the request context, fall back to the full time
+	// spent waiting on a new connection
+	if dial == 0 && tlsHandshake == 0 && !reused {
+		dial = timer.duration(TimingConnect)
+	}
+
+	return RequestTiming{
+		CacheLookupMs:    nanosecondsToMilliseconds(timer.duration(TimingCacheLookup)),
+		LockWaitMs:       nanosecondsToMilliseconds(timer.duration(TimingLockWait)),
+		DialMs:           nanosecondsToMilliseconds(dial),
+		TLSMs:            nanosecondsToMilliseconds(tlsHandshake),
+		TTFBMs:           nanosecondsToMilliseconds(timer.duration(TimingTTFB)),
+		TransferMs:       nanosecondsToMilliseconds(timer.duration(TimingTransfer)),
+		ConnectionReused: reused,
+	}
+}
+
+func (timing RequestTiming) ServerTiming() string {
+	/*
+	 * Format as a Server-Timing header value
+	 * https://www.w3.org/TR/server-timing/
+	 */
+	metrics := []struct {
+		name     string
+		duration float64
+	}{
+		{"cache", timing.CacheLookupMs},
+		{"lock", timing.LockWaitMs},
+		{"dial", timing.DialMs},
+		{"tls", timing.TLSMs},
+		{"ttfb", timing.TTFBMs},
+		{"transfer", timing.TransferMs},
+	}
+
+	values := make([]string, 0, len(metrics))
+	for _, metric := range metrics {
+		values = append(values, fmt.Sprintf("%s;dur=%.3f", metric.name, metric.duration))
+	}
+	return strings.Join(values, ", ")
+}
+
+func nanosecondsToMilliseconds(nanoseconds int64) float64 {
+	return float64(nanoseconds) / float64(time.Millisecond)
+}
+
+func setupTimingMiddleware(proxy *goproxy.ProxyHttpServer) {
+	/*
+	 * This should be mounted after the recorder and cache middlewares so their timings are set
+	 *
+	 * Bodies stream to the client after the headers are written, so the header always reports
+	 * transfer as zero. Tape records are taken once the body finishes and include it.
+	 */
+	proxy.OnResponse().DoFunc(
+		func(response *http.Response, ctx *goproxy.ProxyCtx) *http.Response {
+			requestHeaders, ok := ctx.UserData.(*HeaderDefinition)
+			if response == nil || !ok || !requestHeaders.requestTiming {
+				return response
+			}
+
+			// Add rather than set, upstream servers may report their own timings
+			response.Header.Add("Server-Timing", requestHeaders.timer.Snapshot().ServerTiming())
+			return response
+		},
+	)
+}
+
+type timedBody struct {
+	io.ReadCloser
+
+	timer *requestTimer
+	start time.Time
+	done  bool
+}
+
+func (body *timedBody) Read(p []byte) (int, error) {
+	n, err := body.ReadCloser.Read(p)
+	if err == io.EOF && !body.done {
+		body.done = true
+		body.timer.Record(TimingTransfer, body.start)
+	}
+	return n, err
+}
@@ -0,0 +1,55 @@
+package main
+
+import (
+	"io"
+	"net/http"
+	"net/http/httptest"
+	"testing"
+	"time"
+)
+
+func TestRoundTripTiming(t *testing.T) {
+	upstream := httptest.NewServer(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		time.Sleep(5 * time.Millisecond)
+		w.Write([]byte("groove"))
+	}))
+	defer upstream.Close()
+
+	dialerSession := NewDialerSession(NewConfigStore())
+	dialerSession.SetDialerDefinitions([]*DialerDefinition{NewDialerDefinition(0, nil, nil)})
+	roundTripper := NewCustomRoundTripper(dialerSession)
+
+	timer := newRequestTimer()
+	request, _ := http.NewRequest("GET", upstream.URL, nil)
+	request = withRequestTimer(request, timer)
+
+	response, err := roundTripper.RoundTrip(request)
+	if err != nil {
+		t.Fatal(err)
+	}
+	io.ReadAll(response.Body)
+	response.Body.Close()
+
+	timing := timer.Snapshot()
+	if timing.DialMs <= 0 {
+		t.Errorf("Expected dial timing, got %f", timing.DialMs)
+	}
+	if timing.TTFBMs < 5 {
+		t.Errorf("Expected time to first byte to include the upstream delay, got %f", timing.TTFBMs)
+	}
+	if timing.TransferMs <= 0 {
+		t.Errorf("Expected transfer timing once the body is drained, got %f", timing.TransferMs)
+	}
+	if timing.ConnectionReused {
+		t.Error("First request should open a new connection")
+	}
+}
+
+func TestServerTimingHeader(t *testing.T) {
+	timing := RequestTiming{CacheLookupMs: 0.25, DialMs: 12, TTFBMs: 40.5}
+
+	expected := "cache;dur=0.250, lock;dur=0.000, dial;dur=12.000, tls;dur=0.000, ttfb;dur=40.500, transfer;dur=0.000"
+	if header := timing.ServerTiming(); header != expected {
+		t.Errorf("Unexpected header: %s", header)
+	}
+}
@@ -1,14 +1,16 @@
 package main
 
 import (
+	"context"
 	"crypto/tls"
 	"errors"
-	"log"
 	"net"
 	"net/http"
+	"net/http/httptrace"
 	"net/url"
 	"strings"
 	"sync"
+	"time"
 
 	utls "github.com/refraction-networking/utls"
 	"golang.org/x/net/http2"
@@ -81,11 +83,11 @@ func wrapConnectionWithTLS(host string, rawConnection net.Conn) (*utls.UConn, er
 	 */
 
 	// HelloChrome_Auto | HelloFirefox_Auto | HelloIOS_Auto
-	log.Printf("Performing TLS handshake with server name %s", host)
+	transportLog.Debugf("Performing TLS handshake with server name %s", host)
 	connection := utls.UClient(rawConnection, &utls.Config{ServerName: host}, utls.HelloChrome_Auto)
 
 	if err := connection.Handshake(); err != nil {
-		log.Println("Handshake failed")
+		transportLog.Warnf("Handshake failed for %s: %s", host, err)
 		connection.Close()
 		return nil, err
 	}
@@ -98,15 +100,19 @@ func (rt *CustomRoundTripper) RoundTrip(req *http.Request) (*http.Response, erro
 	 * Implement our custom roundtrip logic
 	 * This is the only function that's actually required by the http.RoundTripper interface
 	 */
+	defer roundTripStage.request.ObserveSince(time.Now())
+
 	// New request, fresh context to track requests
 	dialerContext := rt.dialerSession.NewDialerContext(req)
 
 	// Remove additional headers that `removeProxyHeaders` doesn't cover
 	req.Header.Del(ProxyResourceType)
 
+	timer := requestTimerFromContext(req.Context())
+
 	var response *http.Response = nil
 	responseValid := false
-	log.Printf("Requesting %s", req.URL.String())
+	transportLog.Debugf("Requesting %s", req.URL)
 
 	for !responseValid {
 		// Iterate the dialer until we hit on the correct value
@@ -115,18 +121,27 @@ func (rt *CustomRoundTripper) RoundTrip(req *http.Request) (*http.Response, erro
 			return nil, errors.New("Exhausted dialers")
 		}
 
+		attemptStart := time.Now()
+
 		protocol, err := rt.solveProtocol(req, dialerDefinition)
 		if err != nil {
-			log.Printf("Failed to solve protocol for %s: %s", req.URL.Host, err)
+			transportLog.Warnf("Failed to solve protocol for %s: %s", req.URL.Host, err)
+			dialerDefinition.stats.RecordAttempt(attemptStart, true)
 			continue
 		}
 		handler, err := rt.solveTransport(protocol, dialerDefinition)
 		if err != nil {
-			log.Printf("Failed to solve transport for %s: %s", dialerDefinition.identifier, err)
+			transportLog.Warnf("Failed to solve transport for %s: %s", dialerDefinition.identifier, err)
+			dialerDefinition.stats.RecordAttempt(attemptStart, true)
 			continue
 		}
 
-		response, err = handler.RoundTrip(req)
+		tracedRequest := req
+		if timer != nil {
+			tracedRequest = req.WithContext(httptrace.WithClientTrace(req.Context(), timer.ClientTrace()))
+		}
+
+		response, err = handler.RoundTrip(tracedRequest)
 
 		// This should be the return contents for the actual page
 		// Allow 200 messages and 300s (redirects)
@@ -134,8 +149,14 @@ func (rt *CustomRoundTripper) RoundTrip(req *http.Request) (*http.Response, erro
 		if err == nil && response.StatusCode >= 200 && response.StatusCode < 400 {
 			responseValid = true
 		} else {
-			log.Printf("Invalid response for %s", req.URL.String())
+			transportLog.Infof("Invalid response for %s", req.URL)
 		}
+
+		dialerDefinition.stats.RecordAttempt(attemptStart, !responseValid)
+	}
+
+	if timer != nil {
+		timer.TimeBody(response)
 	}
 
 	return response, nil
@@ -150,7 +171,7 @@ func (rt *CustomRoundTripper) solveTransport(
 	rt.handlerLock.RUnlock()
 
 	if ok {
-		log.Println("Cache hit: transport")
+		transportLog.Debugf("Cache hit: transport")
 		return handler, nil
 	}
 
@@ -159,7 +180,7 @@ func (rt *CustomRoundTripper) solveTransport(
 	handler, err = rt.solveTransportNew(protocol, dialerDefinition)
 
 	if err != nil {
-		log.Printf("Unable to solve transport for %s: %s", dialerDefinition.identifier, err)
+		transportLog.Warnf("Unable to solve transport for %s: %s", dialerDefinition.identifier, err)
 		return nil, err
 	}
 
@@ -181,7 +202,7 @@ func (rt *CustomRoundTripper) solveProtocol(request *http.Request, dialerDefinit
 	rt.protocolLock.RUnlock()
 
 	if ok {
-		log.Println("Cache hit: protocol")
+		transportLog.Debugf("Cache hit: protocol")
 		return protocol, nil
 	}
 
@@ -204,19 +225,26 @@ func (rt *CustomRoundTripper) solveTransportNew(
 	protocol int,
 	dialerDefinition *DialerDefinition,
 ) (http.RoundTripper, error) {
-	mainDialer := func(network, addr string) (net.Conn, error) {
+	mainDialer := func(ctx context.Context, network, addr string) (net.Conn, error) {
+		// Transports dial with the context of the request that needed the connection
+		timer := requestTimerFromContext(ctx)
+
 		// Create a new connection with the protocol we know
+		dialStart := time.Now()
 		connection, err := dialerDefinition.Dial(network, addr)
 		if err != nil {
-			log.Printf("Unable to create connection for %s: %s", addr, err)
+			transportLog.Warnf("Unable to create connection for %s: %s", addr, err)
 			return nil, err
 		}
+		timer.Record(TimingDial, dialStart)
 
 		// If we have a TLS connection, we need to perform the handshake and wrap the connection
 		if protocol == ProtocolHTTP1TLS || protocol == ProtocolHTTP2TLS {
+			tlsStart := time.Now()
 			connection, err = wrapConnectionWithTLS(addressToHost(addr), connection)
+			timer.Record(TimingTLS, tlsStart)
 			if err != nil {
-				log.Printf("Unable to wrap connection for %s: %s", addr, err)
+				transportLog.Warnf("Unable to wrap connection for %s: %s", addr, err)
 				return nil, err
 			}
 		}
@@ -225,15 +253,16 @@ func (rt *CustomRoundTripper) solveTransportNew(
 	}
 
 	mainDialerHTTP2 := func(network, addr string, cfg *tls.Config) (net.Conn, error) {
-		return mainDialer(network, addr)
+		// The http2 transport doesn't pass along a request context
+		return mainDialer(context.Background(), network, addr)
 	}
 
 	var transport http.RoundTripper
 
 	if protocol == ProtocolHTTP1 {
-		transport = &http.Transport{Dial: mainDialer}
+		transport = &http.Transport{DialContext: mainDialer}
 	} else if protocol == ProtocolHTTP1TLS {
-		transport = &http.Transport{DialTLS: mainDialer}
+		transport = &http.Transport{DialTLSContext: mainDialer}
 	} else if protocol == ProtocolHTTP2TLS {
 		transport = &http2.Transport{DialTLS: mainDialerHTTP2}
 	}
@@ -256,7 +285,7 @@ func (rt *CustomRoundTripper) solveProtocolNew(request *http.Request, dialerDefi
 
 	// If the request is "http" assume we're using HTTP/1.1 since HTTP/2 is only supported over TLS
 	if strings.ToLower(request.URL.Scheme) == "http" {
-		log.Printf("Using HTTP/1.1 for %s", request.URL.Host)
+		transportLog.Debugf("Using HTTP/1.1 for %s", request.URL.Host)
 		return ProtocolHTTP1, nil
 	}
 
@@ -270,10 +299,10 @@ func (rt *CustomRoundTripper) solveProtocolNew(request *http.Request, dialerDefi
 	if connection.ConnectionState().HandshakeComplete {
 		// Check if we have a HTTP2 connection
 		if connection.ConnectionState().NegotiatedProtocol == http2.NextProtoTLS {
-			log.Printf("Using HTTP/2TLS for %s", request.URL.Host)
+			transportLog.Debugf("Using HTTP/2TLS for %s", request.URL.Host)
 			return ProtocolHTTP2TLS, nil
 		} else {
-			log.Printf("Using HTTP/1TLS for %s", request.URL.Host)
+			transportLog.Debugf("Using HTTP/1TLS for %s", request.URL.Host)
 			return ProtocolHTTP1TLS, nil
 		}
 	}
@@ -33,6 +33,20 @@ func contains[T comparable](s []T, e T) bool {
 	return false
 }
 
+func minInt(a int, b int) int {
+	if a < b {
+		return a
+	}
+	return b
+}
+
+func maxInt(a int, b int) int {
+	if a > b {
+		return a
+	}
+	return b
+}
+
 func getRedirectHistory(response *http.Response) ([]*http.Request, []*http.Response) {
 	// The eventually resolved response payload carries alongside all of the request
 	// history - this function reassembles it
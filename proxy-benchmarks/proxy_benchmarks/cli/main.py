@@ -3,6 +3,7 @@ from rich.console import Console
 
 from proxy_benchmarks.cli.fingerprinting import fingerprint
 from proxy_benchmarks.cli.load import load_test
+from proxy_benchmarks.cli.page_load import page_load
 from proxy_benchmarks.cli.speed import speed_test
 from proxy_benchmarks.cli.ssl_validity import basic_ssl_test
 
@@ -19,5 +20,6 @@ def main(ctx):
 
 main.add_command(fingerprint)
 main.add_command(load_test)
+main.add_command(page_load)
 main.add_command(speed_test)
 main.add_command(basic_ssl_test)
@@ -0,0 +1,132 @@
+from json import dump
+from pathlib import Path
+from time import time
+
+import pandas as pd
+from click import (
+    Choice,
+    Path as ClickPath,
+    group,
+    option,
+    pass_obj,
+)
+from playwright.sync_api import sync_playwright
+from tqdm import tqdm
+
+from proxy_benchmarks.load_test import run_load_server
+from proxy_benchmarks.networking import SyntheticHostDefinition, SyntheticHosts
+from proxy_benchmarks.proxies.base import ProxyBase
+from proxy_benchmarks.proxies.groove import GrooveProxy
+
+
+@group()
+def page_load():
+    pass
+
+
+@page_load.command()
+@option("--samples", type=int, default=10)
+@option("--resources", type=int, default=30)
+@option("--data-path", type=ClickPath(dir_okay=True, file_okay=False), required=True)
+@option("--profile", type=Choice(["mutex", "block", "heap", "allocs"]), default=None, help="Save this groove profile for each run")
+@pass_obj
+def execute(obj, samples, resources, data_path, profile):
+    """
+    Benchmark browser page loads that fan out to many concurrent subresources.
+
+    Chromium only opens a handful of HTTP/1.1 connections to a proxy, so subresources queue
+    behind one another. Over the groove TLS listener they can be multiplexed with HTTP/2.
+
+    """
+    proxies: list[ProxyBase] = [
+        GrooveProxy(tls=False, profiling=profile is not None),
+        GrooveProxy(tls=True, profiling=profile is not None),
+    ]
+
+    execute_raw(obj, samples, resources, data_path, proxies, profile=profile)
+
+
+def execute_raw(
+    obj,
+    samples: int,
+    resources: int,
+    data_path: str | Path,
+    proxies: list[ProxyBase],
+    profile: str | None = None,
+):
+    console = obj["console"]
+    divider = obj["divider"]
+
+    data_path = Path(data_path).expanduser()
+    data_path.mkdir(exist_ok=True)
+
+    proxy_samples = []
+
+    with run_load_server() as load_server_definition:
+        synthetic_ip_addresses = SyntheticHosts(
+            [
+                SyntheticHostDefinition(
+                    name="load-server",
+                    http_port=load_server_definition["http"],
+                    https_port=load_server_definition["https"],
+                )
+            ]
+        ).configure()
+        synthetic_ip_address = next(iter(synthetic_ip_addresses.values()))
+
+        for proxy in proxies:
+            console.print(f"{divider}\nWill perform page load test with {proxy}...\n{divider}", style="bold blue")
+
+            with proxy.launch():
+                with sync_playwright() as p:
+                    browser = p.chromium.launch(
+                        headless=True,
+                        proxy={
+                            "server": proxy.proxy_url,
+                        },
+                    )
+
+                    for protocol in ["http", "https"]:
+                        for sample in tqdm(range(samples)):
+                            # Fresh context so nothing is served from the browser cache
+                            context = browser.new_context()
+                            page = context.new_page()
+
+                            content = "".join(
+                                f"<img src='{protocol}://{synthetic_ip_address}/handle?sample={sample}&resource={resource}' />"
+                                for resource in range(resources)
+                            )
+
+                            start_time = time()
+                            page.set_content(f"<html><body>{content}</body></html>", wait_until="load")
+                            load_time = time() - start_time
+
+                            proxy_samples.append(
+                                dict(
+                                    proxy=proxy.short_name,
+                                    protocol=protocol,
+                                    resources=resources,
+                                    load_time=load_time,
+                                )
+                            )
+                            context.close()
+
+                    browser.close()
+
+                if profile is not None and isinstance(proxy, GrooveProxy):
+                    proxy.save_profile(profile, data_path / f"{proxy.short_name}-{profile}.pprof")
+
+    with open(data_path / "raw.json", "w") as file:
+        dump(proxy_samples, file)
+
+
+@page_load.command()
+@option("--data-path", type=ClickPath(dir_okay=True, file_okay=False), required=True)
+def analyze(data_path):
+    data_path = Path(data_path).expanduser()
+
+    df = pd.read_json(data_path / "raw.json")
+
+    distribution_df = df.groupby(["proxy", "protocol"])["load_time"].describe().reset_index()
+    print(distribution_df)
+    distribution_df.to_csv("results_page_load.csv")
@@ -40,6 +40,13 @@ class ProxyBase(ABC):
         if timeout == 0:
             raise TimeoutError("Timed out waiting for proxy to close")
 
+    @property
+    def proxy_url(self) -> str:
+        """
+        Address that clients should use to connect to the proxy.
+        """
+        return f"http://localhost:{self.port}"
+
     @property
     @abstractmethod
     def certificate_authority(self) -> CertificateAuthority:
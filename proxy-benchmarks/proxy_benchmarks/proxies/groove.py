@@ -0,0 +1,83 @@
+from contextlib import contextmanager
+from pathlib import Path
+from subprocess import Popen
+from time import sleep
+
+import requests
+
+from proxy_benchmarks.process import terminate_all
+from proxy_benchmarks.proxies.base import CertificateAuthority, ProxyBase
+
+
+class GrooveProxy(ProxyBase):
+    """
+    Groove from this repository. Expects the `grooveproxy` executable to be on the path,
+    which `groove/setup.sh` takes care of through `go install`.
+
+    """
+    def __init__(self, tls: bool = False, profiling: bool = False):
+        """
+        :param tls: Connect to the TLS listener, which allows clients to multiplex requests
+            to the proxy over HTTP/2. The plain http listener is still launched alongside.
+        :param profiling: Launch with the pprof endpoints and contention sampling enabled,
+            so `save_profile` can capture where the proxy spent its time during a run.
+
+        """
+        super().__init__(port=6017)
+        self.tls = tls
+        self.tls_port = 6018
+        self.control_port = 6019
+        self.profiling = profiling
+
+    @contextmanager
+    def launch(self):
+        process = Popen(
+            [
+                "grooveproxy",
+                "--port", str(self.port),
+                "--control-port", str(self.control_port),
+                "--tls-port", str(self.tls_port),
+                *(["--profiling=true"] if self.profiling else []),
+            ]
+        )
+
+        self.wait_for_launch()
+        sleep(1)
+
+        try:
+            yield process
+        finally:
+            terminate_all(process)
+
+            # Wait for the socket to close
+            self.wait_for_close()
+
+    def save_profile(self, kind: str, output_path: Path):
+        """
+        Save a cumulative profile (mutex, block, heap, allocs) of the running proxy. Since the
+        proxy is relaunched for every benchmark, this covers exactly one run.
+
+        """
+        response = requests.get(f"http://localhost:{self.control_port}/debug/pprof/{kind}")
+        response.raise_for_status()
+        output_path.write_bytes(response.content)
+
+    @property
+    def proxy_url(self) -> str:
+        if self.tls:
+            return f"https://localhost:{self.tls_port}"
+        return super().proxy_url
+
+    @property
+    def certificate_authority(self) -> CertificateAuthority:
+        return CertificateAuthority(
+            public=Path("~/.grooveproxy/ca.crt").expanduser(),
+            key=Path("~/.grooveproxy/ca.key").expanduser(),
+        )
+
+    @property
+    def short_name(self) -> str:
+        return "groove-tls" if self.tls else "groove"
+
+    def __repr__(self) -> str:
+        return f"GrooveProxy(port={self.port},tls={self.tls})"
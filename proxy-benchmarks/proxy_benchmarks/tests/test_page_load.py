@@ -0,0 +1,30 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from proxy_benchmarks.cli.page_load import execute_raw
+from proxy_benchmarks.proxies.groove import GrooveProxy
+
+
+@pytest.mark.page_load
+@pytest.mark.parametrize(
+    "proxy",
+    [
+        GrooveProxy(tls=False),
+        GrooveProxy(tls=True),
+    ],
+)
+def test_page_load_simple(cli_object, proxy):
+    with TemporaryDirectory() as directory:
+        directory = Path(directory)
+
+        execute_raw(
+            cli_object,
+            samples=2,
+            resources=10,
+            data_path=directory,
+            proxies=[proxy],
+        )
+
+        assert (directory / "raw.json").exists()